@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compare the csv based label read/write path with libs.label_io
+and check both produce byte-identical files.
+
+    python -m benchmarks.bench_label_io [lines] [repeat]
+"""
+
+import csv
+import io
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+from libs.label_io import formatLabels, readLabels
+from libs.samples import SampleGrouper, SampleObject
+
+
+CATEGORIES = {i: 'class_%s' % i for i in range(80)}
+RATIO = (1920, 1080)
+
+
+def makeLabelFile(path, lines, seed=0):
+    rnd = random.Random(seed)
+    with open(path, 'w') as f:
+        for _ in range(lines):
+            f.write('%s %s %s %s %s\n' % (
+                rnd.randrange(len(CATEGORIES)),
+                *(round(rnd.random(), rnd.randint(1, 8)) for _ in range(4))
+            ))
+
+
+def csvRead(path):
+    grouper = SampleGrouper(CATEGORIES)
+    with open(path, 'r') as f:
+        obj_datas = csv.reader(f, delimiter=' ', dialect='skip_space')
+        for line_number, obj_data in enumerate(obj_datas):
+            sample = SampleObject(ratio=RATIO)
+            sample.addYoloCfg(line_number, obj_data, categories=CATEGORIES)
+            grouper.addSample(sample)
+    return grouper
+
+
+def csvWrite(grouper):
+    file = io.StringIO()
+    groups = grouper.prepareSamplesToSave()
+    for group_idx in sorted(groups):
+        for sample in groups[group_idx]:
+            if sample.isDeleted():
+                continue
+            writer = csv.writer(file, delimiter=' ', dialect='skip_space')
+            writer.writerow(sample.getYoloFormat())
+    return file.getvalue()
+
+
+def arrayRead(path):
+    grouper = SampleGrouper(CATEGORIES)
+    grouper.addYoloRows(readLabels(path), ratio=RATIO)
+    return grouper
+
+
+def arrayWrite(grouper):
+    return formatLabels(grouper.getYoloRows())
+
+
+def main(lines=10000, repeat=5):
+    csv.register_dialect('skip_space', skipinitialspace=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'labels.txt')
+        makeLabelFile(path, lines)
+
+        # Read -> write -> read -> write with both paths
+        for step in ('write', 'rewrite'):
+            csv_out = csvWrite(csvRead(path))
+            array_out = arrayWrite(arrayRead(path))
+            if csv_out != array_out:
+                print("FAIL: %s output differs from the csv path" % step)
+                return 1
+            with open(path, 'w', newline='') as f:
+                f.write(array_out)
+        print("Round trip OK (%s lines)" % lines)
+
+        csv_grouper = csvRead(path)
+        array_grouper = arrayRead(path)
+        for name, stmt in (
+            ('read  csv', lambda: csvRead(path)),
+            ('read  array', lambda: arrayRead(path)),
+            ('write csv', lambda: csvWrite(csv_grouper)),
+            ('write array', lambda: arrayWrite(array_grouper)),
+        ):
+            best = min(timeit.repeat(stmt, number=1, repeat=repeat))
+            print('%-12s %8.2f ms' % (name, best * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:]]))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compare SampleGrouper point / rectangle queries through the
+spatial index with a linear scan over the samples.
+
+    python -m benchmarks.bench_spatial_index [boxes] [queries]
+"""
+
+import sys
+import timeit
+
+import numpy as np
+
+from libs.samples import SampleGrouper
+
+
+CATEGORIES = {i: 'class_%s' % i for i in range(80)}
+RATIO = (1920, 1080)
+
+
+def makeGrouper(boxes, seed=0):
+    rnd = np.random.RandomState(seed)
+    rows = np.column_stack((
+        rnd.randint(0, len(CATEGORIES), boxes),
+        rnd.uniform(0.05, 0.95, boxes),
+        rnd.uniform(0.05, 0.95, boxes),
+        rnd.uniform(0.005, 0.05, boxes),
+        rnd.uniform(0.005, 0.05, boxes),
+    ))
+    grouper = SampleGrouper(CATEGORIES)
+    grouper.addYoloRows(rows, ratio=RATIO)
+    return grouper
+
+
+def linearAt(samples, x, y):
+    return [
+        sample for sample in samples
+        if sample.lx <= x <= sample.rx and sample.ly <= y <= sample.ry
+    ]
+
+
+def linearIn(samples, lx, ly, rx, ry):
+    return [
+        sample for sample in samples
+        if sample.lx <= rx and sample.rx >= lx and
+        sample.ly <= ry and sample.ry >= ly
+    ]
+
+
+def main(boxes=5000, queries=200):
+    grouper = makeGrouper(boxes)
+    samples = grouper.samples
+    rnd = np.random.RandomState(1)
+    points = np.column_stack((
+        rnd.uniform(0, RATIO[0], queries), rnd.uniform(0, RATIO[1], queries)
+    )).tolist()
+    rects = [(x, y, x + 100, y + 100) for x, y in points]
+
+    # Same answers as the linear scan
+    for x, y in points:
+        expected = {sample._row for sample in linearAt(samples, x, y)}
+        if set(grouper.rowsAt(x, y).tolist()) != expected:
+            print("FAIL: point query differs at %s, %s" % (x, y))
+            return 1
+    for rect in rects:
+        expected = {sample._row for sample in linearIn(samples, *rect)}
+        if set(grouper.rowsIn(*rect).tolist()) != expected:
+            print("FAIL: rect query differs at %s" % str(rect))
+            return 1
+
+    build = min(timeit.repeat(
+        lambda: makeGrouper(boxes).spatialIndex(), number=1, repeat=3
+    ))
+    print('%s boxes, index build %.2f ms' % (boxes, build * 1000))
+    for name, stmt in (
+        ('point linear', lambda: [linearAt(samples, *p) for p in points]),
+        ('point index', lambda: [grouper.rowsAt(*p) for p in points]),
+        ('rect  linear', lambda: [linearIn(samples, *r) for r in rects]),
+        ('rect  index', lambda: [grouper.rowsIn(*r) for r in rects]),
+    ):
+        best = min(timeit.repeat(stmt, number=1, repeat=5))
+        print('%-13s %8.3f ms/query' % (name, best * 1000 / queries))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:]]))
@@ -0,0 +1,548 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of the load, render and save paths on a synthetic
+dataset generated with fixed seeds. Results are written as JSON
+so runs can be compared over time.
+
+    python -m benchmarks.suite -o results.json
+    python -m benchmarks.suite --quick --compare results.json
+
+Qt runs with the offscreen platform unless QT_QPA_PLATFORM is set.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PyQt5.QtCore import QT_VERSION_STR
+from PyQt5.QtGui import QColor, QImage, QPixmap
+from PyQt5.QtWidgets import QApplication
+
+from libs.batch import findImageLabels
+from libs.dataset_index import DatasetIndex, indexPath
+from libs.label_io import formatLabels, readLabels
+from libs.samples import SampleGrouper, SampleObject
+from libs.session import saveSession, sessionPath
+from libs.validation import checkRows
+from widgets.image_widget import ImageWidget
+
+
+CATEGORIES = {i: 'class_%s' % i for i in range(80)}
+BOX_COUNTS = (0, 10, 100, 1000, 10000)
+RESOLUTIONS = ((640, 480), (1920, 1080), (4000, 3000))
+QUICK_BOX_COUNTS = (0, 100, 1000)
+QUICK_RESOLUTIONS = ((640, 480), (1920, 1080))
+# Launch to the restored image on screen
+FIRST_IMAGE_TARGET_MS = 1000
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def makeRows(boxes, seed=0):
+    rnd = np.random.RandomState(seed)
+    return np.column_stack((
+        rnd.randint(0, len(CATEGORIES), boxes),
+        rnd.uniform(0.05, 0.95, boxes),
+        rnd.uniform(0.05, 0.95, boxes),
+        rnd.uniform(0.005, 0.1, boxes),
+        rnd.uniform(0.005, 0.1, boxes),
+    )).reshape(-1, 5)
+
+
+def makeImage(path, width, height, seed=0):
+    rnd = np.random.RandomState(seed)
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(QColor(*rnd.randint(0, 256, 3).tolist()))
+    image.save(path)
+    return path
+
+
+def sourcePath(directory, width, height):
+    return os.path.join(directory, 'source_%sx%s.jpg' % (width, height))
+
+
+def makeDataset(directory, sources, images, box_counts, resolutions):
+    """
+    images image / label pairs cycling through the box counts
+    and resolutions, in a few subdirectories. The images are
+    copies of a source image per resolution
+    """
+    os.makedirs(sources, exist_ok=True)
+    for i in range(images):
+        subdirectory = os.path.join(directory, 'part%s' % (i % 4))
+        os.makedirs(subdirectory, exist_ok=True)
+        width, height = resolutions[i % len(resolutions)]
+        source = sourcePath(sources, width, height)
+        if not os.path.exists(source):
+            makeImage(source, width, height, seed=i)
+        path = os.path.join(subdirectory, 'img%06d' % i)
+        with open(source, 'rb') as src, open(path + '.jpg', 'wb') as dst:
+            dst.write(src.read())
+        boxes = box_counts[i % len(box_counts)]
+        with open(path + '.txt', 'w', newline='') as f:
+            f.write(formatLabels(makeRows(boxes, seed=i)))
+    return directory
+
+
+def makeGrouper(rows, ratio):
+    grouper = SampleGrouper(CATEGORIES)
+    grouper.addYoloRows(rows, ratio=ratio)
+    return grouper
+
+
+def makeSamples(rows, ratio):
+    """
+    Grouper built sample by sample, as the csv reader did
+    """
+    grouper = SampleGrouper(CATEGORIES)
+    for line_number, row in enumerate(rows.tolist()):
+        sample = SampleObject(ratio=ratio)
+        sample.addYoloCfg(
+            line_number, [int(row[0])] + row[1:], categories=CATEGORIES
+        )
+        grouper.addSample(sample)
+    return grouper
+
+
+def serializeSamples(grouper):
+    return [
+        sample.getYoloFormat()
+        for samples in grouper.prepareSamplesToSave().values()
+        for sample in samples if not sample.isDeleted()
+    ]
+
+
+def drawOverlay(widget, grouper, width, height):
+    widget.pixmapOriginal = QPixmap(width, height)
+    widget.grouper = grouper
+    return widget.drawSamplesBox()
+
+
+def scanDataset(directory, db_path):
+    index = DatasetIndex(db_path)
+    try:
+        return sum(len(entries)
+                   for entries in index.scan(directory, recursive=True))
+    finally:
+        index.close()
+
+
+class Suite(object):
+
+    """
+    Run benchmark cases and collect their timings
+    """
+
+    def __init__(self, repeat=5, verbose=True):
+        self.repeat = repeat
+        self.verbose = verbose
+        self.results = []
+
+    def run(self, name, fn, repeat=None, **params):
+        timings = timeit.repeat(fn, number=1, repeat=repeat or self.repeat)
+        return self.record(name, timings, **params)
+
+    def record(self, name, timings, **params):
+        """
+        Add a case timed by the caller (timings in seconds)
+        """
+        result = {
+            'name': name,
+            'params': params,
+            'repeat': len(timings),
+            'min_ms': min(timings) * 1000,
+            'median_ms': statistics.median(timings) * 1000,
+            'mean_ms': statistics.mean(timings) * 1000,
+        }
+        self.results.append(result)
+        if self.verbose:
+            print('%-28s %-32s %10.3f ms' % (
+                name, ' '.join('%s=%s' % item for item in params.items()),
+                result['min_ms'],
+            ))
+        return result
+
+
+def runSamples(suite, box_counts):
+    ratio = (1920, 1080)
+    for boxes in box_counts:
+        rows = makeRows(boxes)
+        # The per sample paths are too slow to repeat on large files
+        repeat = 1 if boxes > 1000 else None
+        suite.run('grouper.addYoloRows', lambda: makeGrouper(rows, ratio),
+                  boxes=boxes)
+        suite.run('SampleObject.addYoloCfg',
+                  lambda: makeSamples(rows, ratio),
+                  repeat=repeat, boxes=boxes)
+        grouper = makeGrouper(rows, ratio)
+        suite.run('getSamplesGrouped', lambda: grouper.getSamplesGrouped(),
+                  repeat=repeat, boxes=boxes)
+        suite.run('prepareSamplesToSave',
+                  lambda: grouper.prepareSamplesToSave(),
+                  repeat=repeat, boxes=boxes)
+        suite.run('getYoloFormat', lambda: serializeSamples(grouper),
+                  repeat=repeat, boxes=boxes)
+        suite.run('formatLabels',
+                  lambda: formatLabels(grouper.getYoloRows()),
+                  boxes=boxes)
+        suite.run('checkRows', lambda: checkRows(rows, CATEGORIES),
+                  boxes=boxes)
+    return True
+
+
+def runRender(suite, box_counts, resolutions):
+    widget = ImageWidget(None)
+    for width, height in resolutions:
+        for boxes in box_counts:
+            grouper = makeGrouper(makeRows(boxes), (width, height))
+            suite.run(
+                'drawSamplesBox',
+                lambda: drawOverlay(widget, grouper, width, height),
+                boxes=boxes, resolution='%sx%s' % (width, height),
+            )
+    return True
+
+
+def runFiles(suite, tmp, box_counts, resolutions, images):
+    directory = os.path.join(tmp, 'dataset')
+    sources = os.path.join(tmp, 'sources')
+    makeDataset(directory, sources, images, box_counts, resolutions)
+    labels = [
+        label for _, label in findImageLabels([directory], recursive=True)
+    ]
+    suite.run('readLabels', lambda: [readLabels(path) for path in labels],
+              files=len(labels))
+    for width, height in resolutions:
+        source = sourcePath(sources, width, height)
+        suite.run('decodeImage',
+                  lambda: ImageWidget.decodeImage(source, 864),
+                  resolution='%sx%s' % (width, height))
+    suite.run(
+        'findImageLabels',
+        lambda: sum(1 for _ in findImageLabels([directory], recursive=True)),
+        images=images,
+    )
+    db_path = os.path.join(tmp, 'index.sqlite')
+
+    def cold():
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        return scanDataset(directory, db_path)
+
+    suite.run('DatasetIndex.scan cold', cold, images=images)
+    suite.run('DatasetIndex.scan warm',
+              lambda: scanDataset(directory, db_path), images=images)
+    return True
+
+
+def makeVideo(path, frames, width, height):
+    import cv2
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 25,
+                             (width, height))
+    rnd = np.random.RandomState(0)
+    background = rnd.randint(0, 256, (height, width, 3)).astype(np.uint8)
+    try:
+        for i in range(frames):
+            writer.write(np.roll(background, i * 4, axis=1))
+    finally:
+        writer.release()
+    return path
+
+
+def runVideo(suite, tmp, frames, resolutions):
+    """
+    Frame index build and frame reads: the next frame, one frame
+    back and random jumps
+    """
+    from libs.video import FrameReader, indexVideo
+    rnd = np.random.RandomState(0)
+    for width, height in resolutions:
+        resolution = '%sx%s' % (width, height)
+        path = makeVideo(os.path.join(tmp, 'video_%s.mp4' % resolution),
+                         frames, width, height)
+        suite.run('indexVideo', lambda: indexVideo(path), frames=frames,
+                  resolution=resolution)
+        index = indexVideo(path)
+        reader = FrameReader(path, index)
+        # Without kept frames every jump seeks
+        seeking = FrameReader(path, index, cached_frames=1)
+        state = {'frame': 0}
+
+        def step(offset, reader=reader):
+            state['frame'] = (state['frame'] + offset) % frames
+            return reader.read(state['frame'])
+
+        suite.run('FrameReader next', lambda: step(1), repeat=50,
+                  resolution=resolution)
+        suite.run('FrameReader back', lambda: step(-1), repeat=50,
+                  resolution=resolution)
+        suite.run('FrameReader jump',
+                  lambda: step(frames // 3 + int(rnd.randint(frames // 3)),
+                               seeking),
+                  repeat=50, resolution=resolution)
+        reader.close()
+        seeking.close()
+    return True
+
+
+def runPropagation(suite, box_counts, resolutions):
+    """
+    Tracking image preparation and box propagation to an image
+    shifted and zoomed a little, as the next frame of a video
+    """
+    import cv2
+    from libs.propagation import propagateBoxes, trackingImage
+    rnd = np.random.RandomState(0)
+    for width, height in resolutions:
+        resolution = '%sx%s' % (width, height)
+        image = cv2.GaussianBlur(
+            rnd.randint(0, 256, (height, width, 3)).astype(np.uint8),
+            (9, 9), 0
+        )
+        moved = cv2.warpAffine(
+            image, np.float32([[1.02, 0, -width * 0.01],
+                               [0, 1.02, -height * 0.01]]),
+            (width, height)
+        )
+        suite.run('trackingImage', lambda: trackingImage(image),
+                  resolution=resolution)
+        previous, current = trackingImage(image), trackingImage(moved)
+        for boxes in box_counts:
+            if not boxes or boxes > 1000:
+                continue
+            rows = makeRows(boxes)
+            suite.run('propagateBoxes',
+                      lambda: propagateBoxes(rows, previous, current),
+                      boxes=boxes, resolution=resolution)
+    return True
+
+
+def makeShards(directory, dataset):
+    """
+    Uncompressed tar and zip of the files of dataset
+    """
+    import tarfile
+    import zipfile
+    tar_path = os.path.join(directory, 'dataset.tar')
+    zip_path = os.path.join(directory, 'dataset.zip')
+    with tarfile.open(tar_path, 'w') as tar, \
+            zipfile.ZipFile(zip_path, 'w') as zip_file:
+        for root, _, names in sorted(os.walk(dataset)):
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                name = os.path.relpath(path, dataset).replace(os.sep, '/')
+                tar.add(path, arcname=name)
+                zip_file.write(path, name)
+    return tar_path, zip_path
+
+
+def runShards(suite, tmp, box_counts, resolutions, images):
+    """
+    Shard index build and load, and image / label reads from the
+    shards compared to the same files on disk
+    """
+    from libs.dataset_index import memberLabelPath, memberPath
+    from libs.shards import ShardIndexStore, ShardReader, indexShard
+    dataset = makeDataset(os.path.join(tmp, 'dataset'),
+                          os.path.join(tmp, 'sources'), images, box_counts,
+                          resolutions)
+    files = list(findImageLabels([dataset], recursive=True))
+    for shard_path in makeShards(tmp, dataset):
+        kind = os.path.splitext(shard_path)[1][1:]
+        suite.run('indexShard', lambda: indexShard(shard_path),
+                  kind=kind, images=images)
+        store = ShardIndexStore(os.path.join(tmp, 'shards.sqlite'))
+        store.index(shard_path)
+        suite.run('ShardIndexStore.get', lambda: store.get(shard_path),
+                  kind=kind, images=images)
+        store.close()
+        index = indexShard(shard_path)
+        reader = ShardReader(shard_path, index)
+        names = [name for name in index.names if name.endswith('.jpg')]
+        suite.run('ShardReader.read', lambda: [
+            reader.read(name) for name in names[:100]
+        ], kind=kind, images=100)
+        reader.close()
+        members = [memberPath(shard_path, name) for name in names[:100]]
+        suite.run('decodeImage', lambda: [
+            ImageWidget.decodeImage(path, 1080) for path in members
+        ], source=kind, images=100)
+        labels = [memberLabelPath(shard_path, name) for name in names[:100]]
+        suite.run('readLabels', lambda: [readLabels(path) for path in labels],
+                  source=kind, files=100)
+    suite.run('decodeImage', lambda: [
+        ImageWidget.decodeImage(path, 1080) for path, _ in files[:100]
+    ], source='files', images=100)
+    suite.run('readLabels', lambda: [
+        readLabels(path) for _, path in files[:100]
+    ], source='files', files=100)
+    return True
+
+
+def firstImageTime(settings_path):
+    """
+    Seconds from the launch of the app to the restored image
+    on screen, as it measures it
+    """
+    output = subprocess.check_output(
+        [sys.executable, 'main.py', '--settings', settings_path,
+         '--first-image'],
+        cwd=ROOT, stderr=subprocess.DEVNULL,
+    ).decode('utf8')
+    found = re.search(r'First image: ([0-9.]+) ms', output)
+    if found is None:
+        raise Exception("No first image time in:\n%s" % output)
+    return float(found.group(1)) / 1000
+
+
+def runStartup(suite, tmp, box_counts, resolutions, images):
+    """
+    Time to the first image of a restored session, the dataset
+    scanned and its session saved beforehand
+    """
+    directory = os.path.join(tmp, 'dataset')
+    cache_dir = os.path.join(tmp, 'cache')
+    makeDataset(directory, os.path.join(tmp, 'sources'), images,
+                box_counts, resolutions)
+    names_path = os.path.join(tmp, 'obj.names')
+    with open(names_path, 'w', encoding='utf8') as f:
+        f.write('\n'.join(CATEGORIES.values()) + '\n')
+    settings_path = os.path.join(tmp, 'settings.json')
+    with open(settings_path, 'w', encoding='utf8') as f:
+        json.dump({'cache_dir': cache_dir, 'scan_recursive': True}, f)
+    scanDataset(directory, indexPath(cache_dir, directory, True))
+    image_index = images // 2
+    image = os.path.join(directory, 'part%s' % (image_index % 4),
+                         'img%06d.jpg' % image_index)
+    saveSession(sessionPath(cache_dir), directory, names_path, image,
+                image_index)
+    timings = [firstImageTime(settings_path) for _ in range(suite.repeat)]
+    result = suite.record('first image', timings, images=images)
+    result['target_ms'] = FIRST_IMAGE_TARGET_MS
+    if result['median_ms'] > FIRST_IMAGE_TARGET_MS:
+        print('first image: median %.0f ms over the %s ms target' % (
+            result['median_ms'], FIRST_IMAGE_TARGET_MS
+        ))
+    return True
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': gitRevision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'qt': QT_VERSION_STR,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(results, path):
+    """
+    Print the min time ratio of every case found in a previous run
+    """
+    with open(path, 'r', encoding='utf8') as f:
+        previous = json.load(f)
+    def key(result):
+        return result['name'], json.dumps(result['params'], sort_keys=True)
+
+    before = {key(result): result for result in previous['results']}
+    print('\nCompared with %s (%s)' % (
+        path, previous['environment'].get('revision')
+    ))
+    for result in results:
+        old = before.get(key(result))
+        if old is None or not old['min_ms']:
+            continue
+        print('%-28s %-32s %6.2fx' % (
+            result['name'],
+            ' '.join('%s=%s' % item for item in result['params'].items()),
+            result['min_ms'] / old['min_ms'],
+        ))
+    return True
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the load, render and save paths"
+    )
+    parser.add_argument('-o', '--output', help="write the results (JSON)")
+    parser.add_argument(
+        '--compare', help="results (JSON) of a previous run to compare to")
+    parser.add_argument(
+        '--quick', action='store_true', help="smaller cases, fewer repeats")
+    parser.add_argument('--repeat', type=int, help="runs of each case")
+    parser.add_argument(
+        '--images', type=int, help="images of the synthetic dataset")
+    parser.add_argument(
+        '--only', action='append', default=[],
+        choices=('samples', 'render', 'files', 'startup', 'video',
+                 'shards', 'propagation'),
+        help="run only these groups")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    box_counts = QUICK_BOX_COUNTS if args.quick else BOX_COUNTS
+    resolutions = QUICK_RESOLUTIONS if args.quick else RESOLUTIONS
+    images = args.images or (200 if args.quick else 2000)
+    suite = Suite(repeat=args.repeat or (3 if args.quick else 5))
+    groups = args.only or ['samples', 'render', 'files', 'startup',
+                           'video', 'shards', 'propagation']
+    if 'samples' in groups:
+        runSamples(suite, box_counts)
+    if 'render' in groups:
+        runRender(suite, box_counts, resolutions)
+    if 'files' in groups:
+        with tempfile.TemporaryDirectory() as directory:
+            runFiles(suite, directory, box_counts, resolutions, images)
+    if 'startup' in groups:
+        with tempfile.TemporaryDirectory() as directory:
+            runStartup(suite, directory, box_counts, resolutions, images)
+    if 'video' in groups:
+        with tempfile.TemporaryDirectory() as directory:
+            runVideo(suite, directory, 250 if args.quick else 1000,
+                     resolutions)
+    if 'shards' in groups:
+        with tempfile.TemporaryDirectory() as directory:
+            runShards(suite, directory, box_counts, resolutions, images)
+    if 'propagation' in groups:
+        runPropagation(suite, box_counts, resolutions)
+    report = {'environment': environment(), 'results': suite.results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        compare(suite.results, args.compare)
+    del app
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
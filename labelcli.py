@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+"""
+Bulk operations on yolo label files without the GUI.
+
+    python labelcli.py validate images/ --names obj.names
+    python labelcli.py check images/ --names obj.names --iou 0.8
+    python labelcli.py remap images/ --map 3:5 --map 4:5
+    python labelcli.py delete images/ --class 2
+    python labelcli.py filter images/ --class 0 --class 1
+    python labelcli.py export images/ --format coco -o train.json \
+        --names obj.names
+    python labelcli.py import train.json --format coco --root images/ \
+        --names obj.names --verify
+
+Directories are searched for the label files of their images
+(-r to include subdirectories). Files are processed on a pool
+of processes (-j) and written only when their boxes change.
+validate stops at the first error of a file; check reports every
+invalid line, box without area or outside the image, duplicate
+box (same class, IoU of at least --iou) and unknown class.
+Exports are COCO JSON, Pascal VOC annotations (a directory) or
+a packed binary file; import writes them back as label files
+under --root, or compares them with the label files (--verify).
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from libs.batch import Operation, BatchReport, findImageLabels
+from libs.batch import findLabelFiles, runBatch
+from libs.export import FORMATS, ExportReport, exportDataset, importLabels
+from libs.export import importedLabelPath, sameRows
+from libs.label_io import formatLabels, readLabels, readObjNames
+from libs.label_writer import writeAtomic
+from libs.validation import DUPLICATE_IOU, checkDataset
+
+
+def parseMapping(values):
+    remap = {}
+    for value in values:
+        try:
+            old, new = value.split(':')
+            remap[int(old)] = int(new)
+        except ValueError:
+            raise Exception("Invalid mapping %s, expected old:new" % value)
+    return remap
+
+
+def buildOperation(args, categories):
+    if args.command == 'remap':
+        if not args.map:
+            raise Exception("remap needs at least one --map old:new")
+        return Operation(remap=parseMapping(args.map), categories=categories)
+    if args.command == 'delete':
+        if not args.classes:
+            raise Exception("delete needs at least one --class")
+        return Operation(drop=args.classes, categories=categories)
+    if args.command == 'filter':
+        if not args.classes:
+            raise Exception("filter needs at least one --class")
+        return Operation(keep=args.classes, categories=categories)
+    return Operation(categories=categories)
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(
+        description="Bulk operations on yolo label files"
+    )
+    parser.add_argument(
+        'command', choices=(
+            'validate', 'check', 'remap', 'delete', 'filter', 'export',
+            'import',
+        ))
+    parser.add_argument(
+        'paths', nargs='+',
+        help="label files or image directories, the export to import")
+    parser.add_argument(
+        '--names', help="obj.names file, check boxes categories exist")
+    parser.add_argument(
+        '--map', action='append', default=[], help="old:new class index")
+    parser.add_argument(
+        '--class', dest='classes', action='append', type=int, default=[],
+        help="class index to delete (delete) or to keep (filter)")
+    parser.add_argument(
+        '-r', '--recursive', action='store_true',
+        help="search subdirectories")
+    parser.add_argument(
+        '-n', '--dry-run', action='store_true',
+        help="report the changes without writing")
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count(),
+        help="worker processes")
+    parser.add_argument(
+        '--chunk-size', type=int, default=256,
+        help="files sent to a worker at once")
+    parser.add_argument(
+        '--format', choices=FORMATS, help="export / import format")
+    parser.add_argument(
+        '-o', '--output', help="export file (voc: directory)")
+    parser.add_argument(
+        '--root', help="image directory the exported paths are relative "
+        "to (import: where label files are written)")
+    parser.add_argument(
+        '--verify', action='store_true',
+        help="import: compare with the label files instead of writing")
+    parser.add_argument(
+        '--tolerance', type=float,
+        help="--verify: coordinates difference allowed (default 1 "
+        "pixel; packed files: normalized, default 1e-6)")
+    parser.add_argument(
+        '--iou', type=float, default=DUPLICATE_IOU,
+        help="check: overlap (IoU) of duplicate boxes of a class")
+    return parser.parse_args(argv)
+
+
+def runExport(args, categories):
+    if not args.format or not args.output:
+        print("export needs --format and --output", file=sys.stderr)
+        return 2
+    root = args.root or os.path.commonpath(
+        [os.path.abspath(path) for path in args.paths]
+    )
+    pairs = findImageLabels(args.paths, args.recursive)
+    report = ExportReport()
+    try:
+        for items in exportDataset(pairs, args.format, args.output, root,
+                                   categories, args.jobs, args.chunk_size):
+            for item in items:
+                report.add(item)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 2
+    for path, error in report.errors:
+        print("%s: %s" % (path, error.replace('\n', ' ')), file=sys.stderr)
+    print(
+        "%s images, %s boxes exported to %s, %s errors" % (
+            report.images - len(report.errors), report.boxes, args.output,
+            len(report.errors),
+        )
+    )
+    print(
+        "%.2fs, %.0f images/s, %.0f boxes/s" % (
+            report.elapsed, report.throughput(),
+            report.boxes / report.elapsed if report.elapsed else 0.0,
+        )
+    )
+    return 1 if report.errors else 0
+
+
+def runImport(args, categories):
+    if not args.format or not args.root or len(args.paths) != 1:
+        print("import needs one export, --format and --root",
+              file=sys.stderr)
+        return 2
+    files = 0
+    boxes = 0
+    errors = []
+    try:
+        for relative, rows, size in importLabels(
+                args.format, args.paths[0], categories):
+            path = importedLabelPath(args.root, relative)
+            files += 1
+            boxes += len(rows)
+            exists = os.path.exists(path)
+            if args.verify:
+                try:
+                    current = readLabels(path) if exists else \
+                        np.zeros((0, 5), dtype=np.float64)
+                except Exception as e:
+                    errors.append((path, str(e)))
+                    continue
+                if not sameRows(rows, current, size, args.tolerance):
+                    errors.append((path, "boxes differ"))
+            elif not args.dry_run and (exists or len(rows)):
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                writeAtomic(path, formatLabels(rows).encode('utf8'))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 2
+    for path, error in errors:
+        print("%s: %s" % (path, error.replace('\n', ' ')), file=sys.stderr)
+    print("%s files, %s boxes %s, %s errors" % (
+        files, boxes, 'verified' if args.verify else 'imported',
+        len(errors),
+    ))
+    return 1 if errors else 0
+
+
+def runCheck(args, categories):
+    paths = findLabelFiles(args.paths, args.recursive)
+    files = 0
+    boxes = 0
+    issues = 0
+    errors = []
+    try:
+        for checks in checkDataset(paths, categories, args.iou, args.jobs,
+                                   args.chunk_size):
+            for check in checks:
+                files += 1
+                boxes += check.boxes
+                issues += len(check.issues)
+                if check.error is not None:
+                    errors.append((check.path, check.error))
+                for issue in check.issues:
+                    print("%s:%s: %s" % (check.path, issue.line,
+                                         issue.message))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 2
+    for path, error in errors:
+        print("%s: %s" % (path, error.replace('\n', ' ')), file=sys.stderr)
+    print("%s files, %s boxes, %s issues, %s errors" % (
+        files, boxes, issues, len(errors)
+    ))
+    return 1 if issues or errors else 0
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    categories = None
+    if args.names:
+        categories = readObjNames(args.names)
+    if args.command == 'export':
+        return runExport(args, categories)
+    if args.command == 'import':
+        return runImport(args, categories)
+    if args.command == 'check':
+        return runCheck(args, categories)
+    try:
+        operation = buildOperation(args, categories)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return 2
+    paths = findLabelFiles(args.paths, args.recursive)
+    report = BatchReport()
+    write = not args.dry_run
+    for results in runBatch(paths, operation, write, args.jobs,
+                            args.chunk_size):
+        for result in results:
+            report.add(result)
+            if args.dry_run and result.changed:
+                print("would change %s" % result.path)
+    for path, error in report.errors:
+        print("%s: %s" % (path, error.replace('\n', ' ')), file=sys.stderr)
+    print(
+        "%s files, %s boxes, %s remapped, %s removed, %s files %s, "
+        "%s errors" % (
+            report.files, report.boxes, report.remapped, report.removed,
+            report.changed, 'to change' if args.dry_run else 'changed',
+            len(report.errors),
+        )
+    )
+    print(
+        "%.2fs, %.0f files/s, %.0f boxes/s" % (
+            report.elapsed, report.throughput(),
+            report.boxes / report.elapsed if report.elapsed else 0.0,
+        )
+    )
+    return 1 if report.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import itertools
+import os
+import time
+
+import numpy as np
+
+from libs.dataset_index import IMAGE_EXTENSIONS, LABEL_EXTENSION, framePath
+from libs.dataset_index import isShard, isVideo, labelPath
+from libs.label_io import parseLabels, readLabelData
+from libs.label_writer import writeAtomic
+
+
+def _frameLabels(video_path):
+    """
+    (frame path, label path) of the labeled frames of a video
+    """
+    directory = os.path.splitext(video_path)[0]
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return
+    for name in names:
+        stem, extension = os.path.splitext(name)
+        if extension == LABEL_EXTENSION and stem.isdigit():
+            yield (framePath(video_path, int(stem)),
+                   os.path.join(directory, name))
+
+
+def _shardLabels(shard_path):
+    """
+    (image path, label path) of the labeled images of a shard
+    """
+    # Imported when needed: libs.shards imports this module
+    from libs.shards import indexShard, shardImages
+    return shardImages(indexShard(shard_path))
+
+
+def findImageLabels(paths, recursive=False, frames=False):
+    """
+    (image path, label path) of the images of the directories
+    paths. label path is None if the image has no label file.
+    With frames, also the labeled frames of the videos and the
+    labeled images of the shards
+    """
+    for path in paths:
+        directories = [path]
+        while directories:
+            directory = directories.pop()
+            subdirectories = []
+            names = set()
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    else:
+                        names.add(entry.name)
+            for name in sorted(names):
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                label_name = os.path.basename(labelPath(name))
+                yield (
+                    os.path.join(directory, name),
+                    os.path.join(directory, label_name)
+                    if label_name in names else None,
+                )
+            if frames:
+                for name in sorted(names):
+                    if isVideo(name):
+                        yield from _frameLabels(os.path.join(directory,
+                                                             name))
+                    elif isShard(name):
+                        yield from _shardLabels(os.path.join(directory,
+                                                             name))
+            if recursive:
+                directories.extend(sorted(subdirectories, reverse=True))
+
+
+def findLabelFiles(paths, recursive=False):
+    """
+    Label files of paths. Directories yield the label files
+    next to their images, those of the frames of their videos and
+    those of the images of their shards (read from the shard until
+    written to its overlay), files are yielded as they are
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for _, label_path in findImageLabels([path], recursive, True):
+            if label_path is not None:
+                yield label_path
+
+
+def chunked(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def mapChunks(fn, items, args=(), workers=None, chunk_size=256,
+              mp_context=None, executor=None):
+    """
+    Yield fn(chunk, *args) for the chunks of items, in order.
+    Chunks run on a process pool with a bounded number of
+    them in flight, so items can be a generator of any size.
+    A given executor (of workers processes) is used and left
+    running, even for a single chunk
+    """
+    chunks = chunked(items, chunk_size)
+    first = next(chunks, None)
+    if first is None:
+        return
+    second = next(chunks, None)
+    if executor is None and (workers == 1 or second is None):
+        yield fn(first, *args)
+        if second is not None:
+            yield fn(second, *args)
+            for chunk in chunks:
+                yield fn(chunk, *args)
+        return
+    workers = workers or os.cpu_count() or 1
+    shutdown = executor is None
+    if shutdown:
+        # Imported when needed: multiprocessing is slow to import
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers,
+                                       mp_context=mp_context)
+    futures = collections.deque()
+    try:
+        in_flight = 2 * workers
+        rest = chunks if second is None else \
+            itertools.chain((second,), chunks)
+        for chunk in itertools.chain((first,), rest):
+            futures.append(executor.submit(fn, chunk, *args))
+            if len(futures) >= in_flight:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        for future in futures:
+            future.cancel()
+        if shutdown:
+            executor.shutdown()
+
+
+class Operation(object):
+
+    """
+    Category changes applied to every box of a label file.
+    remap: {old index: new index}
+    drop: indexes of the boxes to remove
+    keep: if set, remove the boxes of any other index
+    categories: if set, indexes must exist in it (obj.names)
+    """
+
+    def __init__(self, remap=None, drop=(), keep=None, categories=None):
+        self.remap = dict(remap or {})
+        self.drop = set(drop)
+        self.keep = None if keep is None else set(keep)
+        self.categories = categories
+        if categories is not None:
+            for idx in self.remap.values():
+                if not categories.get(idx, False):
+                    raise Exception("Category not found for index %s" % idx)
+
+    def isEmpty(self):
+        return not self.remap and not self.drop and self.keep is None
+
+    def apply(self, idx):
+        """
+        Return (new_idx, kept) arrays for the idx column
+        """
+        kept = np.ones(len(idx), dtype=bool)
+        if self.drop:
+            kept &= ~np.isin(idx, list(self.drop))
+        if self.keep is not None:
+            kept &= np.isin(idx, list(self.keep))
+        new_idx = idx.copy()
+        for old, new in self.remap.items():
+            new_idx[idx == old] = new
+        return new_idx, kept
+
+
+class FileResult(object):
+
+    __slots__ = ('path', 'boxes', 'removed', 'remapped', 'changed', 'error')
+
+    def __init__(self, path, boxes=0, removed=0, remapped=0, changed=False,
+                 error=None):
+        self.path = path
+        self.boxes = boxes
+        self.removed = removed
+        self.remapped = remapped
+        self.changed = changed
+        self.error = error
+
+
+def validateRows(rows, path, categories=None):
+    """
+    Same checks as loading the file in the GUI:
+    integer category index found in categories
+    """
+    idx = rows[:, 0]
+    bad = np.nonzero(idx != np.trunc(idx))[0]
+    if len(bad):
+        raise Exception(
+            "Invalid config file: %s \n. Line %s.\nInvalid index: %s"
+            % (path, bad[0], idx[bad[0]])
+        )
+    if categories is not None:
+        known = np.array(
+            [i for i, name in categories.items() if name], dtype=np.float64
+        )
+        bad = np.nonzero(~np.isin(idx, known))[0]
+        if len(bad):
+            raise Exception(
+                "Category not found for index %s" % int(idx[bad[0]])
+            )
+    return True
+
+
+def _editLines(data, new_idx, kept):
+    """
+    Replace the index of each box line of data and remove the
+    lines not kept. Coordinates and line endings are left as
+    they are
+    """
+    lines = data.split(b'\n')
+    output = []
+    for i in range(len(kept)):
+        if not kept[i]:
+            continue
+        line = lines[i]
+        value = line.lstrip()
+        token = value.split(None, 1)[0]
+        start = len(line) - len(value)
+        output.append(
+            line[:start] + str(int(new_idx[i])).encode('ascii')
+            + value[len(token):]
+            + (b'\n' if i < len(lines) - 1 else b'')
+        )
+    return b''.join(output)
+
+
+def processFile(path, operation, write=True):
+    """
+    Validate a label file and apply operation to it.
+    Errors are returned in the result, not raised
+    """
+    result = FileResult(path)
+    try:
+        data = readLabelData(path)
+        rows = parseLabels(data, path)
+        validateRows(rows, path, operation.categories)
+        result.boxes = len(rows)
+        if operation.isEmpty() or not len(rows):
+            return result
+        idx = rows[:, 0].astype(np.int64)
+        new_idx, kept = operation.apply(idx)
+        result.removed = int(np.count_nonzero(~kept))
+        result.remapped = int(np.count_nonzero((new_idx != idx) & kept))
+        if not result.removed and not result.remapped:
+            return result
+        result.changed = True
+        if write:
+            writeAtomic(path, _editLines(data, new_idx, kept))
+    except Exception as e:
+        result.error = str(e)
+    return result
+
+
+def _processChunk(paths, operation, write):
+    return [processFile(path, operation, write) for path in paths]
+
+
+class BatchReport(object):
+
+    """
+    Totals of a batch run
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.boxes = 0
+        self.removed = 0
+        self.remapped = 0
+        self.changed = 0
+        self.errors = []
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add(self, result):
+        self.files += 1
+        self.boxes += result.boxes
+        self.removed += result.removed
+        self.remapped += result.remapped
+        self.changed += int(result.changed)
+        if result.error is not None:
+            self.errors.append((result.path, result.error))
+        self.elapsed = time.perf_counter() - self.start
+        return True
+
+    def throughput(self):
+        """
+        Files per second
+        """
+        if not self.elapsed:
+            return 0.0
+        return self.files / self.elapsed
+
+
+def runBatch(paths, operation, write=True, workers=None, chunk_size=256):
+    """
+    Process label files on a process pool.
+    Yield the FileResult list of each chunk as it finishes
+    """
+    return mapChunks(_processChunk, paths, (operation, write), workers,
+                     chunk_size)
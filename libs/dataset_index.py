@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import sqlite3
+
+from libs.label_io import countLines
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.png', '.jpeg')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+# Uncompressed tar and zip archives of images
+SHARD_EXTENSIONS = ('.tar', '.zip')
+LABEL_EXTENSION = '.txt'
+# A frame of a video is named video path#frame number, an image
+# of a shard shard path#member name
+FRAME_SEPARATOR = '#'
+# Labels of the images of a shard are written to a directory
+# named as the shard with this suffix
+OVERLAY_SUFFIX = '.labels'
+
+
+def labelPath(image_path):
+    """
+    Label file of an image: same name with .txt extension
+    """
+    return os.path.splitext(image_path)[0] + LABEL_EXTENSION
+
+
+def isVideo(path):
+    return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def framePath(video_path, frame):
+    return '%s%s%06d' % (video_path, FRAME_SEPARATOR, frame)
+
+
+def splitFramePath(path):
+    """
+    (video path, frame number) of a frame path, None if path is
+    not a frame
+    """
+    video_path, separator, frame = path.rpartition(FRAME_SEPARATOR)
+    if not separator or not frame.isdigit() or not isVideo(video_path):
+        return None
+    return video_path, int(frame)
+
+
+def frameLabelPath(video_path, frame):
+    """
+    Label file of a frame: the frame number with .txt extension
+    in a directory named as the video, where its extracted frames
+    would be
+    """
+    return os.path.join(os.path.splitext(video_path)[0],
+                        '%06d%s' % (frame, LABEL_EXTENSION))
+
+
+def isShard(path):
+    return os.path.splitext(path)[1].lower() in SHARD_EXTENSIONS
+
+
+def memberPath(shard_path, name):
+    return '%s%s%s' % (shard_path, FRAME_SEPARATOR, name)
+
+
+def splitMemberPath(path):
+    """
+    (shard path, member name) of an image of a shard, None if
+    path is not in a shard
+    """
+    start = path.find(FRAME_SEPARATOR)
+    while start >= 0:
+        if isShard(path[:start]):
+            return path[:start], path[start + 1:]
+        start = path.find(FRAME_SEPARATOR, start + 1)
+    return None
+
+
+def memberLabelPath(shard_path, name):
+    """
+    Label file of an image of a shard in its overlay directory.
+    Until it is written, the labels are read from the label
+    member of the shard (libs.shards)
+    """
+    return os.path.join(shard_path + OVERLAY_SUFFIX,
+                        *labelPath(name).split('/'))
+
+
+def splitOverlayPath(path):
+    """
+    (shard path, label member name) of an overlay label file,
+    None if path is not in the overlay of a shard
+    """
+    marker = OVERLAY_SUFFIX + os.sep
+    end = path.find(marker)
+    while end >= 0:
+        if isShard(path[:end]):
+            name = path[end + len(marker):]
+            return path[:end], name.replace(os.sep, '/')
+        end = path.find(marker, end + 1)
+    return None
+
+
+def sourcePath(path):
+    """
+    File of an image, frame or shard image path
+    """
+    frame = splitFramePath(path)
+    if frame is not None:
+        return frame[0]
+    member = splitMemberPath(path)
+    return path if member is None else member[0]
+
+
+def indexPath(cache_dir, root, recursive):
+    """
+    Index file of a dataset directory inside cache_dir
+    """
+    key = '%s|%s' % (os.path.abspath(root), int(bool(recursive)))
+    name = hashlib.sha1(key.encode('utf8')).hexdigest()[:16] + '.sqlite'
+    return os.path.join(os.path.expanduser(cache_dir), name)
+
+
+def videoIndexPath(cache_dir):
+    """
+    Frame index file of the videos (libs.video) inside cache_dir
+    """
+    return os.path.join(os.path.expanduser(cache_dir), 'videos.sqlite')
+
+
+def shardIndexPath(cache_dir):
+    """
+    Member index file of the shards (libs.shards) inside cache_dir
+    """
+    return os.path.join(os.path.expanduser(cache_dir), 'shards.sqlite')
+
+
+class ImageEntry(object):
+
+    __slots__ = ('path', 'size', 'mtime', 'label_size', 'label_mtime',
+                 'has_label', 'boxes')
+
+    def __init__(self, path, size, mtime, label_size=-1, label_mtime=-1,
+                 has_label=False, boxes=0):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.label_size = label_size
+        self.label_mtime = label_mtime
+        self.has_label = bool(has_label)
+        self.boxes = boxes
+
+    @property
+    def label_path(self):
+        return labelPath(self.path)
+
+    @property
+    def is_video(self):
+        return isVideo(self.path)
+
+    @property
+    def is_shard(self):
+        return isShard(self.path)
+
+    def row(self, directory):
+        return (self.path, directory, self.size, self.mtime,
+                self.label_size, self.label_mtime, int(self.has_label),
+                self.boxes)
+
+
+class DatasetIndex(object):
+
+    """
+    Persistent index (SQLite) of the images, videos and shards of a
+    dataset directory. Every scan lists and stats the files (files
+    edited in place do not change the directory mtime); the label
+    files whose size and mtime did not change keep their stored box
+    count, and the index is written only when something changed
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS directories ("
+        " path TEXT PRIMARY KEY, parent TEXT, mtime INTEGER)",
+        "CREATE TABLE IF NOT EXISTS images ("
+        " path TEXT PRIMARY KEY, directory TEXT, size INTEGER,"
+        " mtime INTEGER, label_size INTEGER, label_mtime INTEGER,"
+        " has_label INTEGER, boxes INTEGER)",
+        "CREATE INDEX IF NOT EXISTS images_directory"
+        " ON images (directory)",
+        "CREATE INDEX IF NOT EXISTS directories_parent"
+        " ON directories (parent)",
+    )
+
+    def __init__(self, db_path):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path)
+        for statement in self.SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def _storedEntries(self, directory):
+        cursor = self.db.execute(
+            "SELECT path, size, mtime, label_size, label_mtime, has_label,"
+            " boxes FROM images WHERE directory = ? ORDER BY path",
+            (directory,)
+        )
+        return [ImageEntry(*row) for row in cursor]
+
+    def _storedSubdirectories(self, directory):
+        cursor = self.db.execute(
+            "SELECT path FROM directories WHERE parent = ? ORDER BY path",
+            (directory,)
+        )
+        return [row[0] for row in cursor]
+
+    def _forget(self, directory):
+        """
+        Remove a directory and everything below it
+        """
+        prefix = directory.rstrip(os.sep) + os.sep
+        # % and _ of the names are not wildcards
+        like = prefix.replace('\\', '\\\\').replace('%', '\\%') \
+            .replace('_', '\\_') + '%'
+        self.db.execute(
+            "DELETE FROM images WHERE directory = ?"
+            " OR directory LIKE ? ESCAPE '\\'",
+            (directory, like)
+        )
+        self.db.execute(
+            "DELETE FROM directories WHERE path = ?"
+            " OR path LIKE ? ESCAPE '\\'",
+            (directory, like)
+        )
+
+    def _scanDirectory(self, directory, mtime, parent, stored_mtime,
+                       chunk_size):
+        """
+        List a directory yielding its entries in chunks. Return
+        the subdirectories
+        """
+        stored = {entry.path: entry for entry in
+                  self._storedEntries(directory)}
+        images = []
+        labels = {}
+        subdirectories = []
+        with os.scandir(directory) as it:
+            for dir_entry in it:
+                name = dir_entry.name
+                if name.startswith('.'):
+                    continue
+                if dir_entry.is_dir():
+                    subdirectories.append(dir_entry.path)
+                    continue
+                extension = os.path.splitext(name)[1].lower()
+                if extension in IMAGE_EXTENSIONS or \
+                        extension in VIDEO_EXTENSIONS or \
+                        extension in SHARD_EXTENSIONS:
+                    images.append(dir_entry)
+                elif extension == LABEL_EXTENSION:
+                    labels[dir_entry.path] = dir_entry
+        images.sort(key=lambda dir_entry: dir_entry.name)
+        subdirectories.sort()
+
+        entries = []
+        chunk_start = 0
+        for dir_entry in images:
+            stat = dir_entry.stat()
+            entry = ImageEntry(dir_entry.path, stat.st_size,
+                               stat.st_mtime_ns)
+            label_entry = labels.get(labelPath(dir_entry.path))
+            if label_entry is not None:
+                label_stat = label_entry.stat()
+                entry.has_label = True
+                entry.label_size = label_stat.st_size
+                entry.label_mtime = label_stat.st_mtime_ns
+                old = stored.get(entry.path)
+                if (old is not None and old.has_label and
+                        old.label_size == entry.label_size and
+                        old.label_mtime == entry.label_mtime):
+                    entry.boxes = old.boxes
+                else:
+                    with open(label_entry.path, 'rb') as f:
+                        entry.boxes = countLines(f.read())
+            entries.append(entry)
+            if len(entries) - chunk_start >= chunk_size:
+                yield entries[chunk_start:]
+                chunk_start = len(entries)
+        if len(entries) > chunk_start:
+            yield entries[chunk_start:]
+
+        rows = {entry.path: entry.row(directory) for entry in entries}
+        if stored_mtime == mtime and rows == {
+            path: entry.row(directory) for path, entry in stored.items()
+        }:
+            return subdirectories
+        self.db.execute("DELETE FROM images WHERE directory = ?",
+                        (directory,))
+        self.db.executemany(
+            "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [entry.row(directory) for entry in entries]
+        )
+        for old_subdirectory in self._storedSubdirectories(directory):
+            if old_subdirectory not in subdirectories:
+                self._forget(old_subdirectory)
+        # Known but never scanned (mtime -1) until they are visited
+        self.db.executemany(
+            "INSERT OR IGNORE INTO directories VALUES (?, ?, -1)",
+            [(path, directory) for path in subdirectories]
+        )
+        self.db.execute(
+            "INSERT OR REPLACE INTO directories VALUES (?, ?, ?)",
+            (directory, parent, mtime)
+        )
+        self.db.commit()
+        return subdirectories
+
+    def stored(self, root, recursive=False):
+        """
+        ImageEntry list of the last scan of root, in scan order,
+        read from the index only: nothing is listed nor stated
+        """
+        pending = [os.path.abspath(root)]
+        entries = []
+        while pending:
+            directory = pending.pop(0)
+            entries.extend(self._storedEntries(directory))
+            if recursive:
+                pending[0:0] = self._storedSubdirectories(directory)
+        return entries
+
+    def scan(self, root, recursive=False, chunk_size=1000):
+        """
+        Walk root and yield lists of ImageEntry as they are found,
+        sorted by path inside each directory. Label files are read
+        only if they changed since the last scan
+        """
+        root = os.path.abspath(root)
+        pending = [(root, None)]
+        while pending:
+            directory, parent = pending.pop(0)
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                self._forget(directory)
+                self.db.commit()
+                continue
+            cursor = self.db.execute(
+                "SELECT mtime FROM directories WHERE path = ?",
+                (directory,)
+            )
+            stored = cursor.fetchone()
+            subdirectories = yield from self._scanDirectory(
+                directory, mtime, parent,
+                None if stored is None else stored[0], chunk_size
+            )
+            if recursive:
+                pending[0:0] = [(path, directory) for path in subdirectories]
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import io
+import os
+import sqlite3
+
+import numpy as np
+from PIL import Image
+
+from libs.batch import mapChunks
+from libs.dataset_index import sourcePath, splitFramePath, splitMemberPath
+from libs.shards import shardSource
+
+
+# The hash is the sign of the 8x8 lowest frequencies of the
+# DCT of the image reduced to 32x32 gray pixels
+HASH_BITS = 64
+_SIDE = 32
+_LOW = 8
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _dctMatrix(n):
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * k * (2 * np.arange(n)[None, :] + 1) / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix * np.sqrt(2.0 / n)
+
+
+_DCT = _dctMatrix(_SIDE)
+
+
+def imageHash(path, video_index_path=None):
+    """
+    64 bits perceptual hash (pHash) of an image. Near identical
+    images (resized, recompressed, small changes) have hashes at
+    a small Hamming distance. Video frames are found with the
+    video index file video_index_path (libs.video)
+    """
+    if splitFramePath(path) is not None:
+        from libs.video import frameSource
+        # BGR to gray, as PIL does from RGB
+        frame = frameSource(video_index_path).frame(path)
+        gray = frame[..., 2] * 0.299 + frame[..., 1] * 0.587 + \
+            frame[..., 0] * 0.114
+        image = Image.fromarray(gray.round().astype(np.uint8))
+        image = image.resize((_SIDE, _SIDE), Image.BILINEAR)
+        pixels = np.asarray(image, dtype=np.float64)
+    else:
+        if splitMemberPath(path) is not None:
+            path = io.BytesIO(shardSource().data(path))
+        with Image.open(path) as image:
+            # JPEG images are decoded at a reduced size
+            image.draft('L', (2 * _SIDE, 2 * _SIDE))
+            image = image.convert('L').resize((_SIDE, _SIDE),
+                                              Image.BILINEAR)
+            pixels = np.asarray(image, dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:_LOW, :_LOW].ravel()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def _hashChunk(paths, video_index_path=None):
+    result = []
+    for path in paths:
+        try:
+            result.append(imageHash(path, video_index_path))
+        except Exception:
+            result.append(None)
+    return result
+
+
+def hammingDistances(hashes, value):
+    """
+    Hamming distance of every hash of the uint64 array to value
+    """
+    xor = np.bitwise_xor(hashes, np.uint64(value))
+    return _POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(
+        axis=1, dtype=np.int64
+    )
+
+
+def _toSigned(value):
+    # SQLite integers are signed 64 bits
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hashPath(cache_dir, root):
+    """
+    Hash store of a dataset directory inside cache_dir
+    """
+    key = os.path.abspath(root)
+    name = hashlib.sha1(key.encode('utf8')).hexdigest()[:16] + '.sqlite'
+    return os.path.join(os.path.expanduser(cache_dir), 'phash', name)
+
+
+class HashStore(object):
+
+    """
+    Persistent (SQLite) perceptual hashes of images, computed
+    again when the image mtime or size change
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS hashes ("
+        " path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER,"
+        " hash INTEGER)",
+    )
+
+    def __init__(self, db_path):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path)
+        for statement in self.SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def _stored(self):
+        cursor = self.db.execute("SELECT path, mtime, size, hash FROM hashes")
+        return {row[0]: row[1:] for row in cursor}
+
+    def update(self, paths, workers=None, chunk_size=64, mp_context=None,
+               video_index_path=None):
+        """
+        Hash the images of paths not hashed yet (or changed) on a
+        process pool. Yield (hashed, to hash) as chunks finish.
+        Video frames are found with video_index_path
+        """
+        stored = self._stored()
+        stale = []
+        stamps = {}
+        for path in paths:
+            try:
+                # Frames have the stamp of their video
+                stat = os.stat(sourcePath(path))
+            except OSError:
+                continue
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            cached = stored.get(path)
+            if cached is None or tuple(cached[:2]) != stamp:
+                stale.append(path)
+                stamps[path] = stamp
+        done = 0
+        yield done, len(stale)
+        start = 0
+        for hashes in mapChunks(_hashChunk, stale, (video_index_path,),
+                                workers, chunk_size, mp_context):
+            chunk = stale[start:start + len(hashes)]
+            start += len(hashes)
+            self.db.executemany(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)",
+                [
+                    (path, *stamps[path],
+                     None if value is None else _toSigned(value))
+                    for path, value in zip(chunk, hashes)
+                ]
+            )
+            self.db.commit()
+            done += len(hashes)
+            yield done, len(stale)
+
+    def hashes(self, paths):
+        """
+        (uint64 hashes, valid) arrays aligned with paths. Images
+        not hashed or that could not be read are not valid
+        """
+        stored = self._stored()
+        values = np.zeros(len(paths), dtype=np.int64)
+        valid = np.zeros(len(paths), dtype=bool)
+        for i, path in enumerate(paths):
+            cached = stored.get(path)
+            if cached is not None and cached[2] is not None:
+                values[i] = cached[2]
+                valid[i] = True
+        return values.view(np.uint64), valid
+
+
+class HashIndex(object):
+
+    """
+    Multi-index hashing: the hashes are split in radius + 1
+    chunks. Two hashes within radius share at least one chunk
+    exactly, so only the hashes sharing a chunk value with the
+    query are compared
+    """
+
+    def __init__(self, hashes, radius):
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.radius = radius
+        chunks = min(radius + 1, HASH_BITS)
+        bounds = np.linspace(0, HASH_BITS, chunks + 1).astype(np.int64)
+        self._chunks = []
+        for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            shift = np.uint64(start)
+            mask = np.uint64((1 << (end - start)) - 1)
+            values = (self.hashes >> shift) & mask
+            order = np.argsort(values, kind='stable')
+            self._chunks.append((shift, mask, values[order], order))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _candidates(self, value):
+        value = np.uint64(value)
+        found = []
+        for shift, mask, values, order in self._chunks:
+            chunk = (value >> shift) & mask
+            start = np.searchsorted(values, chunk, side='left')
+            end = np.searchsorted(values, chunk, side='right')
+            found.append(order[start:end])
+        return np.unique(np.concatenate(found))
+
+    def query(self, value, radius=None):
+        """
+        (positions, distances) of the hashes within radius of value,
+        sorted by distance
+        """
+        radius = self.radius if radius is None else min(radius, self.radius)
+        candidates = self._candidates(value)
+        distances = hammingDistances(self.hashes[candidates], value)
+        near = distances <= radius
+        candidates, distances = candidates[near], distances[near]
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+    def sharesChunk(self):
+        """
+        True for the hashes sharing a chunk value with another one,
+        the only ones that can have a duplicate
+        """
+        shared = np.zeros(len(self.hashes), dtype=bool)
+        for _, _, values, order in self._chunks:
+            same = np.zeros(len(values), dtype=bool)
+            equal = values[1:] == values[:-1]
+            same[1:] |= equal
+            same[:-1] |= equal
+            shared[order] |= same
+        return shared
+
+    def clusters(self):
+        """
+        Cluster of every hash: the position of its leader. Hashes
+        are taken in order; a hash not clustered yet leads the
+        ones within radius of it not clustered yet
+        """
+        labels = np.arange(len(self.hashes))
+        assigned = np.zeros(len(self.hashes), dtype=bool)
+        for i in np.nonzero(self.sharesChunk())[0].tolist():
+            if assigned[i]:
+                continue
+            members, _ = self.query(self.hashes[i])
+            members = members[~assigned[members]]
+            labels[members] = i
+            assigned[members] = True
+        return labels
+
+
+class Duplicates(object):
+
+    """
+    Near duplicate images of a dataset, aligned with its image
+    list. leaders[i] is the first image of the cluster of image
+    i (i itself if it has no earlier duplicate)
+    """
+
+    def __init__(self, images, hashes, valid, radius):
+        self.images = images
+        self.valid = valid
+        self.radius = radius
+        self.positions = np.nonzero(valid)[0]
+        self.index = HashIndex(hashes[valid], radius)
+        self.leaders = np.arange(len(images))
+        self.leaders[self.positions] = self.positions[self.index.clusters()]
+
+    def __len__(self):
+        return len(self.images)
+
+    def representatives(self):
+        """
+        Positions of the images that are not a duplicate of an
+        earlier one
+        """
+        return np.nonzero(self.leaders == np.arange(len(self.images)))[0]
+
+    def duplicateCount(self):
+        return len(self.images) - len(self.representatives())
+
+    def cluster(self, position):
+        """
+        Positions of the images in the cluster of position
+        """
+        return np.nonzero(self.leaders == self.leaders[position])[0]
+
+    def twins(self, position):
+        """
+        Positions of the images within radius of position, the
+        nearest first, without position itself
+        """
+        if not self.valid[position]:
+            return np.zeros(0, dtype=np.int64)
+        i = np.searchsorted(self.positions, position)
+        found, _ = self.index.query(self.index.hashes[i])
+        found = self.positions[found]
+        return found[found != position]
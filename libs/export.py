@@ -0,0 +1,562 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+from xml.etree import ElementTree
+
+import numpy as np
+from PIL import Image
+
+from libs.batch import mapChunks, validateRows
+from libs.dataset_index import labelPath
+from libs.label_io import parseLabels, readLabelData, readLabelsMany
+from libs.label_writer import writeAtomic
+
+
+COCO = 'coco'
+VOC = 'voc'
+PACKED = 'packed'
+FORMATS = (COCO, VOC, PACKED)
+
+# Packed file: header, boxes (n, 5) float32 idx, center_x, center_y,
+# width, height, offsets (images + 1) int64, path offsets
+# (images + 1) int64 and the utf8 relative image paths
+PACKED_MAGIC = b'YOLOPACK'
+PACKED_VERSION = 1
+PACKED_HEADER = struct.Struct('<8sIIQQQQQ')
+PACKED_HEADER_SIZE = 64
+
+# Coordinates difference of the same box read back from an export:
+# COCO / VOC boxes are in pixels, packed ones normalized (float32
+# of the 6 decimals of the label files)
+PIXEL_TOLERANCE = 1.0
+NORMALIZED_TOLERANCE = 1e-6
+
+
+class ExportItem(object):
+
+    """
+    Boxes of an image read by an export worker.
+    rows: (n, 5) yolo rows, None once written by the worker
+    """
+
+    __slots__ = ('image_path', 'width', 'height', 'boxes', 'rows', 'error')
+
+    def __init__(self, image_path, width=0, height=0, rows=None,
+                 error=None):
+        self.image_path = image_path
+        self.width = width
+        self.height = height
+        self.boxes = 0 if rows is None else len(rows)
+        self.rows = rows
+        self.error = error
+
+
+def imageSize(image_path):
+    """
+    (width, height) read from the image header
+    """
+    with Image.open(image_path) as image:
+        return image.size
+
+
+def pixelBoxes(rows, width, height):
+    """
+    (n, 4) x_min, y_min, box width, box height in pixels
+    of yolo rows
+    """
+    scale = np.array([width, height, width, height], dtype=np.float64)
+    boxes = rows[:, 1:5] * scale
+    boxes[:, :2] -= boxes[:, 2:] / 2
+    return boxes
+
+
+def yoloRows(idx, boxes, width, height):
+    """
+    Inverse of pixelBoxes
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    rows = np.empty((len(boxes), 5), dtype=np.float64)
+    rows[:, 0] = idx
+    rows[:, 1:3] = boxes[:, :2] + boxes[:, 2:] / 2
+    rows[:, 3:5] = boxes[:, 2:]
+    rows[:, 1:5] /= np.array([width, height, width, height])
+    return rows
+
+
+def formatVoc(image_path, width, height, rows, categories):
+    """
+    Pascal VOC annotation (bytes) of an image
+    """
+    root = ElementTree.Element('annotation')
+    ElementTree.SubElement(root, 'folder').text = \
+        os.path.basename(os.path.dirname(image_path))
+    ElementTree.SubElement(root, 'filename').text = \
+        os.path.basename(image_path)
+    size = ElementTree.SubElement(root, 'size')
+    ElementTree.SubElement(size, 'width').text = str(width)
+    ElementTree.SubElement(size, 'height').text = str(height)
+    ElementTree.SubElement(size, 'depth').text = '3'
+    boxes = np.rint(pixelBoxes(rows, width, height)).astype(np.int64)
+    for idx, (x, y, w, h) in zip(rows[:, 0].astype(np.int64).tolist(),
+                                 boxes.tolist()):
+        obj = ElementTree.SubElement(root, 'object')
+        ElementTree.SubElement(obj, 'name').text = categories[idx]
+        ElementTree.SubElement(obj, 'difficult').text = '0'
+        box = ElementTree.SubElement(obj, 'bndbox')
+        for tag, value in (('xmin', x), ('ymin', y), ('xmax', x + w),
+                           ('ymax', y + h)):
+            ElementTree.SubElement(box, tag).text = str(value)
+    ElementTree.indent(root)
+    return ElementTree.tostring(root, encoding='utf-8') + b'\n'
+
+
+def vocPath(output, root, image_path):
+    """
+    Annotation file of image_path: same relative path in output
+    """
+    relative = os.path.relpath(image_path, root)
+    return os.path.join(output, os.path.splitext(relative)[0] + '.xml')
+
+
+def _readRows(pairs):
+    """
+    Rows of the label files of pairs, None for a missing file.
+    An exception replaces the rows of an invalid file
+    """
+    labels = [label for _, label in pairs if label is not None]
+    try:
+        rows, offsets = readLabelsMany(labels)
+    except Exception:
+        result = []
+        for _, label in pairs:
+            if label is None:
+                result.append(None)
+                continue
+            try:
+                result.append(parseLabels(readLabelData(label), label))
+            except Exception as e:
+                result.append(e)
+        return result
+    result = []
+    i = 0
+    for _, label in pairs:
+        if label is None:
+            result.append(None)
+            continue
+        result.append(rows[offsets[i]:offsets[i + 1]])
+        i += 1
+    return result
+
+
+def _exportChunk(pairs, fmt, categories, root, output):
+    """
+    Read the boxes of a chunk of (image, label) pairs.
+    VOC annotations are written here, in the worker
+    """
+    items = []
+    for (image_path, label_path), rows in zip(pairs, _readRows(pairs)):
+        item = ExportItem(image_path)
+        items.append(item)
+        try:
+            if isinstance(rows, Exception):
+                raise rows
+            if rows is None:
+                rows = np.zeros((0, 5), dtype=np.float64)
+            item.rows = rows
+            item.boxes = len(rows)
+            validateRows(rows, label_path, categories)
+            if fmt != PACKED:
+                item.width, item.height = imageSize(image_path)
+            if fmt == VOC:
+                path = vocPath(output, root, image_path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                writeAtomic(path, formatVoc(
+                    image_path, item.width, item.height, rows, categories
+                ))
+                item.rows = None
+        except Exception as e:
+            item.error = str(e)
+            item.boxes = 0
+            item.rows = None
+    return items
+
+
+class CocoWriter(object):
+
+    """
+    Write a COCO JSON file one image at a time. Annotations go
+    to a temporary file appended after the images on close
+    """
+
+    def __init__(self, path, categories):
+        self.path = path
+        self._tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        self._file = open(self._tmp_path, 'w', encoding='utf8')
+        self._annotations = tempfile.TemporaryFile('w+', encoding='utf8')
+        self._images = 0
+        self._boxes = 0
+        self._file.write('{"info": %s, "categories": %s, "images": [' % (
+            json.dumps({'description': 'yolo export'}),
+            json.dumps([
+                {'id': idx + 1, 'name': name, 'supercategory': ''}
+                for idx, name in sorted(categories.items())
+            ]),
+        ))
+
+    def add(self, relative_path, item):
+        self._images += 1
+        image_id = self._images
+        self._file.write('%s\n%s' % (
+            ',' if image_id > 1 else '',
+            json.dumps({
+                'id': image_id, 'file_name': relative_path,
+                'width': item.width, 'height': item.height,
+            }),
+        ))
+        boxes = pixelBoxes(item.rows, item.width, item.height)
+        lines = []
+        for idx, box in zip(item.rows[:, 0].astype(np.int64).tolist(),
+                            np.round(boxes, 3).tolist()):
+            self._boxes += 1
+            lines.append('%s\n%s' % (
+                ',' if self._boxes > 1 else '',
+                json.dumps({
+                    'id': self._boxes, 'image_id': image_id,
+                    'category_id': idx + 1, 'bbox': box,
+                    'area': round(box[2] * box[3], 3), 'iscrowd': 0,
+                }),
+            ))
+        self._annotations.write(''.join(lines))
+        return True
+
+    def close(self):
+        self._file.write('\n], "annotations": [')
+        self._annotations.seek(0)
+        shutil.copyfileobj(self._annotations, self._file)
+        self._annotations.close()
+        self._file.write('\n]}\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return True
+
+    def abort(self):
+        self._annotations.close()
+        self._file.close()
+        os.remove(self._tmp_path)
+        return True
+
+
+class PackedWriter(object):
+
+    """
+    Write a packed file (see PACKED_HEADER) one image at a time.
+    The boxes are written in place, the tables of the images
+    to temporary files appended on close
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(b'\0' * PACKED_HEADER_SIZE)
+        self._offsets = tempfile.TemporaryFile()
+        self._path_offsets = tempfile.TemporaryFile()
+        self._paths = tempfile.TemporaryFile()
+        self._images = 0
+        self._boxes = 0
+        self._path_bytes = 0
+        self._offsets.write(struct.pack('<q', 0))
+        self._path_offsets.write(struct.pack('<q', 0))
+
+    def add(self, relative_path, item):
+        self._file.write(item.rows.astype('<f4').tobytes())
+        self._boxes += len(item.rows)
+        self._images += 1
+        self._offsets.write(struct.pack('<q', self._boxes))
+        name = relative_path.encode('utf8')
+        self._paths.write(name)
+        self._path_bytes += len(name)
+        self._path_offsets.write(struct.pack('<q', self._path_bytes))
+        return True
+
+    def _appendAligned(self, source):
+        # 8 bytes aligned sections can be memory mapped as int64
+        self._file.write(b'\0' * (-self._file.tell() % 8))
+        position = self._file.tell()
+        source.seek(0)
+        shutil.copyfileobj(source, self._file)
+        source.close()
+        return position
+
+    def close(self):
+        offsets_position = self._appendAligned(self._offsets)
+        path_offsets_position = self._appendAligned(self._path_offsets)
+        paths_position = self._appendAligned(self._paths)
+        self._file.seek(0)
+        self._file.write(PACKED_HEADER.pack(
+            PACKED_MAGIC, PACKED_VERSION, 0, self._images, self._boxes,
+            offsets_position, path_offsets_position, paths_position,
+        ))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return True
+
+    def abort(self):
+        for f in (self._offsets, self._path_offsets, self._paths):
+            f.close()
+        self._file.close()
+        os.remove(self._tmp_path)
+        return True
+
+
+class PackedLabels(object):
+
+    """
+    Packed file memory mapped: boxes(i) are the yolo rows
+    (float32) of the image imagePath(i)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(PACKED_HEADER.size)
+        if len(header) < PACKED_HEADER.size:
+            raise Exception("Invalid packed file: %s" % path)
+        (magic, version, _, self.images, box_count, offsets_position,
+         path_offsets_position, paths_position) = \
+            PACKED_HEADER.unpack(header)
+        if magic != PACKED_MAGIC or version != PACKED_VERSION:
+            raise Exception("Invalid packed file: %s" % path)
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        self.rows = data[
+            PACKED_HEADER_SIZE:PACKED_HEADER_SIZE + box_count * 20
+        ].view('<f4').reshape(-1, 5)
+        self.offsets = data[
+            offsets_position:offsets_position + (self.images + 1) * 8
+        ].view('<i8')
+        self.path_offsets = data[
+            path_offsets_position:
+            path_offsets_position + (self.images + 1) * 8
+        ].view('<i8')
+        self.paths = data[paths_position:]
+
+    def __len__(self):
+        return self.images
+
+    def boxes(self, i):
+        return self.rows[self.offsets[i]:self.offsets[i + 1]]
+
+    def imagePath(self, i):
+        start, end = self.path_offsets[i], self.path_offsets[i + 1]
+        return self.paths[start:end].tobytes().decode('utf8')
+
+
+class ExportReport(object):
+
+    """
+    Totals of an export
+    """
+
+    def __init__(self):
+        self.images = 0
+        self.boxes = 0
+        self.errors = []
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add(self, item):
+        self.images += 1
+        self.boxes += item.boxes
+        if item.error is not None:
+            self.errors.append((item.image_path, item.error))
+        self.elapsed = time.perf_counter() - self.start
+        return True
+
+    def throughput(self):
+        """
+        Images per second
+        """
+        if not self.elapsed:
+            return 0.0
+        return self.images / self.elapsed
+
+
+def exportDataset(pairs, fmt, output, root, categories=None, workers=None,
+                  chunk_size=256, mp_context=None):
+    """
+    Export (image, label) pairs to output: a COCO JSON file, a
+    directory of VOC annotations or a packed file. Image paths
+    are stored relative to root. Labels are read on a process
+    pool and written as they come, so memory does not grow with
+    the dataset. Yield the ExportItem list of each chunk; images
+    with an error are left out of the export
+    """
+    if fmt not in FORMATS:
+        raise Exception("Unknown export format %s" % fmt)
+    if fmt != PACKED and categories is None:
+        raise Exception("%s export needs the category names" % fmt)
+    writer = None
+    if fmt == COCO:
+        writer = CocoWriter(output, categories)
+    elif fmt == PACKED:
+        writer = PackedWriter(output)
+    try:
+        for items in mapChunks(_exportChunk, pairs,
+                               (fmt, categories, root, output),
+                               workers, chunk_size, mp_context):
+            if writer is not None:
+                for item in items:
+                    if item.error is None:
+                        relative = os.path.relpath(item.image_path, root)
+                        writer.add(relative, item)
+                    item.rows = None
+            yield items
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is not None:
+        writer.close()
+
+
+def readCoco(path, categories=None):
+    """
+    Yield (relative image path, yolo rows, (width, height)) of a
+    COCO JSON file. Categories are matched by name with
+    categories if given, else by their position sorted by id
+    """
+    with open(path, 'r', encoding='utf8') as f:
+        data = json.load(f)
+    if categories is not None:
+        by_name = {name: idx for idx, name in categories.items()}
+        indexes = {}
+        for category in data['categories']:
+            if category['name'] not in by_name:
+                raise Exception(
+                    "Category not found: %s" % category['name']
+                )
+            indexes[category['id']] = by_name[category['name']]
+    else:
+        indexes = {
+            category['id']: position for position, category in
+            enumerate(sorted(data['categories'], key=lambda c: c['id']))
+        }
+    annotations = {}
+    for annotation in data['annotations']:
+        annotations.setdefault(annotation['image_id'], []).append(
+            (indexes[annotation['category_id']], annotation['bbox'])
+        )
+    for image in data['images']:
+        boxes = annotations.pop(image['id'], [])
+        width, height = image['width'], image['height']
+        rows = yoloRows(
+            [idx for idx, _ in boxes], [box for _, box in boxes],
+            width, height,
+        )
+        yield image['file_name'], rows, (width, height)
+
+
+def readVoc(directory, categories):
+    """
+    Yield (relative image path, yolo rows, (width, height)) of the
+    VOC annotations of directory (and its subdirectories)
+    """
+    by_name = {name: idx for idx, name in categories.items()}
+    for parent, subdirectories, names in os.walk(directory):
+        subdirectories.sort()
+        for name in sorted(names):
+            if not name.endswith('.xml'):
+                continue
+            path = os.path.join(parent, name)
+            root = ElementTree.parse(path).getroot()
+            width = int(root.findtext('size/width'))
+            height = int(root.findtext('size/height'))
+            idx = []
+            boxes = []
+            for obj in root.iter('object'):
+                category = obj.findtext('name')
+                if category not in by_name:
+                    raise Exception(
+                        "Category not found: %s (%s)" % (category, path)
+                    )
+                x_min, y_min, x_max, y_max = (
+                    float(obj.findtext('bndbox/' + tag))
+                    for tag in ('xmin', 'ymin', 'xmax', 'ymax')
+                )
+                idx.append(by_name[category])
+                boxes.append((x_min, y_min, x_max - x_min, y_max - y_min))
+            relative = os.path.join(
+                os.path.relpath(parent, directory), root.findtext('filename')
+            )
+            yield (os.path.normpath(relative),
+                   yoloRows(idx, boxes, width, height), (width, height))
+
+
+def readPacked(path):
+    """
+    Yield (relative image path, yolo rows, None) of a packed file
+    """
+    packed = PackedLabels(path)
+    for i in range(len(packed)):
+        yield (packed.imagePath(i), packed.boxes(i).astype(np.float64),
+               None)
+
+
+def importLabels(fmt, path, categories=None):
+    """
+    Yield (relative image path, yolo rows, size or None) of an export
+    """
+    if fmt == COCO:
+        return readCoco(path, categories)
+    if fmt == VOC:
+        if categories is None:
+            raise Exception("voc import needs the category names")
+        return readVoc(path, categories)
+    if fmt == PACKED:
+        return readPacked(path)
+    raise Exception("Unknown import format %s" % fmt)
+
+
+def importedLabelPath(root, relative_path):
+    return labelPath(os.path.join(root, relative_path))
+
+
+def sameRows(rows, other, size=None, tolerance=None):
+    """
+    True if both yolo rows have the same boxes in any order.
+    Coordinates are compared in pixels if size is given,
+    else tolerance is in normalized units. Without tolerance,
+    PIXEL_TOLERANCE or NORMALIZED_TOLERANCE
+    """
+    if tolerance is None:
+        tolerance = NORMALIZED_TOLERANCE if size is None else \
+            PIXEL_TOLERANCE
+    if rows.shape != other.shape:
+        return False
+    if not len(rows):
+        return True
+    scale = np.ones(5)
+    if size is not None:
+        width, height = size
+        scale[1:] = (width, height, width, height)
+    rows = rows * scale
+    other = other * scale
+    used = np.zeros(len(other), dtype=bool)
+    for row in rows:
+        found = np.nonzero(
+            ~used & (other[:, 0] == row[0]) &
+            (np.abs(other[:, 1:] - row[1:]) <= tolerance).all(axis=1)
+        )[0]
+        if not len(found):
+            return False
+        used[found[0]] = True
+    return True
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from libs.label_writer import writeAtomic
+from libs.samples import DELETED, VISIBLE
+
+
+# Kinds of edits
+CATEGORY = 'category'
+DELETE = 'delete'
+VISIBILITY = 'visibility'
+
+_FLAGS = {DELETE: DELETED, VISIBILITY: VISIBLE}
+# Saved files keep 6 decimals of the coordinates
+MATCH_TOLERANCE = 1e-5
+
+
+def historyPath(cache_dir, root):
+    """
+    Journal file of the edits of a dataset directory
+    """
+    key = os.path.abspath(root)
+    name = hashlib.sha1(key.encode('utf8')).hexdigest()[:16] + '.journal'
+    return os.path.join(os.path.expanduser(cache_dir), 'history', name)
+
+
+class Command(object):
+
+    """
+    Edit of some boxes of a label file. Boxes are identified by
+    their yolo coordinates and category, not by row, so a command
+    still applies once the file was saved and read again.
+    boxes: (n, 4) center_x, center_y, width, height
+    idx: (n,) final category of the boxes before the edit
+    old / new: (n,) final category (CATEGORY) or flag value
+    """
+
+    __slots__ = ('path', 'kind', 'boxes', 'idx', 'old', 'new')
+
+    def __init__(self, path, kind, boxes, idx, old, new):
+        self.path = path
+        self.kind = kind
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.idx = np.asarray(idx, dtype=np.int64)
+        self.old = np.asarray(old, dtype=np.int64)
+        self.new = np.asarray(new, dtype=np.int64)
+
+    def isNoop(self):
+        return bool(np.array_equal(self.old, self.new))
+
+    def coalesce(self, other):
+        """
+        Merge other, done right after self on the same boxes,
+        into self. Return False if they can not be merged
+        """
+        if other.path != self.path or other.kind != self.kind:
+            return False
+        if other.boxes.shape != self.boxes.shape:
+            return False
+        if not np.array_equal(other.old, self.new):
+            return False
+        if self.kind != CATEGORY and \
+                not np.array_equal(other.idx, self.idx):
+            return False
+        if not np.allclose(other.boxes, self.boxes, rtol=0,
+                           atol=MATCH_TOLERANCE):
+            return False
+        self.new = other.new
+        return True
+
+    def toJson(self):
+        return [self.path, self.kind, self.boxes.tolist(), self.idx.tolist(),
+                self.old.tolist(), self.new.tolist()]
+
+    @classmethod
+    def fromJson(cls, values):
+        return cls(*values)
+
+
+def _matchRows(grouper, command, current):
+    """
+    Row of each box of command in grouper, -1 if missing.
+    Rows whose state is current are preferred; a deleted box
+    must be matched by a deleted row
+    """
+    yolo = grouper.yoloColumns()
+    if command.kind == CATEGORY:
+        idx = current
+        state = None
+    else:
+        idx = command.idx
+        state = grouper.store.hasFlag(_FLAGS[command.kind])
+    used = np.zeros(len(yolo), dtype=bool)
+    rows = np.full(len(command.boxes), -1, dtype=np.int64)
+    for i, box in enumerate(command.boxes):
+        found = (
+            ~used & (yolo[:, 0] == idx[i]) &
+            (np.abs(yolo[:, 1:] - box) <= MATCH_TOLERANCE).all(axis=1)
+        )
+        if state is not None:
+            preferred = found & (state == bool(current[i]))
+            if command.kind == DELETE or preferred.any():
+                found = preferred
+        candidates = np.nonzero(found)[0]
+        if len(candidates):
+            rows[i] = candidates[0]
+            used[candidates[0]] = True
+    return rows
+
+
+def applyCommand(grouper, command, undo=False):
+    """
+    Apply (or revert) command to the samples of grouper.
+    Return the rows changed
+    """
+    current, target = command.old, command.new
+    if undo:
+        current, target = target, current
+    rows = _matchRows(grouper, command, current)
+    changed = []
+    for i, row in enumerate(rows.tolist()):
+        value = int(target[i])
+        if row < 0:
+            if command.kind == DELETE and not value and current[i]:
+                # Deleted box already removed from the file
+                changed.append(grouper.restoreRow(
+                    [command.idx[i]] + command.boxes[i].tolist()
+                ))
+            continue
+        sample = grouper.sample(row)
+        if command.kind == CATEGORY:
+            if value == sample.idx:
+                sample.resetCategory()
+            else:
+                sample.setCategory(value)
+        elif command.kind == DELETE:
+            sample.setDeleted(bool(value))
+        elif value:
+            sample.setVisible()
+        else:
+            sample.setInvisible()
+        changed.append(row)
+    return changed
+
+
+class History(object):
+
+    """
+    Undo / redo stacks of Commands. Every change of the stacks is
+    appended to a journal (JSON lines, flushed to disk), so the
+    history survives a crash or a restart. The journal is rewritten
+    with the live commands only when it grows too long
+    """
+
+    def __init__(self, journal_path=None, limit=1000):
+        self.journal_path = journal_path
+        self.limit = limit
+        self.undo_stack = []
+        self.redo_stack = []
+        # Consecutive edits of the same boxes are merged until sealed
+        self._sealed = True
+        self._journal = None
+        self._entries = 0
+        if journal_path is not None:
+            self._load()
+            self._compact()
+
+    def _load(self):
+        if not os.path.exists(self.journal_path):
+            return False
+        with open(self.journal_path, 'r', encoding='utf8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn write of a crash: the rest is lost
+                    break
+                try:
+                    self._replay(entry)
+                except IndexError:
+                    break
+                self._entries += 1
+        return True
+
+    def _replay(self, entry):
+        op = entry[0]
+        if op == 'do':
+            self._push(Command.fromJson(entry[1]))
+        elif op == 'amend':
+            self.undo_stack[-1].new = np.asarray(entry[1], dtype=np.int64)
+        elif op == 'drop':
+            self.undo_stack.pop()
+        elif op == 'undo':
+            self.redo_stack.append(self.undo_stack.pop())
+        elif op == 'redo':
+            self.undo_stack.append(self.redo_stack.pop())
+        return True
+
+    def _push(self, command):
+        self.undo_stack.append(command)
+        self.redo_stack = []
+        if len(self.undo_stack) > self.limit:
+            del self.undo_stack[:len(self.undo_stack) - self.limit]
+        return True
+
+    def _append(self, entry):
+        if self.journal_path is None:
+            return False
+        if self._journal is None:
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            self._journal = open(self.journal_path, 'a', encoding='utf8')
+        self._journal.write(json.dumps(entry) + '\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._entries += 1
+        if self._entries > 4 * self.limit + 100:
+            self._compact()
+        return True
+
+    def _compact(self):
+        """
+        Rewrite the journal with the commands of the stacks
+        """
+        if self.journal_path is None or not self._entries:
+            return False
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        commands = self.undo_stack + self.redo_stack[::-1]
+        lines = [json.dumps(['do', command.toJson()]) for command in commands]
+        lines += [json.dumps(['undo'])] * len(self.redo_stack)
+        content = ''.join(line + '\n' for line in lines)
+        writeAtomic(self.journal_path, content.encode('utf8'))
+        self._entries = len(lines)
+        return True
+
+    def record(self, command):
+        """
+        Add a command done by the user
+        """
+        if not self._sealed and self.undo_stack and \
+                self.undo_stack[-1].coalesce(command):
+            self.redo_stack = []
+            if self.undo_stack[-1].isNoop():
+                self.undo_stack.pop()
+                return self._append(['drop'])
+            return self._append(['amend', command.new.tolist()])
+        if command.isNoop():
+            return False
+        self._push(command)
+        self._sealed = False
+        return self._append(['do', command.toJson()])
+
+    def seal(self):
+        """
+        Do not merge the next command with the last one
+        """
+        self._sealed = True
+        return True
+
+    def canUndo(self):
+        return bool(self.undo_stack)
+
+    def canRedo(self):
+        return bool(self.redo_stack)
+
+    def undo(self, apply):
+        """
+        Revert the last command with apply(command, undo=True).
+        Nothing changes if apply returns False
+        """
+        if not self.undo_stack:
+            return False
+        if not apply(self.undo_stack[-1], True):
+            return False
+        self.redo_stack.append(self.undo_stack.pop())
+        self._sealed = True
+        return self._append(['undo'])
+
+    def redo(self, apply):
+        """
+        Apply again the last undone command with apply(command, undo=False)
+        """
+        if not self.redo_stack:
+            return False
+        if not apply(self.redo_stack[-1], False):
+            return False
+        self.undo_stack.append(self.redo_stack.pop())
+        self._sealed = True
+        return self._append(['redo'])
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        return True
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+
+import numpy as np
+
+from libs.dataset_index import sourcePath
+
+
+class ImageSizes(object):
+
+    """
+    Cache of the image sizes (width, height) keyed by path,
+    refreshed when the file mtime or size change.
+    read(path) -> (width, height) or None
+    """
+
+    def __init__(self, read):
+        self.read = read
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        try:
+            stat = os.stat(sourcePath(path))
+        except OSError:
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._sizes.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        size = self.read(path)
+        with self._lock:
+            self._sizes[path] = (stamp, size)
+        return size
+
+
+class LabelIndex(object):
+
+    """
+    Labels of the dataset images in arrays aligned with the
+    image list, to select images by class, box count, box size or
+    issues. Images whose label file was not read yet, or could not
+    be read, have boxes == -1 and are never selected
+    """
+
+    def __init__(self, images, boxes, classes, size_range, issues=None):
+        self.images = images
+        # (n,) boxes per image
+        self.boxes = boxes
+        # (n,) invalid lines and boxes per image
+        if issues is None:
+            issues = np.zeros(len(images), dtype=np.int64)
+        self.issues = issues
+        # (n, classes) bool, image has boxes of the class
+        self.classes = classes
+        # (n, 4) min width, min height, max width, max height (pixels)
+        self.size_range = size_range
+
+    def __len__(self):
+        return len(self.images)
+
+    @classmethod
+    def build(cls, images, labels, stats, sizes=None):
+        """
+        Index images / labels (same order) from the FileStats of
+        stats. The normalized box sizes are converted to pixels with
+        sizes (ImageSizes), else they stay normalized
+        """
+        count = len(images)
+        boxes = np.full(count, -1, dtype=np.int64)
+        size_range = np.full((count, 4), np.nan, dtype=np.float64)
+        issues = np.zeros(count, dtype=np.int64)
+        class_counts = []
+        for i, path in enumerate(labels):
+            file_stats = stats.get(path)
+            if file_stats is None or file_stats.error is not None:
+                class_counts.append(())
+                continue
+            boxes[i] = file_stats.boxes
+            issues[i] = file_stats.issues
+            class_counts.append(file_stats.class_counts)
+            if file_stats.size_range is None:
+                continue
+            size_range[i] = file_stats.size_range
+            if sizes is not None:
+                size = sizes.get(images[i])
+                if size is None:
+                    size_range[i] = np.nan
+                else:
+                    width, height = size
+                    size_range[i] *= (width, height, width, height)
+        columns = max((len(counts) for counts in class_counts), default=0)
+        classes = np.zeros((count, columns), dtype=bool)
+        for i, counts in enumerate(class_counts):
+            if len(counts):
+                classes[i, :len(counts)] = np.asarray(counts) > 0
+        return cls(list(images), boxes, classes, size_range, issues)
+
+    def select(self, classes=None, min_boxes=None, max_boxes=None,
+               smaller_than=None, larger_than=None, issues=None,
+               known_classes=None):
+        """
+        Positions of the images matching every given condition:
+        classes: has a box of any of these classes
+        min_boxes / max_boxes: box count range
+        smaller_than: has a box narrower or lower than this size
+        larger_than: has a box wider or higher than this size
+        issues: has an invalid line or box, or a box of a class not
+        in known_classes (if given)
+        """
+        mask = self.boxes >= 0
+        if classes is not None:
+            classes = [i for i in classes if 0 <= i < self.classes.shape[1]]
+            mask &= self.classes[:, classes].any(axis=1)
+        if min_boxes is not None:
+            mask &= self.boxes >= min_boxes
+        if max_boxes is not None:
+            mask &= self.boxes <= max_boxes
+        # nan (no boxes or unknown size) compares False
+        with np.errstate(invalid='ignore'):
+            if smaller_than is not None:
+                mask &= self.size_range[:, :2].min(axis=1) < smaller_than
+            if larger_than is not None:
+                mask &= self.size_range[:, 2:].max(axis=1) > larger_than
+        if issues:
+            flagged = self.issues > 0
+            if known_classes is not None:
+                unknown = np.ones(self.classes.shape[1], dtype=bool)
+                unknown[[i for i in known_classes
+                         if 0 <= i < len(unknown)]] = False
+                flagged |= self.classes[:, unknown].any(axis=1)
+            mask &= flagged
+        return np.nonzero(mask)[0]
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+import warnings
+
+import numpy as np
+
+
+# Whitespace bytes between the elements of a line
+_SPACES = (ord(' '), ord('\t'), ord('\r'))
+_NEWLINE = ord('\n')
+# SampleObject._truncate
+_FACTOR = 10.0 ** 6
+_LOST_DECIMALS = 0.0000001
+
+
+def _lineTokenCounts(data, line_count):
+    """
+    Number of space separated elements of each line of data (bytes)
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    newline = buf == _NEWLINE
+    space = newline.copy()
+    for char in _SPACES:
+        space |= buf == char
+    starts = ~space
+    starts[1:] &= space[:-1]
+    line_ids = np.cumsum(newline)[starts]
+    return np.bincount(line_ids, minlength=line_count)[:line_count]
+
+
+def countLines(data):
+    """
+    Number of lines (boxes) of a label file content
+    """
+    if not data:
+        return 0
+    return data.count(b'\n') + (not data.endswith(b'\n'))
+
+
+def _invalidLine(data, path, line_number, reason):
+    line = data.split(b'\n')[line_number].decode('utf8', 'replace')
+    raise Exception(
+        "Invalid config file: %s \n. Line %s.\n%s: %s"
+        % (path, line_number, reason, str(line.split()))
+    )
+
+
+def _parseValues(data):
+    """
+    All the numbers of data. Parsing stops at the first invalid
+    number (DeprecationWarning on old numpy, ValueError on new ones)
+    """
+    text = data.decode('utf8')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        try:
+            return np.fromstring(text, sep=' ')
+        except ValueError:
+            pass
+    values = []
+    for token in text.split():
+        try:
+            values.append(float(token))
+        except ValueError:
+            break
+    return np.array(values, dtype=np.float64)
+
+
+def parseLabels(data, path=''):
+    """
+    Parse the content (bytes) of a yolo label file into a
+    (n, 5) float64 array: idx, center_x, center_y, width, height
+    """
+    line_count = countLines(data)
+    if not line_count:
+        return np.zeros((0, 5), dtype=np.float64)
+    counts = _lineTokenCounts(data, line_count)
+    bad_lines = np.nonzero(counts != 5)[0]
+    if len(bad_lines):
+        _invalidLine(data, path, bad_lines[0], "Expected 5 elements")
+    values = _parseValues(data)
+    if values.size != line_count * 5:
+        _invalidLine(data, path, values.size // 5, "Invalid number")
+    return values.reshape(-1, 5)
+
+
+def readLabelData(path):
+    """
+    Content of a label file. The label file of an image of a shard
+    not written yet is read from the shard (libs.shards)
+    """
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        # Imported when needed: libs.shards imports this module
+        from libs.shards import shardSource
+        data = shardSource().labelData(path)
+        if data is None:
+            raise
+        return data
+
+
+def readLabels(path):
+    """
+    Read a yolo label file into a (n, 5) float64 array
+    """
+    return parseLabels(readLabelData(path), path)
+
+
+def readLabelsMany(paths):
+    """
+    Read many label files with a single parse.
+    Return (rows, offsets): the rows of paths[i] are
+    rows[offsets[i]:offsets[i + 1]]
+    """
+    chunks = []
+    line_counts = []
+    for path in paths:
+        data = readLabelData(path)
+        if data and not data.endswith(b'\n'):
+            data += b'\n'
+        chunks.append(data)
+        line_counts.append(countLines(data))
+    offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+    np.cumsum(line_counts, out=offsets[1:])
+    data = b''.join(chunks)
+    line_count = int(offsets[-1])
+    if not line_count:
+        return np.zeros((0, 5), dtype=np.float64), offsets
+    counts = _lineTokenCounts(data, line_count)
+    bad_lines = np.nonzero(counts != 5)[0]
+    if len(bad_lines):
+        line = int(bad_lines[0])
+        i = int(np.searchsorted(offsets, line, side='right')) - 1
+        parseLabels(chunks[i], paths[i])
+    values = _parseValues(data)
+    if values.size != line_count * 5:
+        line = values.size // 5
+        i = int(np.searchsorted(offsets, line, side='right')) - 1
+        parseLabels(chunks[i], paths[i])
+    return values.reshape(-1, 5), offsets
+
+
+def truncateValues(values):
+    """
+    Vectorized SampleObject._truncate without the string formatting
+    """
+    return np.trunc((values + _LOST_DECIMALS) * _FACTOR) / _FACTOR
+
+
+def formatLabels(rows):
+    """
+    Format (n, 5) rows as the content of a label file.
+    Same output as writing SampleObject.getYoloFormat rows
+    with the csv writer
+    """
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, 5)
+    idx = rows[:, 0].astype(np.int64).tolist()
+    values = [
+        repr(value).ljust(8, '0')
+        for value in truncateValues(rows[:, 1:]).ravel().tolist()
+    ]
+    lines = [
+        '%s %s %s %s %s\r\n' % (idx[i], *values[i * 4:i * 4 + 4])
+        for i in range(len(idx))
+    ]
+    return ''.join(lines)
+
+
+def readObjNames(path):
+    """
+    Read an obj.names file: {index: category name}
+    """
+    with open(path, 'r') as f:
+        obj_names = f.readlines()
+    return {
+        i: name.replace('\n', '')
+        for i, name in enumerate(obj_names)
+    }
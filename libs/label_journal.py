@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: journals of running sessions are not detected
+    fcntl = None
+
+from libs.label_writer import writeAtomic
+
+
+EXTENSION = '.wal'
+
+
+def _encode(content):
+    return content.decode('utf8', 'surrogateescape')
+
+
+def _decode(text):
+    return text.encode('utf8', 'surrogateescape')
+
+
+class LabelJournal(object):
+
+    """
+    Write-ahead log of the label files of a session. Every
+    content is appended (and fsynced) before the label file is
+    replaced, so a crash never loses a submitted edit: the
+    entries not marked applied are written again by
+    recoverJournals on the next start. Entries are JSON lines:
+    ['write', seq, path, content, crc32, time] and
+    ['applied', [seq, ...]].
+    Safe to call from the GUI and the writer threads
+    """
+
+    def __init__(self, path, compact_bytes=1024 * 1024):
+        self.path = path
+        self.compact_bytes = compact_bytes
+        self._seq = 0
+        self._unapplied = set()
+        # write may not land between the emptiness check and the
+        # truncation of compact
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf8')
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    @classmethod
+    def create(cls, directory, compact_bytes=1024 * 1024):
+        """
+        New journal of this session in directory
+        """
+        name = '%s-%s%s' % (os.getpid(), time.time_ns(), EXTENSION)
+        return cls(os.path.join(directory, name), compact_bytes)
+
+    def _append(self, entry, sync):
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+        return True
+
+    def write(self, path, content):
+        """
+        Log content (bytes) of path. Return its sequence number
+        """
+        with self._lock:
+            self._seq += 1
+            self._append([
+                'write', self._seq, os.path.abspath(path),
+                _encode(content), zlib.crc32(content), time.time(),
+            ], sync=True)
+            self._unapplied.add(self._seq)
+            return self._seq
+
+    def applied(self, seqs):
+        """
+        Mark entries as written to their label files. The journal
+        is emptied once everything is applied and it grew too long
+        """
+        if not seqs:
+            return False
+        with self._lock:
+            # Lost on a crash the entries are only written again
+            self._append(['applied', list(seqs)], sync=False)
+            self._unapplied.difference_update(seqs)
+            if not self._unapplied and \
+                    self._file.tell() > self.compact_bytes:
+                self._compact()
+        return True
+
+    def pending(self):
+        with self._lock:
+            return len(self._unapplied)
+
+    def compact(self):
+        """
+        Drop the applied entries. Only done when nothing is
+        pending, so the journal is just emptied
+        """
+        with self._lock:
+            return self._compact()
+
+    def _compact(self):
+        if self._unapplied:
+            return False
+        os.fsync(self._file.fileno())
+        self._file.truncate(0)
+        self._file.seek(0)
+        return True
+
+    def close(self, remove=True):
+        """
+        Close the journal, removed if every entry was applied
+        """
+        with self._lock:
+            if self._file is None:
+                return False
+            self._file.close()
+            self._file = None
+            if remove and not self._unapplied:
+                os.remove(self.path)
+        return True
+
+
+def readJournal(path):
+    """
+    Last logged content of every label file of journal path
+    that was not applied: {label path: (content, time)}.
+    A torn or corrupted entry ends the journal
+    """
+    writes = {}
+    latest = {}
+    applied = set()
+    with open(path, 'r', encoding='utf8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                if entry[0] == 'write':
+                    _, seq, label_path, text, crc, stamp = entry
+                    content = _decode(text)
+                    if zlib.crc32(content) != crc:
+                        break
+                    writes[seq] = (label_path, content, stamp)
+                    latest[label_path] = seq
+                elif entry[0] == 'applied':
+                    applied.update(entry[1])
+            except (ValueError, IndexError, TypeError):
+                break
+    return {
+        label_path: writes[seq][1:]
+        for label_path, seq in latest.items() if seq not in applied
+    }
+
+
+def _isLocked(path):
+    """
+    True if a running session holds the journal path
+    """
+    if fcntl is None:
+        return False
+    with open(path, 'a') as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    return False
+
+
+def recoverJournals(directory):
+    """
+    Replay the journals left by sessions that did not close.
+    A label file modified after its entry was logged is newer
+    and is kept. Return (recovered paths, [(path, error)]);
+    a journal with failed writes is kept for the next start
+    """
+    recovered = []
+    errors = []
+    if not os.path.isdir(directory):
+        return recovered, errors
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not name.endswith(EXTENSION) or _isLocked(path):
+            continue
+        failed = False
+        for label_path, (content, stamp) in readJournal(path).items():
+            try:
+                if os.path.exists(label_path) and \
+                        os.stat(label_path).st_mtime > stamp:
+                    continue
+                writeAtomic(label_path, content)
+            except OSError as e:
+                errors.append((label_path, e))
+                failed = True
+                continue
+            recovered.append(label_path)
+        if not failed:
+            os.remove(path)
+    return recovered, errors
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+
+def writeAtomic(path, content):
+    """
+    Replace path with content (bytes) using a temporary
+    file in the same directory and a rename, so readers
+    never see a half written file
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    # Label files of video frames go in a directory of their own
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp'
+    )
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+
+class LabelWriter(object):
+
+    """
+    Write label files on a background thread.
+    Consecutive writes of the same path are coalesced
+    and only the last content is written.
+    With a LabelJournal every content is logged before submit
+    returns, and the pending files are written in batches every
+    delay seconds (or at once when waited for)
+    """
+
+    def __init__(self, journal=None, delay=0):
+        self.journal = journal
+        self.delay = delay if journal is not None else 0
+        # path: (content, journal seq)
+        self._pending = {}
+        self._order = []
+        self._errors = []
+        # Journal entries replaced by a later submit of their path
+        self._superseded = []
+        self._waiting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name='label-writer', daemon=True
+        )
+        self._thread.start()
+
+    def _gather(self):
+        """
+        Let more writes arrive before a batch, called locked
+        """
+        deadline = time.monotonic() + self.delay
+        while not self._closed and not self._waiting:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._cond.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._order and not self._closed:
+                    self._cond.wait()
+                if not self._order:
+                    return
+                if self.delay:
+                    self._gather()
+                batch = [(path, self._pending[path]) for path in self._order]
+                applied, self._superseded = self._superseded, []
+            for path, (content, seq) in batch:
+                try:
+                    writeAtomic(path, content)
+                except Exception as e:
+                    with self._cond:
+                        self._errors.append((path, e))
+                    continue
+                if seq is not None:
+                    applied.append(seq)
+            if applied:
+                try:
+                    self.journal.applied(applied)
+                except Exception as e:
+                    with self._cond:
+                        self._errors.append((self.journal.path, e))
+            with self._cond:
+                for path, entry in batch:
+                    self._order.remove(path)
+                    if self._pending.get(path) is entry:
+                        del self._pending[path]
+                    else:
+                        # Submitted again while writing
+                        self._order.append(path)
+                self._cond.notify_all()
+
+    def submit(self, path, content):
+        if isinstance(content, str):
+            content = content.encode('utf8')
+        with self._cond:
+            if self._closed:
+                raise Exception("LabelWriter is closed")
+            # Logged under the lock: the journal order is the
+            # submit order
+            seq = None
+            if self.journal is not None:
+                seq = self.journal.write(path, content)
+            if path not in self._pending:
+                self._order.append(path)
+            elif self._pending[path][1] is not None:
+                self._superseded.append(self._pending[path][1])
+            self._pending[path] = (content, seq)
+            self._cond.notify_all()
+        return True
+
+    def isPending(self, path):
+        with self._cond:
+            return path in self._pending
+
+    def wait(self, path=None):
+        """
+        Block until path (or every file if None) is written
+        """
+        with self._cond:
+            self._waiting += 1
+            self._cond.notify_all()
+            try:
+                while (self._pending if path is None
+                       else path in self._pending):
+                    self._cond.wait()
+            finally:
+                self._waiting -= 1
+        return True
+
+    def takeErrors(self):
+        """
+        Return and forget the (path, exception) failed writes
+        """
+        with self._cond:
+            errors, self._errors = self._errors, []
+        return errors
+
+    def close(self):
+        """
+        Write the pending files and close the journal, which is
+        kept if some writes failed
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        if self.journal is not None:
+            self.journal.close()
+        return True
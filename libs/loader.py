@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from libs.cache import LRUCache
+
+
+class BackgroundLoader(object):
+
+    """
+    Load values on worker threads into an LRU cache.
+    load(*args) -> value
+    on_ready(key) is called from the worker thread
+    failed is the value of the keys whose load raised, kept until
+    they are invalidated; None loads them again on next get
+    """
+
+    def __init__(self, load, max_bytes, sizeof, workers=2, on_ready=None,
+                 name='loader', failed=None):
+        self.load = load
+        self.on_ready = on_ready
+        self.failed = failed
+        self._cache = LRUCache(max_bytes, sizeof)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=name
+        )
+        self._pending = {}
+        # Bumped by invalidate: results of older loads are dropped
+        self._generation = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, *args):
+        """
+        Return the value if loaded, else queue load(*args)
+        and return None
+        """
+        value = self._cache.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            if key not in self._pending:
+                self._pending[key] = self._executor.submit(
+                    self._load, key, self._generation.get(key, 0), args
+                )
+        return None
+
+    def _load(self, key, generation, args):
+        try:
+            value = self.load(*args)
+        except Exception:
+            value = self.failed
+        with self._lock:
+            current = self._generation.get(key, 0) == generation
+            if current:
+                if value is not None:
+                    self._cache.put(key, value)
+                self._pending.pop(key, None)
+        if current and value is not None and self.on_ready is not None:
+            self.on_ready(key)
+        return value
+
+    def invalidate(self, key):
+        """
+        Forget the value of key, it is loaded again on next get
+        """
+        with self._lock:
+            self._generation[key] = self._generation.get(key, 0) + 1
+            future = self._pending.pop(key, None)
+        if future is not None:
+            future.cancel()
+        self._cache.pop(key)
+        return True
+
+    def cancelExcept(self, keys):
+        """
+        Drop queued loads that are not in keys (no longer needed)
+        """
+        keys = set(keys)
+        with self._lock:
+            stale = [
+                (key, future) for key, future in self._pending.items()
+                if key not in keys
+            ]
+        for key, future in stale:
+            if future.cancel():
+                with self._lock:
+                    if self._pending.get(key) is future:
+                        self._pending.pop(key)
+        return True
+
+    def shutdown(self):
+        self.cancelExcept(())
+        self._executor.shutdown(wait=False)
+        return True
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from libs.cache import LRUCache
+
+
+class Prefetcher(object):
+
+    """
+    Decode images and parse label files ahead of the
+    navigation on worker threads.
+    decode(path, max_height) -> image
+    parse(label_path) -> label rows
+    """
+
+    def __init__(self, decode, parse, max_bytes, sizeof, workers=2,
+                 max_labels=32):
+        self.decode = decode
+        self.parse = parse
+        self._images = LRUCache(max_bytes, sizeof)
+        self._labels = LRUCache(max_labels)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='prefetch'
+        )
+        self._pending = {}
+        self._generation = {}
+        self._lock = threading.Lock()
+
+    def _imageKey(self, path, max_height):
+        return ('image', path, max_height)
+
+    def _labelKey(self, path):
+        return ('label', path)
+
+    def _submit(self, key, cache, fn, *args):
+        """
+        Queue fn(*args) unless the key is cached or in progress.
+        The result is stored only if the key was not invalidated
+        while the job was running
+        """
+        with self._lock:
+            if key in self._pending or key in cache:
+                return self._pending.get(key)
+            generation = self._generation.get(key, 0)
+
+            def job():
+                value = fn(*args)
+                with self._lock:
+                    if self._generation.get(key, 0) == generation:
+                        cache.put(key, value)
+                return value
+
+            future = self._executor.submit(job)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return future
+
+    def _done(self, key, future):
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def _fetch(self, key, cache, fn, *args):
+        value = cache.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            # Jobs of an invalidated key are no longer pending
+            future = self._pending.get(key)
+            generation = self._generation.get(key, 0)
+        if future is not None and not future.cancel():
+            return future.result()
+        # Not requested yet: decode here instead of waiting in the queue
+        value = fn(*args)
+        with self._lock:
+            if self._generation.get(key, 0) == generation:
+                cache.put(key, value)
+        return value
+
+    def image(self, path, max_height):
+        key = self._imageKey(path, max_height)
+        return self._fetch(key, self._images, self.decode, path, max_height)
+
+    def labels(self, path):
+        key = self._labelKey(path)
+        return self._fetch(key, self._labels, self.parse, path)
+
+    def schedule(self, items, max_height):
+        """
+        Prefetch the (image_path, label_path) items in priority
+        order and drop queued jobs that are no longer needed
+        """
+        wanted = set()
+        for image_path, label_path in items:
+            key = self._imageKey(image_path, max_height)
+            wanted.add(key)
+            self._submit(key, self._images, self.decode,
+                         image_path, max_height)
+            if label_path:
+                key = self._labelKey(label_path)
+                wanted.add(key)
+                self._submit(key, self._labels, self.parse, label_path)
+        with self._lock:
+            stale = [
+                future for key, future in self._pending.items()
+                if key not in wanted
+            ]
+        for future in stale:
+            future.cancel()
+        return True
+
+    def invalidateLabels(self, path):
+        """
+        Forget the parsed rows of a label file that was rewritten.
+        A parse in progress is dropped: its result is not cached
+        nor returned
+        """
+        key = self._labelKey(path)
+        with self._lock:
+            self._generation[key] = self._generation.get(key, 0) + 1
+            future = self._pending.pop(key, None)
+        if future is not None:
+            future.cancel()
+        self._labels.pop(key)
+        return True
+
+    def shutdown(self):
+        with self._lock:
+            pending = list(self._pending.values())
+        for future in pending:
+            future.cancel()
+        self._executor.shutdown(wait=False)
+        return True
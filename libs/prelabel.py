@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import os
+import sqlite3
+import time
+
+import cv2
+import numpy as np
+
+from libs.batch import mapChunks
+from libs.dataset_index import sourcePath, splitFramePath, splitMemberPath
+from libs.shards import shardSource
+from libs.stats import fileStamp
+from libs.validation import boxEdges, overlapPairs
+from libs.video import frameSource
+
+
+# Letterbox padding value of the YOLO exports
+_PAD_VALUE = 114
+# Proposals overlapping a label of their class this much are dropped
+LABEL_IOU = 0.5
+
+# Detector of a worker process and the video index its frames are
+# read with, set by _initWorker
+_detector = None
+_video_index_path = None
+
+
+def _emptyRows():
+    return np.zeros((0, 6), dtype=np.float64)
+
+
+def readImage(path, video_index_path=None):
+    """
+    BGR image of path (also non ascii paths on Windows), of a
+    video frame path (read with the video index of the app if
+    given) or of an image of a shard
+    """
+    if splitFramePath(path) is not None:
+        return frameSource(video_index_path).frame(path)
+    if splitMemberPath(path) is not None:
+        data = np.frombuffer(shardSource().data(path), dtype=np.uint8)
+    else:
+        data = np.fromfile(path, dtype=np.uint8)
+    image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if image is None:
+        raise Exception("Could not decode %s" % path)
+    return image
+
+
+def letterbox(image, size):
+    """
+    image scaled to fit size x size and centered on padding.
+    Return (input, scale, (pad_x, pad_y))
+    """
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    new_width = max(int(round(width * scale)), 1)
+    new_height = max(int(round(height * scale)), 1)
+    resized = cv2.resize(image, (new_width, new_height),
+                         interpolation=cv2.INTER_LINEAR)
+    pad_x = (size - new_width) // 2
+    pad_y = (size - new_height) // 2
+    canvas = np.full((size, size, 3), _PAD_VALUE, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_height, pad_x:pad_x + new_width] = resized
+    return canvas, scale, (pad_x, pad_y)
+
+
+def decodeOutput(output, score_threshold, nms_threshold):
+    """
+    (n, 6) detections (class, center_x, center_y, width, height,
+    score) in input pixels of the output of one image: YOLOv5
+    rows (boxes, 5 + classes) with an objectness column, or
+    YOLOv8 columns (4 + classes, boxes) without it. Boxes of a
+    class overlapping more than nms_threshold are suppressed
+    """
+    output = np.asarray(output, dtype=np.float32)
+    if output.shape[0] < output.shape[1]:
+        rows = output.T
+        scores = rows[:, 4:]
+    else:
+        rows = output
+        scores = rows[:, 5:] * rows[:, 4:5]
+    if not scores.shape[1] or not len(rows):
+        return _emptyRows()
+    classes = scores.argmax(axis=1)
+    score = scores[np.arange(len(rows)), classes]
+    keep = score >= score_threshold
+    boxes = rows[keep, :4].astype(np.float64)
+    classes, score = classes[keep], score[keep]
+    if not len(boxes):
+        return _emptyRows()
+    # Boxes of different classes are moved apart so a single
+    # NMS never suppresses across classes
+    offset = classes * (np.abs(boxes).max() * 4 + 1)
+    rects = np.column_stack((
+        boxes[:, 0] - boxes[:, 2] / 2 + offset,
+        boxes[:, 1] - boxes[:, 3] / 2 + offset,
+        boxes[:, 2], boxes[:, 3],
+    ))
+    kept = cv2.dnn.NMSBoxes(rects.tolist(), score.tolist(),
+                            score_threshold, nms_threshold)
+    kept = np.asarray(kept, dtype=np.int64).reshape(-1)
+    return np.column_stack((classes[kept], boxes[kept], score[kept]))
+
+
+def toYolo(detections, scale, pad, image_size):
+    """
+    Detections in input pixels to rows normalized to the image
+    (width, height), clipped to it. Boxes left without area
+    are dropped
+    """
+    width, height = image_size
+    pad_x, pad_y = pad
+    cx = (detections[:, 1] - pad_x) / scale
+    cy = (detections[:, 2] - pad_y) / scale
+    half_width = detections[:, 3] / scale / 2
+    half_height = detections[:, 4] / scale / 2
+    lx = np.clip((cx - half_width) / width, 0, 1)
+    rx = np.clip((cx + half_width) / width, 0, 1)
+    ly = np.clip((cy - half_height) / height, 0, 1)
+    ry = np.clip((cy + half_height) / height, 0, 1)
+    rows = np.column_stack((
+        detections[:, 0], (lx + rx) / 2, (ly + ry) / 2, rx - lx, ry - ly,
+        detections[:, 5],
+    ))
+    return rows[(rows[:, 3] > 0) & (rows[:, 4] > 0)]
+
+
+class Detector(object):
+
+    """
+    YOLO detector exported to ONNX, run on the CPU with OpenCV
+    DNN. Images are sent to the network in batches; a model
+    exported with a fixed batch size of 1 is run image by image
+    """
+
+    def __init__(self, model_path, input_size=640, score_threshold=0.25,
+                 nms_threshold=0.45, threads=None):
+        if threads:
+            cv2.setNumThreads(threads)
+        self.input_size = input_size
+        self.score_threshold = score_threshold
+        self.nms_threshold = nms_threshold
+        self.batched = True
+        # OpenCV backend on the CPU, the default
+        self.net = cv2.dnn.readNet(model_path)
+
+    def _forward(self, inputs):
+        blob = cv2.dnn.blobFromImages(
+            inputs, 1 / 255.0, (self.input_size, self.input_size),
+            swapRB=True, crop=False,
+        )
+        self.net.setInput(blob)
+        output = self.net.forward()
+        if output.shape[0] != len(inputs):
+            raise ValueError("Batch of %s images gave %s outputs"
+                             % (len(inputs), output.shape[0]))
+        return output
+
+    def detect(self, images):
+        """
+        (n, 6) rows (class, center_x, center_y, width, height,
+        score) of each BGR image, normalized to the image
+        """
+        if not images:
+            return []
+        letterboxed = [letterbox(image, self.input_size) for image in images]
+        inputs = [item[0] for item in letterboxed]
+        outputs = None
+        if self.batched and len(inputs) > 1:
+            try:
+                outputs = self._forward(inputs)
+            except (cv2.error, ValueError):
+                self.batched = False
+        if outputs is None:
+            outputs = [self._forward([item])[0] for item in inputs]
+        result = []
+        for image, (_, scale, pad), output in zip(images, letterboxed,
+                                                   outputs):
+            detections = decodeOutput(output, self.score_threshold,
+                                      self.nms_threshold)
+            height, width = image.shape[:2]
+            result.append(toYolo(detections, scale, pad, (width, height)))
+        return result
+
+
+def _initWorker(model_path, input_size, score_threshold, nms_threshold,
+                threads, video_index_path=None):
+    global _detector, _video_index_path
+    _detector = Detector(model_path, input_size, score_threshold,
+                         nms_threshold, threads)
+    _video_index_path = video_index_path
+
+
+def _detectChunk(paths):
+    """
+    [(path, stamp, rows, error)] of a batch of images, in a
+    worker process
+    """
+    images = []
+    found = []
+    results = []
+    for path in paths:
+        # Frames have the stamp of their video
+        stamp = fileStamp(sourcePath(path))
+        try:
+            images.append(readImage(path, _video_index_path))
+        except Exception as e:
+            results.append((path, stamp, None, str(e)))
+            continue
+        found.append((path, stamp))
+    try:
+        detections = _detector.detect(images)
+    except Exception as e:
+        return results + [(path, stamp, None, str(e))
+                          for path, stamp in found]
+    return results + [
+        (path, stamp, rows, None)
+        for (path, stamp), rows in zip(found, detections)
+    ]
+
+
+class Prelabeler(object):
+
+    """
+    Detector on a pool of worker processes, each loading the
+    model once and running batches of batch_size images with
+    threads OpenCV threads. Video frames are read with the video
+    index file video_index_path
+    """
+
+    def __init__(self, model_path, input_size=640, score_threshold=0.25,
+                 nms_threshold=0.45, workers=1, threads=None, batch_size=4,
+                 mp_context=None, video_index_path=None):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.images = 0
+        self.elapsed = 0.0
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=mp_context,
+            initializer=_initWorker,
+            initargs=(model_path, input_size, score_threshold,
+                      nms_threshold, threads, video_index_path),
+        )
+
+    def detect(self, paths):
+        """
+        Run the detector on paths. Yield the [(path, stamp, rows,
+        error)] of each batch, in order
+        """
+        start = time.perf_counter()
+        for results in mapChunks(_detectChunk, paths, (), self.workers,
+                                 self.batch_size, executor=self.executor):
+            now = time.perf_counter()
+            self.images += len(results)
+            self.elapsed += now - start
+            start = now
+            yield results
+
+    def throughput(self):
+        """
+        Images per second
+        """
+        if not self.elapsed:
+            return 0.0
+        return self.images / self.elapsed
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        return True
+
+
+def proposalPath(cache_dir, model_path, *params):
+    """
+    Proposal store of a model (and its file version) run with
+    params inside cache_dir
+    """
+    stamp = fileStamp(model_path)
+    key = repr((os.path.abspath(model_path), stamp, params))
+    name = hashlib.sha1(key.encode('utf8')).hexdigest()[:16] + '.sqlite'
+    return os.path.join(os.path.expanduser(cache_dir), 'prelabel', name)
+
+
+class ProposalStore(object):
+
+    """
+    Persistent (SQLite) detections of images, run again when
+    the image mtime or size change
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS proposals ("
+        " path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER,"
+        " rows BLOB)",
+    )
+
+    def __init__(self, db_path):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path)
+        for statement in self.SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def get(self, paths):
+        """
+        ({path: rows} of the paths stored and unchanged, the
+        other paths)
+        """
+        found = {}
+        missing = []
+        for path in paths:
+            row = self.db.execute(
+                "SELECT mtime, size, rows FROM proposals WHERE path = ?",
+                (path,)
+            ).fetchone()
+            if row is None or \
+                    tuple(row[:2]) != fileStamp(sourcePath(path)):
+                missing.append(path)
+                continue
+            found[path] = np.frombuffer(row[2], dtype=np.float64) \
+                .reshape(-1, 6)
+        return found, missing
+
+    def put(self, results):
+        """
+        Store the detections of Prelabeler.detect results, the
+        images that failed are not stored
+        """
+        self.db.executemany(
+            "INSERT OR REPLACE INTO proposals VALUES (?, ?, ?, ?)",
+            [
+                (path, *stamp, rows.astype(np.float64).tobytes())
+                for path, stamp, rows, error in results
+                if error is None and stamp is not None
+            ]
+        )
+        self.db.commit()
+        return True
+
+
+def newProposals(proposals, labels, categories, iou_threshold=LABEL_IOU):
+    """
+    Proposals (n, 6) of classes in categories that do not
+    overlap a label (m, 5) of their class at least iou_threshold
+    """
+    proposals = proposals[np.isin(
+        proposals[:, 0], [i for i, name in categories.items() if name]
+    )]
+    if not len(proposals) or not len(labels):
+        return proposals
+    rows = np.concatenate((labels[:, :5], proposals[:, :5]))
+    lx, ly, rx, ry = boxEdges(rows)
+    _, groups = np.unique(rows[:, 0], return_inverse=True)
+    valid = np.nonzero((rows[:, 3] > 0) & (rows[:, 4] > 0))[0]
+    first, second, _ = overlapPairs(
+        groups.reshape(-1)[valid], lx[valid], ly[valid], rx[valid],
+        ry[valid], iou_threshold,
+    )
+    first, second = valid[first], valid[second]
+    count = len(labels)
+    covered = second[(first < count) & (second >= count)] - count
+    keep = np.ones(len(proposals), dtype=bool)
+    keep[covered] = False
+    return proposals[keep]
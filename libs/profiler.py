@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class Profiler(object):
+
+    """
+    Latency of named stages. The last window durations of each
+    stage are kept for rolling percentiles. While tracing every
+    stage is also recorded as a Chrome trace event (open the
+    file in chrome://tracing or https://ui.perfetto.dev)
+    """
+
+    def __init__(self, window=1000, max_events=1000000):
+        self.window = window
+        self.max_events = max_events
+        self._durations = {}
+        self._events = None
+        self._profile = None
+        self._lock = threading.Lock()
+        self._start = time.perf_counter_ns()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter_ns())
+
+    def wrap(self, name, fn):
+        """
+        fn timed as stage name on every call
+        """
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return timed
+
+    def add(self, name, start, end):
+        """
+        Record a stage from start to end (perf_counter_ns)
+        """
+        with self._lock:
+            durations = self._durations.get(name)
+            if durations is None:
+                durations = collections.deque(maxlen=self.window)
+                self._durations[name] = durations
+            durations.append(end - start)
+            if self._events is not None and \
+                    len(self._events) < self.max_events:
+                self._events.append({
+                    'name': name, 'ph': 'X', 'pid': os.getpid(),
+                    'tid': threading.get_ident(),
+                    'ts': (start - self._start) / 1000.0,
+                    'dur': (end - start) / 1000.0,
+                })
+        return True
+
+    def stages(self):
+        with self._lock:
+            return list(self._durations)
+
+    def percentiles(self, name, q=(50, 95, 99)):
+        """
+        Percentiles q of the last durations of stage name in
+        milliseconds, None if it never ran
+        """
+        with self._lock:
+            durations = self._durations.get(name)
+            if not durations:
+                return None
+            values = np.fromiter(durations, dtype=np.int64)
+        return (np.percentile(values, q) / 1e6).tolist()
+
+    def summary(self, names=None):
+        """
+        One line per stage: name p50 / p95 / p99 ms (count)
+        """
+        lines = []
+        for name in names or sorted(self.stages()):
+            values = self.percentiles(name)
+            if values is None:
+                continue
+            with self._lock:
+                count = len(self._durations[name])
+            lines.append('%s  %.1f / %.1f / %.1f ms  (%s)' % (
+                name, *values, count
+            ))
+        return '\n'.join(lines)
+
+    def isTracing(self):
+        return self._events is not None
+
+    def startTrace(self):
+        with self._lock:
+            self._events = []
+        return True
+
+    def stopTrace(self, path):
+        """
+        Write the trace events recorded since startTrace to path
+        """
+        with self._lock:
+            events, self._events = self._events, None
+        if events is None:
+            return False
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf8') as f:
+            json.dump({'traceEvents': events,
+                       'displayTimeUnit': 'ms'}, f)
+        return True
+
+    def isProfiling(self):
+        return self._profile is not None
+
+    def startProfile(self):
+        """
+        cProfile the calling thread (the GUI thread) until
+        stopProfile
+        """
+        if self._profile is not None:
+            return False
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        return True
+
+    def stopProfile(self, path):
+        """
+        Write the profile to path (pstats format, e.g. for snakeviz)
+        """
+        if self._profile is None:
+            return False
+        self._profile.disable()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._profile.dump_stats(path)
+        self._profile = None
+        return True
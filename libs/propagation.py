@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import threading
+
+import cv2
+import numpy as np
+
+from libs.cache import LRUCache
+from libs.loader import BackgroundLoader
+
+
+# Longest side (px) of the gray images the boxes are tracked on
+TRACK_SIZE = 640
+# Points tracked per box: a GRID x GRID grid inside it
+GRID = 4
+# Lucas-Kanade window (px) and pyramid levels
+WINDOW = (15, 15)
+LEVELS = 3
+# Points whose backward track ends farther than this (px) from
+# their start are dropped
+MAX_ERROR = 1.0
+# Boxes with less than this fraction of their points kept are
+# not propagated
+MIN_SCORE = 0.5
+# Max change of the box size between two images
+MAX_SCALE = 1.25
+# Memory budget of the tracking images kept (MB)
+IMAGE_CACHE_MB = 32
+
+
+def trackingImage(image, size=TRACK_SIZE):
+    """
+    Gray image of a BGR image, reduced to fit size x size
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    height, width = gray.shape
+    scale = size / max(height, width)
+    if scale < 1:
+        gray = cv2.resize(gray, (max(int(round(width * scale)), 1),
+                                 max(int(round(height * scale)), 1)),
+                          interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def gridPoints(rows, width, height, grid=GRID):
+    """
+    (n, grid * grid, 2) points (px) spread inside the boxes of
+    yolo rows, away from their edges
+    """
+    steps = (np.arange(grid) + 0.5) / grid - 0.5
+    offsets_x, offsets_y = np.meshgrid(steps, steps)
+    x = rows[:, 1:2] + offsets_x.reshape(1, -1) * rows[:, 3:4]
+    y = rows[:, 2:3] + offsets_y.reshape(1, -1) * rows[:, 4:5]
+    return np.stack((x * width, y * height), axis=2)
+
+
+def propagateBoxes(rows, previous, current, min_score=MIN_SCORE):
+    """
+    (n, 6) rows (class, center_x, center_y, width, height, score)
+    of the boxes (yolo rows) of the previous gray image moved to
+    the current one. A grid of points of every box is tracked
+    forward and backward at once (pyramidal Lucas-Kanade); the
+    points that do not come back are dropped. A box moves by the
+    median motion of its points and is scaled by the median change
+    of their spread. score is the fraction of points kept
+    """
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, 5)
+    if not len(rows) or previous.shape != current.shape:
+        return np.zeros((0, 6), dtype=np.float64)
+    height, width = previous.shape
+    start = gridPoints(rows, width, height)
+    count, points = start.shape[:2]
+    flat = start.reshape(-1, 1, 2).astype(np.float32)
+    moved, found, _ = cv2.calcOpticalFlowPyrLK(
+        previous, current, flat, None, winSize=WINDOW, maxLevel=LEVELS
+    )
+    back, found_back, _ = cv2.calcOpticalFlowPyrLK(
+        current, previous, moved, None, winSize=WINDOW, maxLevel=LEVELS
+    )
+    error = np.linalg.norm((back - flat).reshape(count, points, 2), axis=2)
+    good = (found.reshape(count, points) > 0) & \
+        (found_back.reshape(count, points) > 0) & (error < MAX_ERROR)
+    score = good.mean(axis=1)
+    keep = score >= max(min_score, 1.0 / points)
+    if not np.any(keep):
+        return np.zeros((0, 6), dtype=np.float64)
+    rows, score, good = rows[keep], score[keep], good[keep]
+    start = start[keep]
+    end = moved.reshape(count, points, 2)[keep].astype(np.float64)
+    # Points not kept do not count in the medians
+    start[~good] = np.nan
+    end[~good] = np.nan
+    shift = np.nanmedian(end - start, axis=1)
+    spread_start = np.linalg.norm(
+        start - np.nanmean(start, axis=1, keepdims=True), axis=2
+    )
+    spread_end = np.linalg.norm(
+        end - np.nanmean(end, axis=1, keepdims=True), axis=2
+    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(spread_start > 0, spread_end / spread_start, np.nan)
+    scale = np.ones(len(rows))
+    measured = np.any(np.isfinite(ratio), axis=1)
+    scale[measured] = np.nanmedian(ratio[measured], axis=1)
+    scale = np.clip(scale, 1 / MAX_SCALE, MAX_SCALE)
+    cx = rows[:, 1] + shift[:, 0] / width
+    cy = rows[:, 2] + shift[:, 1] / height
+    half_width = rows[:, 3] * scale / 2
+    half_height = rows[:, 4] * scale / 2
+    lx = np.clip(cx - half_width, 0, 1)
+    rx = np.clip(cx + half_width, 0, 1)
+    ly = np.clip(cy - half_height, 0, 1)
+    ry = np.clip(cy + half_height, 0, 1)
+    result = np.column_stack((
+        rows[:, 0], (lx + rx) / 2, (ly + ry) / 2, rx - lx, ry - ly, score,
+    ))
+    return result[(result[:, 3] > 0) & (result[:, 4] > 0)]
+
+
+class Propagator(BackgroundLoader):
+
+    """
+    Boxes of an image propagated to another on a worker thread,
+    keyed by (source path, target path, boxes digest). The gray
+    tracking images are prepared ahead and kept for the next ones.
+    read(path) -> BGR image
+    on_ready(key) is called from the worker thread. A propagation
+    that fails gives no boxes
+    """
+
+    def __init__(self, read, size=TRACK_SIZE, min_score=MIN_SCORE,
+                 on_ready=None):
+        super(Propagator, self).__init__(
+            self._propagate, 1024 * 1024, lambda rows: rows.nbytes + 64,
+            workers=1, on_ready=on_ready, name='propagation',
+            failed=np.zeros((0, 6), dtype=np.float64),
+        )
+        self.read = read
+        self.size = size
+        self.min_score = min_score
+        self._images = LRUCache(IMAGE_CACHE_MB * 1024 * 1024,
+                                lambda image: image.nbytes)
+        self._prepared = {}
+        self._prepared_lock = threading.Lock()
+
+    def trackingImage(self, path):
+        image = self._images.get(path)
+        if image is None:
+            image = trackingImage(self.read(path), self.size)
+            self._images.put(path, image)
+        return image
+
+    def _propagate(self, source, target, rows):
+        return propagateBoxes(rows, self.trackingImage(source),
+                              self.trackingImage(target), self.min_score)
+
+    def prepare(self, paths):
+        """
+        Queue the tracking images of paths (the current image and
+        the next one) so propagating to them only tracks. Queued
+        images not in paths are dropped
+        """
+        with self._prepared_lock:
+            for path, future in list(self._prepared.items()):
+                if future.done() or (path not in paths and future.cancel()):
+                    self._prepared.pop(path)
+            for path in paths:
+                if path not in self._prepared and path not in self._images:
+                    self._prepared[path] = self._executor.submit(
+                        self.trackingImage, path
+                    )
+        return True
+
+    def key(self, source, target, rows):
+        digest = hashlib.sha1(np.ascontiguousarray(rows).tobytes())
+        return (source, target, digest.hexdigest())
+
+    def boxes(self, source, target, rows):
+        """
+        Propagated rows if done, else queue the propagation and
+        return None
+        """
+        return self.get(self.key(source, target, rows), source, target,
+                        rows)
@@ -3,6 +3,134 @@
 import math
 import numpy as np
 
+from libs.spatial_index import GridIndex
+from libs.validation import badIndex
+
+
+# BoxStore flags
+VISIBLE = 1
+DELETED = 2
+CHANGED = 4
+NEW = 8
+# New boxes proposed by the detector, saved once accepted
+PROPOSED = 16
+
+
+class BoxStore(object):
+
+    """
+    Structure of arrays with the boxes of an image.
+    Normalized (center/size) and pixel (corners) coordinates
+    are stored as float64 columns so the 6 decimals truncation
+    of the yolo format gives the same result as python floats
+    """
+
+    FLOAT_COLUMNS = (
+        'center_x', 'center_y', 'width', 'height',
+        'lx', 'ly', 'rx', 'ry',
+    )
+    # Negative values mean "not set"
+    INT_COLUMNS = ('idx', 'new_idx', 'line_number')
+
+    def __init__(self, capacity=16):
+        self.size = 0
+        self.capacity = max(capacity, 1)
+        self.columns = {}
+        for name in self.FLOAT_COLUMNS:
+            self.columns[name] = np.zeros(self.capacity, dtype=np.float64)
+        for name in self.INT_COLUMNS:
+            self.columns[name] = np.full(self.capacity, -1, dtype=np.int32)
+        self.flags = np.zeros(self.capacity, dtype=np.uint8)
+        self.names = []
+        # Image size used to compute pixel coordinates
+        self.ratio = (1, 1)
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self, needed):
+        if needed <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        for name, column in self.columns.items():
+            fill = -1 if name in self.INT_COLUMNS else 0
+            new_column = np.full(capacity, fill, dtype=column.dtype)
+            new_column[:self.size] = column[:self.size]
+            self.columns[name] = new_column
+        flags = np.zeros(capacity, dtype=np.uint8)
+        flags[:self.size] = self.flags[:self.size]
+        self.flags = flags
+        self.capacity = capacity
+
+    def appendRows(self, count):
+        """
+        Reserve count rows and return their slice
+        """
+        start = self.size
+        self._grow(start + count)
+        self.size += count
+        self.flags[start:self.size] = VISIBLE
+        self.names.extend([None] * count)
+        return slice(start, self.size)
+
+    def column(self, name):
+        return self.columns[name][:self.size]
+
+    def hasFlag(self, flag):
+        return (self.flags[:self.size] & flag) != 0
+
+    def setFlag(self, rows, flag, value=True):
+        if value:
+            self.flags[rows] |= flag
+        else:
+            self.flags[rows] &= ~np.uint8(flag)
+        return True
+
+    def finalIdx(self):
+        new_idx = self.column('new_idx')
+        return np.where(new_idx < 0, self.column('idx'), new_idx)
+
+    def copyRow(self, other, other_row):
+        """
+        Append a row of another store and return its index
+        """
+        row = self.appendRows(1).start
+        for name, column in self.columns.items():
+            column[row] = other.columns[name][other_row]
+        self.flags[row] = other.flags[other_row]
+        self.names[row] = other.names[other_row]
+        return row
+
+
+def _float_column(name):
+    def fget(self):
+        return float(self._store.columns[name][self._row])
+
+    def fset(self, value):
+        self._store.columns[name][self._row] = value
+    return property(fget, fset)
+
+
+def _int_column(name):
+    def fget(self):
+        value = int(self._store.columns[name][self._row])
+        return None if value < 0 else value
+
+    def fset(self, value):
+        self._store.columns[name][self._row] = -1 if value is None else value
+    return property(fget, fset)
+
+
+def _flag(flag):
+    def fget(self):
+        return bool(self._store.flags[self._row] & flag)
+
+    def fset(self, value):
+        self._store.setFlag(self._row, flag, value)
+    return property(fget, fset)
+
 
 class SampleGrouper(object):
 
@@ -11,74 +139,392 @@ class SampleGrouper(object):
     def __init__(self, categories):
         self.categories = categories
         self.categories_color = {}
-        self.samples = []
-        self.new_samples = []
+        self.store = BoxStore()
+        self._views = []
+        self._index = None
         self.line_number = None
 
+    @property
+    def samples(self):
+        return [self.sample(row) for row in range(len(self.store))]
+
+    @property
+    def new_samples(self):
+        rows = np.nonzero(self.store.hasFlag(NEW))[0]
+        return [self.sample(row) for row in rows]
+
+    def sample(self, row):
+        """
+        Return the SampleObject view of a store row
+        """
+        row = int(row)
+        while len(self._views) <= row:
+            self._views.append(None)
+        if self._views[row] is None:
+            self._views[row] = SampleObject.fromStore(self.store, row)
+        return self._views[row]
+
+    def _addColor(self, idx):
+        if idx not in self.categories_color:
+            self.categories_color[idx] = list(
+                np.random.choice(range(256), size=3)
+            ) + [255]
+
     def addSample(self, sample):
         if sample.idx is None:
             raise Exception(
                 "Sample must be idx before appending to Gruper"
             )
-        self.samples.append(sample)
-        if sample.isNew():
-            self.new_samples.append(sample)
-        if sample.idx not in self.categories_color:
-            self.categories_color[sample.idx] = list(
-                np.random.choice(range(256), size=3)
-            ) + [255]
+        row = self.store.copyRow(sample._store, sample._row)
+        sample._store, sample._row = self.store, row
+        while len(self._views) <= row:
+            self._views.append(None)
+        self._views[row] = sample
+        self._addColor(sample.idx)
+        self._indexRows(np.array([row]))
+
+    def addYoloRows(self, rows, ratio=(1, 1), categories=None,
+                    line_numbers=None):
+        """
+        Append yolo rows (idx, center_x, center_y, width, height)
+        at once. Same checks and math as SampleObject.addYoloCfg
+        """
+        categories = self.categories if categories is None else categories
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, 5)
+        count = len(rows)
+        # -1 is the index of the samples without category
+        bad = np.nonzero(badIndex(rows[:, 0]))[0]
+        if len(bad):
+            raise Exception("Invalid class index %s" % rows[bad[0], 0])
+        idx = rows[:, 0].astype(np.int32)
+        for i in range(count):
+            if not categories.get(int(idx[i]), False):
+                raise Exception("Category not found for index %s" % idx[i])
+        if line_numbers is None:
+            line_numbers = np.arange(count)
+        W, H = ratio
+        store = self.store
+        store.ratio = ratio
+        new_rows = store.appendRows(count)
+        columns = store.columns
+        columns['idx'][new_rows] = idx
+        columns['line_number'][new_rows] = line_numbers
+        center_x = columns['center_x'][new_rows] = rows[:, 1]
+        center_y = columns['center_y'][new_rows] = rows[:, 2]
+        width = columns['width'][new_rows] = rows[:, 3]
+        height = columns['height'][new_rows] = rows[:, 4]
+        columns['lx'][new_rows] = (center_x - (width / 2)) * W
+        columns['rx'][new_rows] = (center_x + (width / 2)) * W
+        columns['ly'][new_rows] = (center_y - (height / 2)) * H
+        columns['ry'][new_rows] = (center_y + (height / 2)) * H
+        store.names[new_rows] = [categories[int(i)] for i in idx]
+        for i in np.unique(idx):
+            self._addColor(int(i))
+        self._indexRows(np.arange(new_rows.start, new_rows.stop))
+        return new_rows
+
+    def spatialIndex(self):
+        """
+        Grid index over the pixel coordinates, built on first use
+        """
+        if self._index is None:
+            store = self.store
+            self._index = GridIndex()
+            self._index.build(
+                np.arange(len(store)),
+                store.column('lx'), store.column('ly'),
+                store.column('rx'), store.column('ry'),
+            )
+        return self._index
+
+    def _indexRows(self, rows):
+        if self._index is None:
+            return False
+        columns = self.store.columns
+        for row in rows.tolist():
+            self._index.insert(
+                row, columns['lx'][row], columns['ly'][row],
+                columns['rx'][row], columns['ry'][row],
+            )
+        return True
+
+    def updateSample(self, sample):
+        """
+        Reindex a sample after its box coordinates changed
+        """
+        return self._indexRows(np.array([sample._row]))
+
+    def _filterRows(self, rows, only_visible, include_deleted, idx):
+        store = self.store
+        flags = store.flags[rows]
+        keep = np.ones(len(rows), dtype=bool)
+        if only_visible:
+            keep &= (flags & VISIBLE) != 0
+        if not include_deleted:
+            keep &= (flags & DELETED) == 0
+        if idx is not None:
+            keep &= store.finalIdx()[rows] == idx
+        return rows[keep]
+
+    def rowsAt(self, x, y, only_visible=False, include_deleted=False,
+               idx=None):
+        """
+        Rows of the boxes containing (x, y), smallest box first.
+        Deleted boxes and category changes are filtered at query time
+        """
+        rows = self.spatialIndex().candidatesAt(x, y)
+        columns = self.store.columns
+        lx, ly = columns['lx'][rows], columns['ly'][rows]
+        rx, ry = columns['rx'][rows], columns['ry'][rows]
+        inside = (
+            (np.minimum(lx, rx) <= x) & (x <= np.maximum(lx, rx)) &
+            (np.minimum(ly, ry) <= y) & (y <= np.maximum(ly, ry))
+        )
+        rows = self._filterRows(rows[inside], only_visible,
+                                include_deleted, idx)
+        area = np.abs(
+            (columns['rx'][rows] - columns['lx'][rows]) *
+            (columns['ry'][rows] - columns['ly'][rows])
+        )
+        return rows[np.argsort(area, kind='stable')]
+
+    def rowsIn(self, lx, ly, rx, ry, only_visible=False,
+               include_deleted=False, idx=None):
+        """
+        Rows of the boxes intersecting the rectangle
+        """
+        rows = self.spatialIndex().candidatesIn(lx, ly, rx, ry)
+        columns = self.store.columns
+        blx, bly = columns['lx'][rows], columns['ly'][rows]
+        brx, bry = columns['rx'][rows], columns['ry'][rows]
+        inside = (
+            (np.minimum(blx, brx) <= max(lx, rx)) &
+            (np.maximum(blx, brx) >= min(lx, rx)) &
+            (np.minimum(bly, bry) <= max(ly, ry)) &
+            (np.maximum(bly, bry) >= min(ly, ry))
+        )
+        return self._filterRows(rows[inside], only_visible,
+                                include_deleted, idx)
+
+    def samplesAt(self, x, y, **kwargs):
+        return [self.sample(row) for row in self.rowsAt(x, y, **kwargs)]
+
+    def samplesIn(self, lx, ly, rx, ry, **kwargs):
+        return [
+            self.sample(row) for row in self.rowsIn(lx, ly, rx, ry, **kwargs)
+        ]
+
+    def _groupRows(self, idx, mask):
+        """
+        Rows of mask grouped by idx in order of first appearance
+        """
+        groups = {}
+        rows = np.nonzero(mask)[0]
+        if not len(rows):
+            return groups
+        keys, first = np.unique(idx[rows], return_index=True)
+        for key in keys[np.argsort(first)]:
+            groups[int(key)] = rows[idx[rows] == key]
+        return groups
+
+    def getRowsGrouped(self, only_visible=False):
+        """
+        Return store rows grouped by category
+        if only_visible is True only return visible rows
+        """
+        mask = np.ones(len(self.store), dtype=bool)
+        if only_visible:
+            mask = self.store.hasFlag(VISIBLE)
+        return self._groupRows(self.store.column('idx'), mask)
 
     def getSamplesGrouped(self, only_visible=False):
         """
         Return samples grouped
         if only_visible is True only return visible samples
         """
-        groups = {}
-        for sample in self.samples:
-            if not sample.isVisible() and only_visible:
-                continue
-            if sample.idx not in groups:
-                groups[sample.idx] = []
-            groups[sample.idx].append(sample)
-        return groups
+        return {
+            idx: [self.sample(row) for row in rows]
+            for idx, rows in self.getRowsGrouped(only_visible).items()
+        }
 
     def prepareSamplesToSave(self):
         """
         Return samples changed grouped
         by cateogry to save
         """
-        groups = {}
-        for sample in self.samples:
-            sample_idx = sample.getFinalIdx()
-            if sample_idx not in groups:
-                groups[sample_idx] = []
-            groups[sample_idx].append(sample)
-        return groups
+        mask = np.ones(len(self.store), dtype=bool)
+        groups = self._groupRows(self.store.finalIdx(), mask)
+        return {
+            idx: [self.sample(row) for row in rows]
+            for idx, rows in groups.items()
+        }
+
+    def restoreRow(self, yolo_row):
+        """
+        Add back a box that is no longer in the label file
+        (undo of a saved delete). It is saved as a new sample.
+        A class unknown to categories is named by its index, as
+        when the file was loaded
+        """
+        row = len(self.store)
+        idx = int(yolo_row[0])
+        categories = self.categories
+        if not categories.get(idx, False):
+            categories = {**categories, idx: str(idx)}
+        rows = self.addYoloRows(
+            [yolo_row], ratio=self.store.ratio, categories=categories,
+            line_numbers=[row]
+        )
+        self.store.setFlag(rows, NEW)
+        return row
+
+    def addProposals(self, rows):
+        """
+        Add detector boxes (idx, center_x, center_y, width, height)
+        as new samples to accept or reject. The label file does
+        not change until they are accepted
+        """
+        rows = self.addYoloRows(
+            np.asarray(rows)[:, :5], ratio=self.store.ratio,
+            line_numbers=np.arange(len(rows)) + len(self.store),
+        )
+        self.store.setFlag(rows, NEW | PROPOSED)
+        return rows
+
+    def proposalRows(self):
+        """
+        Rows of the proposals not accepted nor deleted
+        """
+        store = self.store
+        return np.nonzero(
+            store.hasFlag(PROPOSED) & ~store.hasFlag(DELETED)
+        )[0]
+
+    def acceptProposals(self, rows=None):
+        """
+        Turn proposals into new samples, saved with the others
+        """
+        rows = self.proposalRows() if rows is None else rows
+        self.store.setFlag(rows, PROPOSED, False)
+        return len(rows)
+
+    def rejectProposals(self, rows=None):
+        rows = self.proposalRows() if rows is None else rows
+        self.store.setFlag(rows, DELETED)
+        self.store.setFlag(rows, VISIBLE, False)
+        return len(rows)
 
     def setGroupVisibility(self, idx, visible):
-        for sample in self.samples:
-            if sample.idx != idx:
-                continue
-            if visible:
-                sample.setVisible()
-            else:
-                sample.setInvisible()
+        rows = self.store.column('idx') == idx
+        self.store.setFlag(np.nonzero(rows)[0], VISIBLE, visible)
         return True
 
+    def isDirty(self):
+        """
+        True if saving would change the label file: new (not deleted)
+        samples, deleted samples or samples with a new category.
+        Proposals count once accepted
+        """
+        store = self.store
+        new = store.hasFlag(NEW)
+        deleted = store.hasFlag(DELETED)
+        proposed = store.hasFlag(PROPOSED)
+        new_idx = store.column('new_idx')
+        recategorized = (new_idx >= 0) & (new_idx != store.column('idx'))
+        return bool(np.any((new ^ deleted) & ~proposed) or
+                    np.any(recategorized & ~new))
+
+    def yoloColumns(self):
+        """
+        Return the (n, 5) yolo rows of every sample, in store
+        order. Same math as getYoloFormat
+        """
+        store = self.store
+        W, H = store.ratio
+        lx, ly = store.column('lx'), store.column('ly')
+        rx, ry = store.column('rx'), store.column('ry')
+        return np.column_stack((
+            store.finalIdx(),
+            (lx + rx)/2/W,
+            (ly + ry)/2/H,
+            (rx - lx)/W,
+            (ry - ly)/H,
+        ))
+
+    def getYoloRows(self):
+        """
+        Return the (n, 5) yolo rows to save: not deleted samples
+        sorted by final category. Proposals not accepted are left out
+        """
+        store = self.store
+        rows = self.yoloColumns()
+        keep = np.nonzero(
+            ~store.hasFlag(DELETED) & ~store.hasFlag(PROPOSED)
+        )[0]
+        order = np.argsort(rows[keep, 0], kind='stable')
+        return rows[keep[order]]
+
+    def getBoxes(self):
+        """
+        Return boxes as (lx, ly, rx, ry, idx) tuples
+        """
+        store = self.store
+        return list(zip(
+            store.column('lx').tolist(), store.column('ly').tolist(),
+            store.column('rx').tolist(), store.column('ry').tolist(),
+            store.column('idx').tolist(),
+        ))
+
 
 class SampleObject(object):
 
+    """
+    Box view over a BoxStore row. A standalone sample owns
+    a one row store until it is added to a SampleGrouper
+    """
+
+    __slots__ = ('_store', '_row', '_W', '_H')
+
+    idx = _int_column('idx')
+    _new_idx = _int_column('new_idx')
+    line_number = _int_column('line_number')
+    center_x = _float_column('center_x')
+    center_y = _float_column('center_y')
+    width = _float_column('width')
+    height = _float_column('height')
+    lx = _float_column('lx')
+    ly = _float_column('ly')
+    rx = _float_column('rx')
+    ry = _float_column('ry')
+    _visible = _flag(VISIBLE)
+    _deleted = _flag(DELETED)
+    _changed = _flag(CHANGED)
+    _new = _flag(NEW)
+
     def __init__(self, ratio=(1, 1)):
         if len(ratio) != 2:
             raise Exception("Bad Ratio. Must be (float, float)")
-        self.idx = None
+        self._store = BoxStore(capacity=1)
+        self._store.ratio = tuple(ratio)
+        self._row = self._store.appendRows(1).start
         self._W = ratio[0]
         self._H = ratio[1]
-        self._visible = True
-        self._new_idx = None
-        self._new = False
-        self._changed = False
-        self._deleted = False
+
+    @classmethod
+    def fromStore(cls, store, row):
+        sample = cls.__new__(cls)
+        sample._store = store
+        sample._row = row
+        sample._W, sample._H = store.ratio
+        return sample
+
+    @property
+    def category_name(self):
+        return self._store.names[self._row]
+
+    @category_name.setter
+    def category_name(self, value):
+        self._store.names[self._row] = value
 
     def _truncate(self, number):
         """
@@ -125,7 +571,7 @@ class SampleObject(object):
         return True
 
     def resetCategory(self):
-        if self._new_idx:
+        if self._new_idx is not None:
             self._new_idx = None
             self._changed = False
         return True
@@ -183,4 +629,8 @@ class SampleObject(object):
         self.rx = rx
         self.ry = ry
         self.idx = idx
+        self.center_x = (lx + rx) / 2 / self._W
+        self.center_y = (ly + ry) / 2 / self._H
+        self.width = (rx - lx) / self._W
+        self.height = (ry - ly) / self._H
         return True
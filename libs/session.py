@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+from libs.label_writer import writeAtomic
+
+
+SESSION_VERSION = 1
+SESSION_NAME = 'session.json'
+# Keys of a session state
+KEYS = ('image_directory', 'obj_names_path', 'image', 'image_index')
+
+
+def sessionPath(cache_dir):
+    """
+    Session state file inside cache_dir
+    """
+    return os.path.join(os.path.expanduser(cache_dir), SESSION_NAME)
+
+
+def loadSession(path):
+    """
+    {key: value} state saved by saveSession, None if there is
+    none or it cannot be read: the app then starts empty
+    """
+    try:
+        with open(path, 'r', encoding='utf8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(state, dict) or \
+            state.get('version') != SESSION_VERSION:
+        return None
+    return {key: state.get(key) for key in KEYS}
+
+
+def saveSession(path, image_directory, obj_names_path, image=None,
+                image_index=-1):
+    """
+    Save the dataset directory, obj.names file and current image
+    (path and position) opened again on the next start. The image
+    list itself is read back from the dataset index
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    state = {
+        'version': SESSION_VERSION,
+        'image_directory': image_directory,
+        'obj_names_path': obj_names_path,
+        'image': image,
+        'image_index': image_index,
+    }
+    writeAtomic(path, json.dumps(state, indent=1).encode('utf8'))
+    return True
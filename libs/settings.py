@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+
+SETTINGS_PATH = './settings.json'
+
+DEFAULTS = {
+    # Number of images decoded ahead / behind the current one
+    'prefetch_next': 3,
+    'prefetch_prev': 1,
+    # Memory budget for decoded images (MB)
+    'image_cache_mb': 512,
+    # Memory budget for full resolution tiles shown when zooming (MB)
+    'tile_cache_mb': 256,
+    'decode_threads': 2,
+    # Processes computing the dataset statistics (null: one per CPU)
+    'stats_workers': None,
+    # Thumbnails of the image browser: side (px), memory and disk budgets
+    'thumbnail_size': 128,
+    'thumbnail_cache_mb': 64,
+    'thumbnail_disk_mb': 1024,
+    # Images whose perceptual hashes differ in at most this many
+    # bits (of 64) are duplicates
+    'duplicate_distance': 6,
+    # Boxes of the same class overlapping at least this much
+    # (intersection over union) are reported as duplicates
+    'duplicate_iou': 0.9,
+    # ONNX detector proposing boxes for the next images (null: off),
+    # its input side (px) and minimum score
+    'prelabel_model': None,
+    'prelabel_input_size': 640,
+    'prelabel_score': 0.25,
+    # Detector processes, OpenCV threads of each one, images run
+    # at once and images ahead of the current one to pre-label
+    'prelabel_workers': 1,
+    'prelabel_threads': 2,
+    'prelabel_batch': 4,
+    'prelabel_ahead': 8,
+    # Boxes propagated to the next image are tracked on gray images
+    # of this side (px); boxes with less than this fraction of
+    # their points tracked are dropped
+    'propagate_size': 640,
+    'propagate_score': 0.5,
+    # Edits kept in the undo history
+    'undo_limit': 1000,
+    # Saved labels are journaled at once and written in batches
+    # at most this late (seconds)
+    'label_flush_seconds': 2,
+    # Index files and other caches
+    'cache_dir': '~/.cache/pyyolomark',
+    # Look for images in subdirectories of the image path
+    'scan_recursive': False,
+}
+
+
+class Settings(object):
+
+    """
+    User settings. Defaults are overridden by the keys
+    found in settings.json
+    """
+
+    def __init__(self, path=SETTINGS_PATH):
+        self.path = path
+        self.values = dict(DEFAULTS)
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'r', encoding='utf8') as f:
+            values = json.load(f)
+        unknown = set(values) - set(DEFAULTS)
+        if unknown:
+            raise Exception(
+                "Unknown settings in %s: %s" % (self.path, sorted(unknown))
+            )
+        self.values.update(values)
+        return True
+
+    def get(self, key):
+        return self.values[key]
+
+    def set(self, key, value):
+        if key not in DEFAULTS:
+            raise Exception("Unknown setting %s" % key)
+        self.values[key] = value
+        return True
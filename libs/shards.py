@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from libs.dataset_index import IMAGE_EXTENSIONS, labelPath, memberLabelPath
+from libs.dataset_index import memberPath, splitMemberPath, splitOverlayPath
+from libs.stats import fileStamp
+
+
+# Compression of the members (zip methods)
+STORED = 0
+DEFLATED = 8
+# Shards kept open (memory mapped) by a ShardSource
+OPEN_SHARDS = 8
+# Zip local file header: name and extra field lengths at 26
+_ZIP_HEADER = struct.Struct('<26xHH')
+_ZIP_HEADER_SIZE = 30
+
+
+class ShardIndex(object):
+
+    """
+    Members of a tar or zip shard: name, offset and size of their
+    bytes in the file, and their compression. Tar members are
+    always stored
+    """
+
+    def __init__(self, path, stamp, names, offsets, sizes, methods):
+        self.path = path
+        self.stamp = stamp
+        self.names = names
+        self.offsets = offsets
+        self.sizes = sizes
+        self.methods = methods
+        self._positions = {name: i for i, name in enumerate(names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def position(self, name):
+        try:
+            return self._positions[name]
+        except KeyError:
+            raise Exception("No member %s in %s" % (name, self.path))
+
+
+def _tarMembers(path):
+    # Imported when needed: tarfile and zipfile are slow to import
+    import tarfile
+    try:
+        shard = tarfile.open(path, 'r:')
+    except tarfile.ReadError as e:
+        raise Exception("Could not read the tar %s (compressed tar "
+                        "shards can not be read in place): %s" % (path, e))
+    with shard:
+        for member in shard:
+            if member.isfile():
+                yield member.name, member.offset_data, member.size, STORED
+
+
+def _zipMembers(path):
+    import zipfile
+    with zipfile.ZipFile(path) as shard, open(path, 'rb') as f:
+        for info in shard.infolist():
+            if info.is_dir():
+                continue
+            # The data follows the local header, whose extra field
+            # may differ from the central directory one
+            f.seek(info.header_offset)
+            name_size, extra_size = _ZIP_HEADER.unpack(
+                f.read(_ZIP_HEADER_SIZE)
+            )
+            offset = info.header_offset + _ZIP_HEADER_SIZE + name_size + \
+                extra_size
+            method = info.compress_type
+            if info.flag_bits & 0x1:
+                # Encrypted: never readable in place
+                method = -1
+            yield info.filename, offset, info.compress_size, method
+
+
+def indexShard(path):
+    """
+    ShardIndex of a tar or zip file, read from its headers only
+    """
+    stamp = fileStamp(path)
+    if path.lower().endswith('.zip'):
+        members = list(_zipMembers(path))
+    else:
+        members = list(_tarMembers(path))
+    names = []
+    for name, _, _, _ in members:
+        while name.startswith('./'):
+            name = name[2:]
+        names.append(name)
+    columns = np.array([member[1:] for member in members],
+                       dtype=np.int64).reshape(-1, 3)
+    return ShardIndex(path, stamp, names, columns[:, 0].copy(),
+                      columns[:, 1].copy(), columns[:, 2].copy())
+
+
+class ShardIndexStore(object):
+
+    """
+    Persistent (SQLite) ShardIndex of shards, built again when
+    the shard mtime or size change
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS shards ("
+        " path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER,"
+        " names BLOB, offsets BLOB, sizes BLOB, methods BLOB)",
+    )
+
+    def __init__(self, db_path):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path)
+        for statement in self.SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def get(self, path):
+        """
+        Stored ShardIndex of path, None if missing or stale
+        """
+        row = self.db.execute(
+            "SELECT mtime, size, names, offsets, sizes, methods FROM shards"
+            " WHERE path = ?", (path,)
+        ).fetchone()
+        stamp = fileStamp(path)
+        if row is None or tuple(row[:2]) != stamp:
+            return None
+        # Member names never contain NUL
+        names = row[2].decode('utf8').split('\0') if row[2] else []
+        return ShardIndex(path, stamp, names,
+                          np.frombuffer(row[3], dtype=np.int64),
+                          np.frombuffer(row[4], dtype=np.int64),
+                          np.frombuffer(row[5], dtype=np.int64))
+
+    def put(self, index):
+        if index.stamp is None:
+            return False
+        self.db.execute(
+            "INSERT OR REPLACE INTO shards VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (index.path, *index.stamp,
+             '\0'.join(index.names).encode('utf8'),
+             index.offsets.tobytes(), index.sizes.tobytes(),
+             index.methods.tobytes())
+        )
+        self.db.commit()
+        return True
+
+    def index(self, path):
+        """
+        ShardIndex of path, built and stored if needed
+        """
+        index = self.get(path)
+        if index is None:
+            index = indexShard(path)
+            self.put(index)
+        return index
+
+
+def shardImages(index):
+    """
+    (image path, label path) of the images of a shard that have
+    labels, in the shard or already in its overlay directory
+    """
+    pairs = []
+    for name in sorted(index.names):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        label_path = memberLabelPath(index.path, name)
+        if labelPath(name) in index or os.path.exists(label_path):
+            pairs.append((memberPath(index.path, name), label_path))
+    return pairs
+
+
+class ShardReader(object):
+
+    """
+    Bytes of the members of a shard, sliced from the memory
+    mapped file: nothing is extracted
+    """
+
+    def __init__(self, path, index):
+        self.path = path
+        self.index = index
+        self.lock = threading.Lock()
+        with open(path, 'rb') as f:
+            # An empty file can not be mapped, it has no members
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) \
+                if os.fstat(f.fileno()).st_size else b''
+
+    def close(self):
+        with self.lock:
+            if not isinstance(self._map, bytes):
+                self._map.close()
+        return True
+
+    def read(self, name):
+        """
+        Content of the member name
+        """
+        i = self.index.position(name)
+        offset = int(self.index.offsets[i])
+        method = int(self.index.methods[i])
+        with self.lock:
+            data = self._map[offset:offset + int(self.index.sizes[i])]
+        if method == DEFLATED:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+        if method != STORED:
+            raise Exception("Unsupported compression of %s in %s" % (
+                name, self.path
+            ))
+        return data
+
+
+class ShardSource(object):
+
+    """
+    Members of shards by image path, with a ShardReader per open
+    shard (the least recently used are closed). The shard indexes
+    come from the ShardIndexStore at index_path, or are built.
+    Safe to call from worker threads
+    """
+
+    def __init__(self, index_path=None, open_shards=OPEN_SHARDS):
+        self.index_path = index_path
+        self.open_shards = open_shards
+        self._readers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _index(self, shard_path):
+        if self.index_path is None:
+            return indexShard(shard_path)
+        # SQLite connections stay in their thread
+        store = ShardIndexStore(self.index_path)
+        try:
+            return store.index(shard_path)
+        finally:
+            store.close()
+
+    def reader(self, shard_path):
+        with self._lock:
+            reader = self._readers.get(shard_path)
+            if reader is not None:
+                self._readers.move_to_end(shard_path)
+                return reader
+        reader = ShardReader(shard_path, self._index(shard_path))
+        closed = []
+        with self._lock:
+            if shard_path in self._readers:
+                # Opened meanwhile by another thread
+                closed.append(reader)
+                reader = self._readers[shard_path]
+            else:
+                self._readers[shard_path] = reader
+            while len(self._readers) > self.open_shards:
+                closed.append(self._readers.popitem(last=False)[1])
+        for old in closed:
+            old.close()
+        return reader
+
+    def data(self, path):
+        """
+        Content of an image of a shard
+        """
+        shard_path, name = splitMemberPath(path)
+        return self.reader(shard_path).read(name)
+
+    def _labelMember(self, path):
+        """
+        (reader, label member name) of an overlay label file, None
+        if its shard has no such member
+        """
+        member = splitOverlayPath(path)
+        if member is None or not os.path.exists(member[0]):
+            return None
+        reader = self.reader(member[0])
+        if member[1] not in reader.index:
+            return None
+        return reader, member[1]
+
+    def labelData(self, path):
+        """
+        Content of the label member of an overlay label file, None
+        if the shard has none
+        """
+        member = self._labelMember(path)
+        return None if member is None else member[0].read(member[1])
+
+    def labelStamp(self, path):
+        """
+        Stamp of the shard of an overlay label file if the shard
+        has its label member, else None
+        """
+        member = self._labelMember(path)
+        return None if member is None else member[0].index.stamp
+
+    def close(self):
+        with self._lock:
+            readers = list(self._readers.values())
+            self._readers.clear()
+        for reader in readers:
+            reader.close()
+        return True
+
+
+_index_path = None
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def setShardIndexPath(index_path):
+    """
+    Index file of the ShardSource given by shardSource() in this
+    process; without one the shards are indexed in memory
+    """
+    global _index_path
+    _index_path = index_path
+    return True
+
+
+def shardSource():
+    """
+    ShardSource shared by the threads of the process
+    """
+    with _sources_lock:
+        source = _sources.get(_index_path)
+        if source is None:
+            source = ShardSource(_index_path)
+            _sources[_index_path] = source
+        return source
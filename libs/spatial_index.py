@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+import numpy as np
+
+
+class GridIndex(object):
+
+    """
+    Uniform grid over boxes (lx, ly, rx, ry).
+    Each cell keeps the ids of the boxes overlapping it, so queries
+    only test the boxes of the cells they touch
+    """
+
+    def __init__(self, cell_size=64.0):
+        self.cell_size = float(cell_size)
+        self._cells = {}
+        self._boxes = {}
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def _cellRange(self, lx, ly, rx, ry):
+        size = self.cell_size
+        return (
+            int(math.floor(min(lx, rx) / size)),
+            int(math.floor(min(ly, ry) / size)),
+            int(math.floor(max(lx, rx) / size)),
+            int(math.floor(max(ly, ry) / size)),
+        )
+
+    def build(self, ids, lx, ly, rx, ry, cell_size=None):
+        """
+        Index all the boxes at once. Without cell_size the cell
+        is twice the median box side
+        """
+        self._cells = {}
+        self._boxes = {}
+        if cell_size is None and len(ids):
+            sides = np.concatenate((np.abs(rx - lx), np.abs(ry - ly)))
+            cell_size = max(float(np.median(sides)) * 2, 8.0)
+        if cell_size is not None:
+            self.cell_size = float(cell_size)
+        for box in zip(np.asarray(ids).tolist(), np.asarray(lx).tolist(),
+                       np.asarray(ly).tolist(), np.asarray(rx).tolist(),
+                       np.asarray(ry).tolist()):
+            self.insert(*box)
+        return True
+
+    def insert(self, box_id, lx, ly, rx, ry):
+        if box_id in self._boxes:
+            self.remove(box_id)
+        cells = self._cellRange(lx, ly, rx, ry)
+        self._boxes[box_id] = cells
+        cx0, cy0, cx1, cy1 = cells
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                self._cells.setdefault((cx, cy), []).append(box_id)
+        return True
+
+    def remove(self, box_id):
+        cells = self._boxes.pop(box_id, None)
+        if cells is None:
+            return False
+        cx0, cy0, cx1, cy1 = cells
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = self._cells[(cx, cy)]
+                cell.remove(box_id)
+                if not cell:
+                    del self._cells[(cx, cy)]
+        return True
+
+    def candidatesAt(self, x, y):
+        """
+        Ids of the boxes that may contain (x, y)
+        """
+        size = self.cell_size
+        key = (int(math.floor(x / size)), int(math.floor(y / size)))
+        return np.array(self._cells.get(key, ()), dtype=np.int64)
+
+    def candidatesIn(self, lx, ly, rx, ry):
+        """
+        Ids of the boxes that may intersect the rectangle
+        """
+        cx0, cy0, cx1, cy1 = self._cellRange(lx, ly, rx, ry)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cells):
+            # Large query: walk the cells instead of the area
+            found = [
+                ids for (cx, cy), ids in self._cells.items()
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1
+            ]
+        else:
+            found = [
+                self._cells[(cx, cy)]
+                for cx in range(cx0, cx1 + 1)
+                for cy in range(cy0, cy1 + 1)
+                if (cx, cy) in self._cells
+            ]
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(found).astype(np.int64))
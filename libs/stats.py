@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+
+from libs.batch import mapChunks
+from libs.dataset_index import splitOverlayPath
+from libs.label_io import readLabelData, readLabelsMany
+from libs.validation import DUPLICATE_IOU, badIndex, countIssues
+from libs.validation import parseLabelsChecked
+
+
+# Histogram bins of the normalized box width / height ([0, 1])
+SIZE_BINS = 20
+
+
+class FileStats(object):
+
+    """
+    Partial statistics of a label file.
+    stamp is (mtime_ns, size) of the file when it was read.
+    size_range is (min width, min height, max width, max height)
+    of its boxes, normalized. issues counts the invalid lines and
+    boxes (libs.validation), classes unknown to obj.names aside
+    """
+
+    __slots__ = ('path', 'stamp', 'boxes', 'class_counts', 'width_hist',
+                 'height_hist', 'size_range', 'issues', 'error')
+
+    def __init__(self, path, stamp, boxes=0, class_counts=None,
+                 width_hist=None, height_hist=None, size_range=None,
+                 issues=0, error=None):
+        self.path = path
+        self.stamp = stamp
+        self.boxes = boxes
+        self.issues = issues
+        if class_counts is None:
+            class_counts = np.zeros(0, dtype=np.int64)
+        if width_hist is None:
+            width_hist = np.zeros(SIZE_BINS, dtype=np.int64)
+        if height_hist is None:
+            height_hist = np.zeros(SIZE_BINS, dtype=np.int64)
+        self.class_counts = class_counts
+        self.width_hist = width_hist
+        self.height_hist = height_hist
+        self.size_range = size_range
+        self.error = error
+
+
+def fileStamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def labelStamp(path):
+    """
+    fileStamp of a label file. The label file of an image of a
+    shard not written yet has the stamp of the shard, if the
+    shard has labels for it
+    """
+    stamp = fileStamp(path)
+    if stamp is None and splitOverlayPath(path) is not None:
+        # Imported when needed: libs.shards imports this module
+        from libs.shards import shardSource
+        stamp = shardSource().labelStamp(path)
+    return stamp
+
+
+def _perFile(file_ids, values, files, bins):
+    """
+    (files, bins) counts of values (ints in [0, bins)) per file
+    """
+    counts = np.bincount(file_ids * bins + values, minlength=files * bins)
+    return counts.reshape(files, bins)
+
+
+def _sizeBins(values):
+    bins = (values * SIZE_BINS).astype(np.int64)
+    return np.clip(bins, 0, SIZE_BINS - 1)
+
+
+def computeStats(paths, iou_threshold=DUPLICATE_IOU):
+    """
+    FileStats of paths. Files are parsed together and the
+    histograms of every file computed at once. A missing file
+    has no boxes (a video frame not labeled yet)
+    """
+    stamps = [labelStamp(path) for path in paths]
+    missing = [
+        FileStats(path, None)
+        for path, stamp in zip(paths, stamps) if stamp is None
+    ]
+    if missing:
+        found = [i for i, stamp in enumerate(stamps) if stamp is not None]
+        paths = [paths[i] for i in found]
+        stamps = [stamps[i] for i in found]
+    try:
+        rows, offsets = readLabelsMany(paths)
+    except Exception:
+        # Some file is invalid or vanished: parse them one by one
+        return missing + [
+            _computeOne(path, stamp, iou_threshold)
+            for path, stamp in zip(paths, stamps)
+        ]
+    return missing + _fileStats(paths, stamps, rows, offsets,
+                                iou_threshold)
+
+
+def _computeOne(path, stamp, iou_threshold):
+    """
+    FileStats of the valid lines of a file, the invalid ones
+    are counted as issues
+    """
+    try:
+        labels = parseLabelsChecked(readLabelData(path), path)
+    except Exception as e:
+        return FileStats(path, stamp, error=str(e))
+    stats = _fileStats([path], [stamp], labels.rows,
+                       np.array([0, len(labels)]), iou_threshold)[0]
+    stats.issues += len(labels.issues)
+    return stats
+
+
+def _fileStats(paths, stamps, rows, offsets, iou_threshold):
+    files = len(paths)
+    boxes = np.diff(offsets)
+    file_ids = np.repeat(np.arange(files), boxes)
+    # Invalid class indexes are issues (countIssues), not classes
+    valid = ~badIndex(rows[:, 0])
+    idx = rows[valid, 0].astype(np.int64)
+    classes = int(idx.max()) + 1 if len(idx) else 0
+    class_counts = _perFile(file_ids[valid], idx, files, classes)
+    width_hist = _perFile(file_ids, _sizeBins(rows[:, 3]), files, SIZE_BINS)
+    height_hist = _perFile(file_ids, _sizeBins(rows[:, 4]), files, SIZE_BINS)
+    # Size ranges of the files with boxes
+    size_ranges = [None] * files
+    starts = offsets[:-1][boxes > 0]
+    if len(starts):
+        ranges = np.concatenate((
+            np.minimum.reduceat(rows[:, 3:5], starts),
+            np.maximum.reduceat(rows[:, 3:5], starts),
+        ), axis=1)
+        for i, size_range in zip(np.nonzero(boxes)[0], ranges.tolist()):
+            size_ranges[i] = tuple(size_range)
+    issues = countIssues(rows, offsets, iou_threshold).tolist()
+    return [
+        FileStats(path, stamps[i], int(boxes[i]), class_counts[i],
+                  width_hist[i], height_hist[i], size_ranges[i], issues[i])
+        for i, path in enumerate(paths)
+    ]
+
+
+def _addPadded(total, values, sign):
+    if len(values) > len(total):
+        total = np.pad(total, (0, len(values) - len(total)))
+    total[:len(values)] += sign * values
+    return total
+
+
+class StatsSummary(object):
+
+    """
+    Dataset aggregates.
+    class_counts[i]: boxes of class i
+    class_images[i]: label files with at least one box of class i
+    boxes_per_image[n]: label files with n boxes
+    issues: invalid lines and boxes, in issue_files label files
+    """
+
+    def __init__(self, files, boxes, empty, errors, class_counts,
+                 class_images, width_hist, height_hist, boxes_per_image,
+                 issues=0, issue_files=0):
+        self.files = files
+        self.boxes = boxes
+        self.empty = empty
+        self.errors = errors
+        self.issues = issues
+        self.issue_files = issue_files
+        self.class_counts = class_counts
+        self.class_images = class_images
+        self.width_hist = width_hist
+        self.height_hist = height_hist
+        self.boxes_per_image = boxes_per_image
+
+
+class DatasetStats(object):
+
+    """
+    Statistics of all the label files of a dataset.
+    Partial results are cached per file with its mtime and size,
+    so an update only parses the files that changed. Totals are
+    kept up to date by subtracting the old partial of a file and
+    adding the new one
+    """
+
+    def __init__(self, iou_threshold=DUPLICATE_IOU):
+        self.iou_threshold = iou_threshold
+        self._files = {}
+        self._errors = {}
+        self._issues = 0
+        self._issue_files = 0
+        self._class_counts = np.zeros(0, dtype=np.int64)
+        self._class_images = np.zeros(0, dtype=np.int64)
+        self._width_hist = np.zeros(SIZE_BINS, dtype=np.int64)
+        self._height_hist = np.zeros(SIZE_BINS, dtype=np.int64)
+        self._boxes_per_image = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._files)
+
+    def get(self, path):
+        """
+        Cached FileStats of path, None if not computed yet
+        """
+        return self._files.get(path)
+
+    def _account(self, stats, sign):
+        if stats.error is not None:
+            if sign > 0:
+                self._errors[stats.path] = stats.error
+            else:
+                self._errors.pop(stats.path, None)
+            return True
+        self._issues += sign * stats.issues
+        self._issue_files += sign * int(stats.issues > 0)
+        self._class_counts = _addPadded(
+            self._class_counts, stats.class_counts, sign
+        )
+        self._class_images = _addPadded(
+            self._class_images, (stats.class_counts > 0).astype(np.int64),
+            sign
+        )
+        self._width_hist += sign * stats.width_hist
+        self._height_hist += sign * stats.height_hist
+        per_image = np.zeros(stats.boxes + 1, dtype=np.int64)
+        per_image[stats.boxes] = 1
+        self._boxes_per_image = _addPadded(
+            self._boxes_per_image, per_image, sign
+        )
+        return True
+
+    def _replace(self, path, stats):
+        old = self._files.pop(path, None)
+        if old is not None:
+            self._account(old, -1)
+        if stats is not None:
+            self._files[path] = stats
+            self._account(stats, 1)
+        return True
+
+    def stale(self, paths):
+        """
+        Paths not cached or changed since they were read
+        """
+        stale = []
+        for path in paths:
+            stats = self._files.get(path)
+            if stats is None or stats.stamp != labelStamp(path):
+                stale.append(path)
+        return stale
+
+    def update(self, paths, prune=False, workers=None, chunk_size=512,
+               mp_context=None):
+        """
+        Refresh the statistics of paths. With prune, the files
+        not in paths are forgotten. Chunks of files are parsed on
+        a process pool; yield the summary after each chunk
+        """
+        if prune:
+            keep = set(paths)
+            for path in [p for p in self._files if p not in keep]:
+                self._replace(path, None)
+        stale = self.stale(paths)
+        for chunk_stats in mapChunks(computeStats, stale,
+                                     (self.iou_threshold,), workers,
+                                     chunk_size, mp_context):
+            for stats in chunk_stats:
+                self._replace(stats.path, stats)
+            yield self.summary()
+        if not stale:
+            yield self.summary()
+
+    def summary(self):
+        boxes_per_image = np.trim_zeros(self._boxes_per_image, 'b')
+        files = len(self._files) - len(self._errors)
+        return StatsSummary(
+            files=files,
+            boxes=int(self._class_counts.sum()),
+            empty=int(boxes_per_image[0]) if len(boxes_per_image) else 0,
+            errors=dict(self._errors),
+            class_counts=self._class_counts.copy(),
+            class_images=self._class_images.copy(),
+            width_hist=self._width_hist.copy(),
+            height_hist=self._height_hist.copy(),
+            boxes_per_image=boxes_per_image.copy(),
+            issues=self._issues,
+            issue_files=self._issue_files,
+        )
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import tempfile
+
+from libs.dataset_index import sourcePath
+
+
+class ThumbnailCache(object):
+
+    """
+    Thumbnails stored on disk. A thumbnail is keyed by the image
+    path, mtime and size and by the thumbnail size, so an image
+    changed on disk gets a new one
+    """
+
+    EXTENSION = '.jpg'
+
+    def __init__(self, directory, size):
+        self.directory = os.path.expanduser(directory)
+        self.size = size
+
+    def path(self, image_path):
+        """
+        Thumbnail file of image_path (or video frame path), None if
+        the image is missing
+        """
+        try:
+            stat = os.stat(sourcePath(image_path))
+        except OSError:
+            return None
+        key = '%s|%s|%s|%s' % (
+            os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size,
+            self.size,
+        )
+        name = hashlib.sha1(key.encode('utf8')).hexdigest()
+        return os.path.join(self.directory, name[:2], name + self.EXTENSION)
+
+    def store(self, path, write):
+        """
+        Create the thumbnail file path with write(tmp_path),
+        renamed once complete. Return False if write fails
+        """
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            if not write(tmp_path):
+                os.remove(tmp_path)
+                return False
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return True
+
+    def prune(self, max_bytes):
+        """
+        Remove the least recently written thumbnails until the
+        cache fits in max_bytes
+        """
+        if not os.path.isdir(self.directory):
+            return 0
+        files = []
+        total = 0
+        for subdirectory in os.scandir(self.directory):
+            if not subdirectory.is_dir():
+                continue
+            for entry in os.scandir(subdirectory.path):
+                if not entry.name.endswith(self.EXTENSION):
+                    continue
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
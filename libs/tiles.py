@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+from libs.loader import BackgroundLoader
+
+
+# Tile side in pixels of its own pyramid level
+TILE_SIZE = 256
+
+
+def pyramidLevel(scale):
+    """
+    Pyramid level to show an image at scale (screen pixels
+    per image pixel). Level n is downsampled by 2 ** n
+    """
+    if scale >= 1:
+        return 0
+    return int(math.floor(math.log2(1.0 / scale)))
+
+
+def visibleTiles(level, rect, image_size):
+    """
+    Tiles of level covering rect (x, y, w, h in full resolution
+    pixels). Yield (tx, ty, region) where region is the
+    (x, y, w, h) full resolution area of the tile
+    """
+    image_w, image_h = image_size
+    side = TILE_SIZE * 2 ** level
+    x, y, w, h = rect
+    tx0 = max(int(math.floor(x / side)), 0)
+    ty0 = max(int(math.floor(y / side)), 0)
+    tx1 = min(int(math.ceil((x + w) / side)), int(math.ceil(image_w / side)))
+    ty1 = min(int(math.ceil((y + h) / side)), int(math.ceil(image_h / side)))
+    for ty in range(ty0, ty1):
+        for tx in range(tx0, tx1):
+            left, top = tx * side, ty * side
+            yield tx, ty, (left, top,
+                           min(side, image_w - left),
+                           min(side, image_h - top))
+
+
+class TileLoader(BackgroundLoader):
+
+    """
+    Decode image tiles on worker threads into an LRU cache.
+    decode(path, level, region) -> tile image
+    on_ready(key) is called from the worker thread
+    failed is the tile of the regions that can not be decoded
+    """
+
+    def __init__(self, decode, max_bytes, sizeof, workers=2, on_ready=None,
+                 failed=None):
+        super(TileLoader, self).__init__(
+            decode, max_bytes, sizeof, workers, on_ready, name='tiles',
+            failed=failed,
+        )
+
+    def tile(self, path, level, tx, ty, region):
+        """
+        Return the tile if decoded, else queue it and return None
+        """
+        return self.get((path, level, tx, ty), path, level, region)
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from libs.batch import mapChunks
+from libs.label_io import parseLabels, readLabelData
+
+
+# Kinds of issues
+MALFORMED = 'malformed'
+INVALID_CLASS = 'class'
+NO_SIZE = 'size'
+OUTSIDE = 'outside'
+DUPLICATE = 'duplicate'
+KINDS = (MALFORMED, INVALID_CLASS, NO_SIZE, OUTSIDE, DUPLICATE)
+
+# Boxes of the same class overlapping at least this much (IoU)
+DUPLICATE_IOU = 0.9
+# Coordinates are saved truncated to 6 decimals
+_TOLERANCE = 1e-6
+# Class indexes from this one on are invalid
+MAX_CLASSES = 1 << 16
+# Pairs of boxes compared at once
+_MAX_PAIRS = 1 << 20
+
+
+class Issue(object):
+
+    """
+    Problem found on line (0 based, as the box names) of a
+    label file
+    """
+
+    __slots__ = ('line', 'kind', 'message')
+
+    def __init__(self, line, kind, message):
+        self.line = line
+        self.kind = kind
+        self.message = message
+
+    def __str__(self):
+        return "Line %s: %s" % (self.line, self.message)
+
+
+class ParsedLabels(object):
+
+    """
+    Rows of the valid lines of a label file, their line numbers
+    and the issues of the lines that could not be parsed
+    """
+
+    __slots__ = ('rows', 'line_numbers', 'issues')
+
+    def __init__(self, rows, line_numbers, issues=()):
+        self.rows = rows
+        self.line_numbers = line_numbers
+        self.issues = list(issues)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def _parseLines(data):
+    rows = []
+    line_numbers = []
+    issues = []
+    for line_number, line in enumerate(data.split(b'\n')):
+        tokens = line.split()
+        if not tokens:
+            continue
+        if len(tokens) != 5:
+            issues.append(Issue(
+                line_number, MALFORMED,
+                "Expected 5 elements, found %s" % len(tokens)
+            ))
+            continue
+        try:
+            rows.append([float(token) for token in tokens])
+        except ValueError:
+            issues.append(Issue(line_number, MALFORMED, "Invalid number"))
+            continue
+        line_numbers.append(line_number)
+    return ParsedLabels(
+        np.array(rows, dtype=np.float64).reshape(-1, 5),
+        np.array(line_numbers, dtype=np.int64), issues,
+    )
+
+
+def parseLabelsChecked(data, path=''):
+    """
+    parseLabels that skips the invalid lines instead of raising,
+    they are reported as MALFORMED issues
+    """
+    try:
+        rows = parseLabels(data, path)
+    except Exception:
+        # Line by line only when something is wrong
+        return _parseLines(data)
+    return ParsedLabels(rows, np.arange(len(rows)))
+
+
+def readLabelsChecked(path):
+    return parseLabelsChecked(readLabelData(path), path)
+
+
+def drawableRows(rows):
+    """
+    Mask of the rows that can be loaded as boxes: numbers only
+    and a valid class index
+    """
+    return np.isfinite(rows).all(axis=1) & ~badIndex(rows[:, 0])
+
+
+def unparsedLines(data, labels):
+    """
+    Lines (bytes, without line ending) of the content of a label
+    file that are not boxes of its ParsedLabels: the lines that
+    could not be parsed and the ones with values that are not
+    numbers or an invalid class index (see drawableRows). Writing
+    them back keeps them for the user to fix
+    """
+    line_numbers = set(
+        labels.line_numbers[~drawableRows(labels.rows)].tolist()
+    )
+    line_numbers.update(issue.line for issue in labels.issues)
+    if not line_numbers:
+        return []
+    lines = data.split(b'\n')
+    return [
+        lines[i].rstrip(b'\r') for i in sorted(line_numbers)
+        if i < len(lines)
+    ]
+
+
+def boxEdges(rows):
+    """
+    (lx, ly, rx, ry) normalized edges of yolo rows
+    """
+    half_width = rows[:, 3] / 2
+    half_height = rows[:, 4] / 2
+    return (rows[:, 1] - half_width, rows[:, 2] - half_height,
+            rows[:, 1] + half_width, rows[:, 2] + half_height)
+
+
+def _pairIou(first, second, lx, ly, rx, ry):
+    width = np.minimum(rx[first], rx[second]) - \
+        np.maximum(lx[first], lx[second])
+    height = np.minimum(ry[first], ry[second]) - \
+        np.maximum(ly[first], ly[second])
+    inter = np.maximum(width, 0) * np.maximum(height, 0)
+    area = (rx - lx) * (ry - ly)
+    return inter / (area[first] + area[second] - inter)
+
+
+def overlapPairs(groups, lx, ly, rx, ry, threshold):
+    """
+    (first, second, iou) of the pairs of boxes of the same group
+    (int ids) with an IoU of at least threshold, first < second.
+    Boxes are swept by left edge: a box can only reach threshold
+    with the boxes starting within (1 - threshold) of its width,
+    so only those pairs are computed, in bounded blocks
+    """
+    if not 0 < threshold <= 1:
+        raise Exception("IoU threshold must be in (0, 1]: %s" % threshold)
+    count = len(lx)
+    first = []
+    second = []
+    ious = []
+    if count > 1:
+        # One sorted key: the groups one after the other
+        origin = lx.min()
+        span = float(rx.max() - origin) + 1.0
+        keys = groups * span + (lx - origin)
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        limits = keys + (1 - threshold) * (rx - lx)[order]
+        ends = np.searchsorted(keys, limits, side='right')
+        counts = np.maximum(ends - np.arange(count) - 1, 0)
+        totals = np.cumsum(counts)
+        start = 0
+        while start < count:
+            base = int(totals[start - 1]) if start else 0
+            end = int(np.searchsorted(totals, base + _MAX_PAIRS, 'right'))
+            end = min(max(end, start + 1), count)
+            block = counts[start:end]
+            pairs = int(block.sum())
+            if pairs:
+                a = np.repeat(np.arange(start, end), block)
+                b = a + 1 + np.arange(pairs) - \
+                    np.repeat(np.cumsum(block) - block, block)
+                a, b = order[a], order[b]
+                iou = _pairIou(a, b, lx, ly, rx, ry)
+                near = iou >= threshold
+                first.append(np.minimum(a, b)[near])
+                second.append(np.maximum(a, b)[near])
+                ious.append(iou[near])
+            start = end
+    if not first:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.float64))
+    return np.concatenate(first), np.concatenate(second), \
+        np.concatenate(ious)
+
+
+def badIndex(idx):
+    """
+    Mask of the class indexes that are not integers in
+    [0, MAX_CLASSES), not numbers included
+    """
+    with np.errstate(invalid='ignore'):
+        return (idx != np.trunc(idx)) | (idx < 0) | (idx >= MAX_CLASSES)
+
+
+def _rowChecks(rows, groups, iou_threshold):
+    """
+    Masks of the rows with a value that is not a number, a class
+    index that is not a positive integer, no area and outside the
+    image, and the duplicate pairs of rows of the same group
+    """
+    with np.errstate(invalid='ignore'):
+        finite = np.isfinite(rows).all(axis=1)
+        bad_index = finite & badIndex(rows[:, 0])
+        no_size = finite & ((rows[:, 3] <= 0) | (rows[:, 4] <= 0))
+        lx, ly, rx, ry = boxEdges(rows)
+        outside = finite & ~no_size & (
+            (lx < -_TOLERANCE) | (ly < -_TOLERANCE) |
+            (rx > 1 + _TOLERANCE) | (ry > 1 + _TOLERANCE)
+        )
+    valid = np.nonzero(finite & ~no_size)[0]
+    first, second, ious = overlapPairs(
+        groups[valid], lx[valid], ly[valid], rx[valid], ry[valid],
+        iou_threshold,
+    )
+    pairs = (valid[first], valid[second], ious)
+    return ~finite, bad_index, no_size, outside, pairs
+
+
+def checkRows(rows, categories=None, iou_threshold=DUPLICATE_IOU,
+              line_numbers=None):
+    """
+    Issues of the boxes of a label file, sorted by line: values
+    that are not numbers, invalid or unknown (not in categories)
+    classes, boxes without area or outside the image and boxes of
+    the same class overlapping at least iou_threshold
+    """
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, 5)
+    if line_numbers is None:
+        line_numbers = np.arange(len(rows))
+    line_numbers = np.asarray(line_numbers).tolist()
+    idx = rows[:, 0]
+    _, groups = np.unique(idx, return_inverse=True)
+    not_number, bad_index, no_size, outside, pairs = _rowChecks(
+        rows, groups.reshape(-1), iou_threshold
+    )
+    unknown = np.zeros(len(rows), dtype=bool)
+    if categories is not None:
+        known = [i for i, name in categories.items() if name]
+        unknown = ~not_number & ~bad_index & ~np.isin(idx, known)
+    issues = []
+    for i in np.nonzero(not_number)[0].tolist():
+        issues.append(Issue(line_numbers[i], MALFORMED, "Not a number"))
+    for i in np.nonzero(bad_index)[0].tolist():
+        issues.append(Issue(
+            line_numbers[i], INVALID_CLASS,
+            "Invalid class index %s" % idx[i]
+        ))
+    for i in np.nonzero(unknown)[0].tolist():
+        issues.append(Issue(
+            line_numbers[i], INVALID_CLASS, "Unknown class %s" % int(idx[i])
+        ))
+    for i in np.nonzero(no_size)[0].tolist():
+        issues.append(Issue(line_numbers[i], NO_SIZE, "Zero or negative size"))
+    for i in np.nonzero(outside)[0].tolist():
+        issues.append(Issue(line_numbers[i], OUTSIDE, "Outside the image"))
+    for first, second, iou in zip(*(values.tolist() for values in pairs)):
+        issues.append(Issue(
+            line_numbers[second], DUPLICATE,
+            "Duplicate of line %s (IoU %.2f)" % (line_numbers[first], iou)
+        ))
+    issues.sort(key=lambda issue: issue.line)
+    return issues
+
+
+def checkLabels(labels, categories=None, iou_threshold=DUPLICATE_IOU):
+    """
+    Issues of ParsedLabels: its invalid lines and checkRows
+    """
+    issues = labels.issues + checkRows(
+        labels.rows, categories, iou_threshold, labels.line_numbers
+    )
+    issues.sort(key=lambda issue: issue.line)
+    return issues
+
+
+def countIssues(rows, offsets, iou_threshold=DUPLICATE_IOU):
+    """
+    Issues per label file of rows read with readLabelsMany,
+    without the class names: the whole dataset is checked at
+    once. Classes unknown to obj.names are not counted
+    """
+    files = len(offsets) - 1
+    file_ids = np.repeat(np.arange(files), np.diff(offsets))
+    if not len(rows):
+        return np.zeros(files, dtype=np.int64)
+    # Duplicates are searched among the boxes of a file and class
+    _, groups = np.unique(
+        np.column_stack((file_ids, rows[:, 0])), axis=0, return_inverse=True
+    )
+    not_number, bad_index, no_size, outside, pairs = _rowChecks(
+        rows, groups.reshape(-1), iou_threshold
+    )
+    flagged = not_number | bad_index | no_size | outside
+    counts = np.bincount(file_ids[flagged], minlength=files)
+    counts += np.bincount(file_ids[pairs[1]], minlength=files)
+    return counts
+
+
+class FileCheck(object):
+
+    __slots__ = ('path', 'boxes', 'issues', 'error')
+
+    def __init__(self, path, boxes=0, issues=(), error=None):
+        self.path = path
+        self.boxes = boxes
+        self.issues = list(issues)
+        self.error = error
+
+
+def checkFile(path, categories=None, iou_threshold=DUPLICATE_IOU):
+    """
+    FileCheck of a label file. Errors are returned, not raised
+    """
+    try:
+        labels = readLabelsChecked(path)
+        issues = checkLabels(labels, categories, iou_threshold)
+    except Exception as e:
+        return FileCheck(path, error=str(e))
+    return FileCheck(path, len(labels), issues)
+
+
+def _checkChunk(paths, categories, iou_threshold):
+    return [checkFile(path, categories, iou_threshold) for path in paths]
+
+
+def checkDataset(paths, categories=None, iou_threshold=DUPLICATE_IOU,
+                 workers=None, chunk_size=256, mp_context=None):
+    """
+    Check label files on a process pool.
+    Yield the FileCheck list of each chunk as it finishes
+    """
+    return mapChunks(_checkChunk, paths, (categories, iou_threshold),
+                     workers, chunk_size, mp_context)
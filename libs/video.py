@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import os
+import sqlite3
+import threading
+
+import cv2
+import numpy as np
+
+from libs.cache import LRUCache
+from libs.dataset_index import frameLabelPath, framePath, splitFramePath
+from libs.stats import fileStamp
+
+
+# Decoded frames kept per video: the frames before the one read
+# are decoded on the way, so stepping back does not seek
+CACHED_FRAMES = 16
+# Videos kept open by a FrameSource
+OPEN_VIDEOS = 4
+
+
+class VideoIndex(object):
+
+    """
+    Frame timestamps (ms, presentation order) and key frames of a
+    video, read from its packets without decoding them. The key
+    frames are the packets a decoder can start from (approximate
+    frame numbers with reordered frames)
+    """
+
+    def __init__(self, path, stamp, timestamps, keyframes):
+        self.path = path
+        self.stamp = stamp
+        self.timestamps = timestamps
+        self.keyframes = keyframes
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def keyframeBefore(self, frame):
+        """
+        Last key frame at or before frame
+        """
+        i = np.searchsorted(self.keyframes, frame, side='right') - 1
+        return int(self.keyframes[i]) if i >= 0 else 0
+
+
+def indexVideo(path):
+    """
+    VideoIndex of a video file. Backends that can not read the
+    packets give timestamps from the frame rate and every frame
+    as key frame: frames are then always reached with a seek
+    """
+    stamp = fileStamp(path)
+    capture = cv2.VideoCapture(
+        path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1]
+    )
+    timestamps = []
+    keyframes = []
+    try:
+        if capture.isOpened():
+            while capture.grab():
+                if capture.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME) > 0:
+                    keyframes.append(len(timestamps))
+                timestamps.append(capture.get(cv2.CAP_PROP_POS_MSEC))
+    finally:
+        capture.release()
+    if not timestamps:
+        capture = cv2.VideoCapture(path)
+        try:
+            if not capture.isOpened():
+                raise Exception("Could not open the video %s" % path)
+            count = max(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+            fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        finally:
+            capture.release()
+        timestamps = np.arange(count) * 1000.0 / fps
+        keyframes = np.arange(count)
+    if not len(keyframes):
+        keyframes = np.arange(len(timestamps))
+    return VideoIndex(path, stamp, np.sort(np.asarray(timestamps,
+                                                      dtype=np.float64)),
+                      np.asarray(keyframes, dtype=np.int64))
+
+
+class VideoIndexStore(object):
+
+    """
+    Persistent (SQLite) VideoIndex of videos, built again when
+    the video mtime or size change
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS videos ("
+        " path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER,"
+        " timestamps BLOB, keyframes BLOB)",
+    )
+
+    def __init__(self, db_path):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path)
+        for statement in self.SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def get(self, path):
+        """
+        Stored VideoIndex of path, None if missing or stale
+        """
+        row = self.db.execute(
+            "SELECT mtime, size, timestamps, keyframes FROM videos"
+            " WHERE path = ?", (path,)
+        ).fetchone()
+        stamp = fileStamp(path)
+        if row is None or tuple(row[:2]) != stamp:
+            return None
+        return VideoIndex(path, stamp,
+                          np.frombuffer(row[2], dtype=np.float64),
+                          np.frombuffer(row[3], dtype=np.int64))
+
+    def put(self, index):
+        if index.stamp is None:
+            return False
+        self.db.execute(
+            "INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?)",
+            (index.path, *index.stamp, index.timestamps.tobytes(),
+             index.keyframes.tobytes())
+        )
+        self.db.commit()
+        return True
+
+    def index(self, path):
+        """
+        VideoIndex of path, built and stored if needed
+        """
+        index = self.get(path)
+        if index is None:
+            index = indexVideo(path)
+            self.put(index)
+        return index
+
+
+def videoFrames(index):
+    """
+    (frame path, label path) of every frame of a video
+    """
+    return [
+        (framePath(index.path, frame), frameLabelPath(index.path, frame))
+        for frame in range(len(index))
+    ]
+
+
+class FrameReader(object):
+
+    """
+    Random access to the frames of a video. A frame a little
+    ahead of the decoder is reached by decoding forward; others
+    by a seek to the key frame before it and decoding forward
+    from there, so a read never decodes more than a key frame
+    interval. The last frames decoded are kept for stepping back
+    """
+
+    def __init__(self, path, index, cached_frames=CACHED_FRAMES):
+        self.path = path
+        self.index = index
+        self.cached_frames = cached_frames
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise Exception("Could not open the video %s" % path)
+        # Frame the next read of the capture returns
+        self.position = 0
+        self.lock = threading.Lock()
+        self._frames = LRUCache(cached_frames)
+
+    def close(self):
+        with self.lock:
+            self.capture.release()
+        return True
+
+    def size(self):
+        """
+        Frame (width, height)
+        """
+        with self.lock:
+            return (int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                    int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    def read(self, frame):
+        """
+        BGR image of frame
+        """
+        with self.lock:
+            image = self._frames.get(frame)
+            if image is not None:
+                return image
+            if not 0 <= frame < len(self.index):
+                raise Exception("No frame %s in %s (%s frames)" % (
+                    frame, self.path, len(self.index)
+                ))
+            keyframe = self.index.keyframeBefore(frame)
+            if not keyframe <= self.position <= frame:
+                self.capture.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+                self.position = keyframe
+            while self.position <= frame:
+                # Only the frames kept are converted
+                if frame - self.position < self.cached_frames:
+                    ok, image = self.capture.read()
+                    if ok:
+                        self._frames.put(self.position, image)
+                else:
+                    ok = self.capture.grab()
+                if not ok:
+                    raise Exception("Could not decode frame %s of %s" % (
+                        self.position, self.path
+                    ))
+                self.position += 1
+            return image
+
+
+class FrameSource(object):
+
+    """
+    Frames of videos by frame path, with a FrameReader per open
+    video (the least recently used are closed). The video indexes
+    come from the VideoIndexStore at index_path, or are built.
+    Safe to call from worker threads, the reads of a video are
+    done one at a time
+    """
+
+    def __init__(self, index_path=None, open_videos=OPEN_VIDEOS,
+                 cached_frames=CACHED_FRAMES):
+        self.index_path = index_path
+        self.open_videos = open_videos
+        self.cached_frames = cached_frames
+        self._readers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _index(self, video_path):
+        if self.index_path is None:
+            return indexVideo(video_path)
+        # SQLite connections stay in their thread
+        store = VideoIndexStore(self.index_path)
+        try:
+            return store.index(video_path)
+        finally:
+            store.close()
+
+    def reader(self, video_path):
+        with self._lock:
+            reader = self._readers.get(video_path)
+            if reader is not None:
+                self._readers.move_to_end(video_path)
+                return reader
+        reader = FrameReader(video_path, self._index(video_path),
+                             self.cached_frames)
+        closed = []
+        with self._lock:
+            if video_path in self._readers:
+                # Opened meanwhile by another thread
+                closed.append(reader)
+                reader = self._readers[video_path]
+            else:
+                self._readers[video_path] = reader
+            while len(self._readers) > self.open_videos:
+                closed.append(self._readers.popitem(last=False)[1])
+        for old in closed:
+            old.close()
+        return reader
+
+    def frame(self, path):
+        """
+        BGR image of a frame path
+        """
+        video_path, frame = splitFramePath(path)
+        return self.reader(video_path).read(frame)
+
+    def frameSize(self, path):
+        """
+        (width, height) of the frames of the video of a frame path
+        """
+        video_path, _ = splitFramePath(path)
+        return self.reader(video_path).size()
+
+    def close(self):
+        with self._lock:
+            readers = list(self._readers.values())
+            self._readers.clear()
+        for reader in readers:
+            reader.close()
+        return True
+
+
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def frameSource(index_path=None):
+    """
+    FrameSource shared by the threads of the process, one per
+    video index file
+    """
+    with _sources_lock:
+        source = _sources.get(index_path)
+        if source is None:
+            source = FrameSource(index_path)
+            _sources[index_path] = source
+        return source
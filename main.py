@@ -1,31 +1,99 @@
 # -*- coding: utf-8 -*-
 
-import csv
-from glob import glob
+import time
+
+# Time to the first image is counted from here, before the imports
+STARTED = time.perf_counter_ns()
+
 import os
-import re
 import sys
+import threading
 
+from PyQt5.QtCore import QTimer, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QPushButton
 from PyQt5.QtWidgets import QHBoxLayout, QVBoxLayout, QFileDialog, QLabel
-from PyQt5.QtWidgets import QMessageBox
-from PyQt5.QtGui import QColor, QIcon
-
+from PyQt5.QtWidgets import QListWidget, QMessageBox, QShortcut
+from PyQt5.QtGui import QIcon, QImage, QKeySequence
 
-from libs.samples import SampleObject
-from views.sample_view import GroupModel, GroupView
+from libs.dataset_index import DatasetIndex, indexPath, shardIndexPath
+from libs.dataset_index import videoIndexPath
+from libs.label_io import formatLabels, readObjNames
+from libs.label_journal import LabelJournal, recoverJournals
+from libs.label_writer import LabelWriter
+from libs.prefetch import Prefetcher
+from libs.profiler import Profiler
+from libs.session import loadSession, saveSession, sessionPath
+from libs.settings import SETTINGS_PATH, Settings
 from widgets.image_widget import ImageWidget
+from widgets.workers import TaskThread
+
+# The duplicates (PIL), pre-labeling and box propagation (OpenCV),
+# thumbnails, process pools, shards, statistics, label index, undo
+# history, tiles and the dock widgets are imported the first time
+# they are used, so the last image opens as soon as possible
+
+
+def spawnContext():
+    """
+    Process start method of the pools: Qt threads are running,
+    do not fork the process
+    """
+    import multiprocessing
+    return multiprocessing.get_context('spawn')
+
+
+def imagePairs(entries, video_index_path, shard_index_path, skipped=None):
+    """
+    (image path, label path) of dataset index entries: the images
+    that have a label file, every frame of the videos and the
+    images of the shards that have labels. Videos and shards that
+    can not be read are skipped, their (path, error) appended to
+    skipped if given
+    """
+    pairs = []
+    videos = None
+    shards = None
+    try:
+        for entry in entries:
+            if not entry.is_video and not entry.is_shard:
+                if entry.has_label:
+                    pairs.append((entry.path, entry.label_path))
+                continue
+            try:
+                if entry.is_shard:
+                    if shards is None:
+                        # Only when the dataset has shards
+                        from libs.shards import ShardIndexStore
+                        from libs.shards import setShardIndexPath
+                        setShardIndexPath(shard_index_path)
+                        shards = ShardIndexStore(shard_index_path)
+                    from libs.shards import shardImages
+                    pairs.extend(shardImages(shards.index(entry.path)))
+                    continue
+                if videos is None:
+                    # OpenCV only when the dataset has videos
+                    from libs.video import VideoIndexStore, videoFrames
+                    videos = VideoIndexStore(video_index_path)
+                pairs.extend(videoFrames(videos.index(entry.path)))
+            except Exception as e:
+                if skipped is not None:
+                    skipped.append((entry.path, e))
+    finally:
+        for store in (videos, shards):
+            if store is not None:
+                store.close()
+    return pairs
 
 
 class MyApp(QMainWindow):
 
-    def __init__(self):
+    def __init__(self, settings=None):
         super().__init__()
         self.setWindowIcon(QIcon('./resources/icons/icon.png'))
-        self.initUI()
+        self.initUI(settings)
 
-    def initUI(self):
-        self.mainWidget = MainWidget(self)
+    def initUI(self, settings=None):
+        self.mainWidget = MainWidget(self, settings)
 
         self.setCentralWidget(self.mainWidget)
         statusbar = self.statusBar()
@@ -34,6 +102,8 @@ class MyApp(QMainWindow):
         self.cursorPos = QLabel('      ')
         self.imageSize = QLabel('      ')
         self.progress = QLabel('                 ')  # reserve widget space
+        self.latency = QLabel('')
+        self.prelabel = QLabel('')
 
         widget = QWidget(self)
         widget.setLayout(QHBoxLayout())
@@ -43,29 +113,132 @@ class MyApp(QMainWindow):
         widget.layout().addWidget(self.cursorPos)
         widget.layout().addStretch(1)
         widget.layout().addStretch(2)
+        widget.layout().addWidget(self.prelabel)
+        widget.layout().addWidget(self.latency)
         widget.layout().addWidget(self.progress)
         statusbar.addWidget(widget, 1)
 
         self.setGeometry(50, 50, 1200, 800)
         self.setWindowTitle('pyYoloMark')
         self.show()
+        self.mainWidget.restoreSession()
 
     def fitSize(self):
         self.setFixedSize(self.layout().sizeHint())
 
+    def closeEvent(self, event):
+        self.mainWidget.stopScan()
+        self.mainWidget.stopStats()
+        self.mainWidget.stopLabelIndex()
+        self.mainWidget.stopDuplicates()
+        self.mainWidget.stopPrelabel()
+        self.mainWidget.saveSession()
+        self.mainWidget.writeSamples()
+        self.mainWidget.writer.close()
+        self.mainWidget.prefetcher.shutdown()
+        self.mainWidget.tiles.shutdown()
+        if self.mainWidget.propagator is not None:
+            self.mainWidget.propagator.shutdown()
+        if self.mainWidget.browser is not None:
+            self.mainWidget.browser.shutdown()
+        if self.mainWidget.history is not None:
+            self.mainWidget.history.close()
+        self.mainWidget.stopProfiling()
+        super().closeEvent(event)
+
 
 class MainWidget(QWidget):
 
-    def __init__(self, parent):
+    # Milliseconds from the start to the restored image on screen
+    firstImageShown = pyqtSignal(float)
+    # Emitted from the propagation worker with the key done
+    trackingReady = pyqtSignal(object)
+
+    def __init__(self, parent, settings=None):
         super(MainWidget, self).__init__(parent)
         self.parent = parent
         self.currentImg = "start.png"
         self.currentCfg = ""
         self.image_directory = None
+        # Full path of image_directory
+        self.dataset_root = None
         self.train_path = None
         self.obj_names_path = None
         self.categories = {}
+        self.imgList = []
+        self.imgListCfg = []
+        self.total_imgs = 0
+        self.scan_thread = None
+        self.stats_thread = None
+        self.stats_pending = []
+        self.stats_summary = None
+        # Created on first use: DatasetStats, ImageSizes, History
+        self.stats = None
+        self.image_sizes = None
+        self.label_index = None
+        self.index_thread = None
+        self.index_pending = False
+        # Sorted image indexes shown by Back / Next, None: all
+        self.filter_positions = None
+        self.duplicates = None
+        self.hash_thread = None
+        # Detector boxes of the images: {image path: (n, 6) rows}
+        self.proposals = {}
+        self.proposals_shown = False
+        self.prelabeler = None
+        self.prelabel_thread = None
+        self.prelabel_pending = False
+        self.prelabel_failed = False
+        # Boxes carried to the next image: Propagator and the
+        # (source, target, rows) propagation waiting for it
+        self.propagator = None
+        self.propagation = None
+        self.browser = None
+        self.settings = settings if settings is not None else Settings()
+        cache_dir = self.settings.get('cache_dir')
+        ImageWidget.video_index_path = videoIndexPath(cache_dir)
+        # Shard images and labels are read through this index
+        self.shard_index_path = shardIndexPath(cache_dir)
+        # Undo history of the dataset directory (None: in memory)
+        self.history = None
+        self.history_root = None
+        journal_dir = os.path.join(
+            os.path.expanduser(self.settings.get('cache_dir')), 'journal'
+        )
+        recovered, failed = recoverJournals(journal_dir)
+        self.profiler = Profiler()
+        self.writer = LabelWriter(
+            LabelJournal.create(journal_dir),
+            delay=self.settings.get('label_flush_seconds'),
+        )
+        self.prefetcher = Prefetcher(
+            self.profiler.wrap('prefetch decode', ImageWidget.decodeImage),
+            self.profiler.wrap('prefetch parse', self.readObjData),
+            max_bytes=self.settings.get('image_cache_mb') * 1024 * 1024,
+            sizeof=lambda image: image.sizeInBytes(),
+            workers=self.settings.get('decode_threads'),
+        )
         self.initUI()
+        self.showRecovery(recovered, failed)
+
+    def showRecovery(self, recovered, failed):
+        """
+        Report the label files written again from the journal
+        of a session that did not close
+        """
+        if recovered:
+            self.showPopupOk(
+                "Recovered labels",
+                "Unsaved edits of the last session were written to:\n%s"
+                % "\n".join(recovered[:20])
+            )
+        if failed:
+            self.showPopupOk(
+                "Error!", "Could not recover:\n%s" % "\n".join(
+                    "%s: %s" % (path, error) for path, error in failed[:20]
+                )
+            )
+        return True
 
     def showPopupOk(self, title, content):
         msg = QMessageBox()
@@ -77,85 +250,17 @@ class MainWidget(QWidget):
             msg.close()
 
     def refreshTreeView(self):
-        render = self.label_img
-        samples_grouped = render.grouper.getSamplesGrouped()
-        self._on_refresh = True
-        for idx, samples in samples_grouped.items():
-            group_name = render.grouper.categories[idx]
-            group_item = self.group_model.add_group(idx, group_name)
-            for sample in samples:
-                self.group_model.append_element_to_group(group_item, sample)
-        try:
-            self.group_model.disconnect(self.registerTreeCellChange)
-        except Exception:
-            pass
-        self.group_model.itemChanged.connect(self.registerTreeCellChange)
-        self._on_refresh = False
+        self.group_model.setGrouper(self.label_img.grouper)
         return True
 
-    def registerTreeCellChange(self, item):
-        if getattr(self, '_on_register_tree_cell', False):
-            return True
-        item_data = item.data()
-        self._on_register_tree_cell = True
-        if isinstance(item_data, int):  # Grouper
-            self.label_img.grouper.setGroupVisibility(
-                item_data, bool(item.checkState())
-            )
-            # Root element:
-            root = item.data(3)
-            for row in range(0, root.rowCount()):
-                root.child(row, 1).setCheckState(item.checkState())
-            self.label_img.pixmap = self.label_img.drawSamplesBox()
-            self.label_img.update()
-        elif isinstance(item_data, SampleObject):
-            # Cambio la categoria?
-            if item.column() == 2:
-                item.setForeground(QColor("#000000"))
-                if not item.data(2):
-                    self._on_register_tree_cell = False
-                    item_data.resetCategory()
-                    return
-                try:
-                    category_index = int(item.data(2).strip())
-                except Exception:
-                    self.showPopupOk(
-                        "Error!", "Category must be integer"
-                    )
-                    item.setData("", 2)
-                    self._on_register_tree_cell = False
-                    return
-                if category_index not in self.categories:
-                    self.showPopupOk(
-                        "Error!",
-                        "Category index must be in %s. \n Categories: %s"
-                        % (
-                            str(list(self.categories.keys())),
-                            str(self.categories),
-                        )
-                    )
-                    item.setData("", 2)
-                    self._on_register_tree_cell = False
-                    return
-                item_data.setCategory(category_index)
-                item.setForeground(QColor("#FF0000"))
-            if item.column() == 3:
-                if bool(item.checkState()):
-                    item_data.setDeleted()
-                else:
-                    item_data.setDeleted(deleted=False)
-            else:
-                if self._on_refresh:
-                    item.setCheckState(2)
-                    item_data.setVisible()
-                else:
-                    if bool(item.checkState()):
-                        item_data.setVisible()
-                    else:
-                        item_data.setInvisible()
-                    self.label_img.pixmap = self.label_img.drawSamplesBox()
-                    self.label_img.update()
-        self._on_register_tree_cell = False
+    def showIssues(self, issues):
+        """
+        List the problems found in the label file of the image,
+        hidden when there are none
+        """
+        self.issue_list.clear()
+        self.issue_list.addItems([str(issue) for issue in issues])
+        self.issue_list.setVisible(bool(issues))
         return True
 
     def initUI(self):
@@ -163,12 +268,24 @@ class MainWidget(QWidget):
         imagePathButton = QPushButton('Image Path (Folder)', self)
         objNamesPathButton = QPushButton('obj.names File Path', self)
 
+        browseButton = QPushButton('Browse', self)
         self.backButton = QPushButton('Back', self)
         self.okButton = QPushButton('Next', self)
-        imagePathLabel = QLabel('Image Path not selected', self)
-        objNamesPathLabel = QLabel('obj.names Path not selected', self)
+        self.imagePathLabel = QLabel('Image Path not selected', self)
+        self.objNamesPathLabel = QLabel('obj.names Path not selected', self)
 
         self.label_img = ImageWidget(self.parent)
+        from libs.tiles import TileLoader
+        self.tiles = TileLoader(
+            ImageWidget.decodeTile,
+            max_bytes=self.settings.get('tile_cache_mb') * 1024 * 1024,
+            sizeof=lambda image: image.sizeInBytes(),
+            workers=self.settings.get('decode_threads'),
+            on_ready=self.label_img.tileReady.emit,
+            failed=QImage(),
+        )
+        self.label_img.setTileLoader(self.tiles)
+        self.label_img.setProfiler(self.profiler)
         self.image_index = -1
 
         # Events
@@ -180,13 +297,12 @@ class MainWidget(QWidget):
         )
         self.okButton.setEnabled(False)
         self.backButton.setEnabled(False)
+        browseButton.clicked.connect(lambda: self.openBrowser())
         imagePathButton.clicked.connect(
-            lambda: self.registerImagePath(
-                imagePathButton, imagePathLabel)
+            lambda: self.registerImagePath(imagePathButton)
         )
         objNamesPathButton.clicked.connect(
-            lambda: self.registerObjNamesPath(
-                objNamesPathButton, objNamesPathLabel)
+            lambda: self.registerObjNamesPath(objNamesPathButton)
         )
 
         # Config Button
@@ -198,58 +314,387 @@ class MainWidget(QWidget):
         hbox.addLayout(vbox)
 
         vbox = QVBoxLayout()
-        vbox.addWidget(imagePathLabel)
-        vbox.addWidget(objNamesPathLabel)
+        vbox.addWidget(self.imagePathLabel)
+        vbox.addWidget(self.objNamesPathLabel)
         hbox.addLayout(vbox)
 
         hbox.addStretch(3)
         hbox.addStretch(1)
+        hbox.addWidget(browseButton)
         hbox.addWidget(self.backButton)
         hbox.addWidget(self.okButton)
 
+        from widgets.navigation_bar import NavigationBar
+        self.navigation_bar = NavigationBar(self)
+        self.navigation_bar.filterChanged.connect(self.applyFilter)
+        self.navigation_bar.jumpRequested.connect(self.showImage)
+        self.navigation_bar.copyTwinRequested.connect(self.copyTwinLabels)
+        self.navigation_bar.propagateChanged.connect(
+            lambda checked: self.trackAhead()
+        )
+        self.trackingReady.connect(self.showPropagation)
+
         vbox = QVBoxLayout()
         hbox_1 = QHBoxLayout()
         hbox_1.addWidget(self.label_img, 7)
+        from views.sample_view import GroupModel, GroupView
         self.group_model = GroupModel(self)
+        self.group_model.groupVisibilityChanged.connect(
+            self.label_img.refreshGroup
+        )
+        self.group_model.samplesVisibilityChanged.connect(
+            self.label_img.refreshSamples
+        )
+        self.group_model.categoryError.connect(
+            lambda message: self.showPopupOk("Error!", message)
+        )
+        self.group_model.samplesEdited.connect(self.recordEdit)
+        QShortcut(QKeySequence.Undo, self).activated.connect(self.undoEdit)
+        QShortcut(QKeySequence.Redo, self).activated.connect(self.redoEdit)
+        QShortcut(QKeySequence('Ctrl+Shift+T'), self).activated.connect(
+            self.toggleTrace
+        )
+        QShortcut(QKeySequence('Ctrl+Shift+P'), self).activated.connect(
+            self.toggleProfile
+        )
+        QShortcut(QKeySequence('Ctrl+Return'), self).activated.connect(
+            self.acceptProposals
+        )
+        QShortcut(QKeySequence('Ctrl+Backspace'), self).activated.connect(
+            self.rejectProposals
+        )
         self.tree_view = GroupView(self.group_model)
-        hbox_1.addWidget(self.tree_view, 3)
+        from widgets.stats_panel import StatsPanel
+        self.stats_panel = StatsPanel(self)
+        self.issue_list = QListWidget(self)
+        self.issue_list.setToolTip(
+            "Problems of the label file. Invalid lines are not loaded "
+            "and are written back unchanged when the boxes are saved"
+        )
+        self.issue_list.setVisible(False)
+        vbox_1 = QVBoxLayout()
+        vbox_1.addWidget(self.tree_view, 3)
+        vbox_1.addWidget(self.issue_list, 1)
+        vbox_1.addWidget(self.stats_panel, 2)
+        hbox_1.addLayout(vbox_1, 3)
         vbox.addLayout(hbox_1)
+        vbox.addWidget(self.navigation_bar)
         vbox.addLayout(hbox)
 
         self.setLayout(vbox)
 
     def setNextImage(self, go_back=False):
+        source = None
+        if not go_back and self.currentCfg and \
+                self.navigation_bar.propagateBoxes():
+            source = self.currentImg
+            rows = self.label_img.grouper.getYoloRows()
+        self.showImage(self.nextIndex(self.image_index, go_back))
+        if source is not None and len(rows) and self.currentCfg:
+            self.propagateFrom(source, rows)
+
+    def nextIndex(self, index, go_back=False):
+        """
+        Image after (before) index in the navigation order:
+        every image or the filtered ones. -1 is the start
+        image and total_imgs the end image
+        """
+        positions = self.filter_positions
+        if positions is None:
+            return index - 1 if go_back else index + 1
+        import numpy as np
         if go_back:
-            self.image_index -= 1
-        else:
-            self.image_index += 1
-        self.writeSamples()
+            i = np.searchsorted(positions, index) - 1
+            return int(positions[i]) if i >= 0 else -1
+        i = np.searchsorted(positions, index, side='right')
+        return int(positions[i]) if i < len(positions) else self.total_imgs
+
+    def showImage(self, index):
+        start = time.perf_counter_ns()
+        self.image_index = index
+        with self.profiler.stage('write'):
+            self.writeSamples()
+        if self.history is not None:
+            self.history.seal()
         # start?
         if self.image_index < 0:
             self.currentImg = './resources/background/start.png'
             self.currentCfg = ''
             self.backButton.setEnabled(False)
-            self.parent.progress.setText("")
+            self.enableOkButton()
         else:
             try:
                 self.currentImg = self.imgList[self.image_index]
                 self.currentCfg = self.imgListCfg[self.image_index]
+                self.enableOkButton()
             except Exception:
                 self.currentImg = './resources/background/end.png'
                 self.currentCfg = ''
                 self.okButton.setEnabled(False)
             self.backButton.setEnabled(True)
-            self.parent.progress.setText(
-                str(self.image_index) +
-                '/'+str(self.total_imgs)
-            )
+        self.showProgress()
+        if self.browser is not None:
+            self.browser.setCurrentImage(self.image_index)
 
         basename = os.path.basename(self.currentImg)
         self.parent.fileName.setText(basename)
-        self.label_img.setPixmap(self.currentImg)
+        max_height = self.label_img.maxHeight()
+        with self.profiler.stage('decode'):
+            image = self.prefetcher.image(self.currentImg, max_height)
+        obj_datas = None
+        if self.currentCfg:
+            with self.profiler.stage('labels'):
+                obj_datas = self.prefetcher.labels(self.currentCfg)
+        self.label_img.setPixmap(self.currentImg, image=image)
         self.label_img.update()
         # self.parent.fitSize()
-        self.label_img.setObjData(self.currentCfg)
+        self.label_img.setObjData(self.currentCfg, obj_datas)
+        self.proposals_shown = False
+        self.propagation = None
+        self.showProposals()
+        self.prefetchImages()
+        self.trackAhead()
+        self.updateProposals()
+        self.profiler.add('navigate', start, time.perf_counter_ns())
+        self.showLatency()
+
+    def prefetchImages(self):
+        """
+        Decode the images around image_index in background
+        """
+        if not self.imgList:
+            return False
+        depth_next = self.settings.get('prefetch_next')
+        depth_prev = self.settings.get('prefetch_prev')
+        indexes = []
+        index = self.image_index
+        for _ in range(depth_next):
+            index = self.nextIndex(index)
+            indexes.append(index)
+        index = self.image_index
+        for _ in range(depth_prev):
+            index = self.nextIndex(index, go_back=True)
+            indexes.append(index)
+        items = [
+            (self.imgList[i], self.imgListCfg[i])
+            for i in indexes if 0 <= i < self.total_imgs
+        ]
+        self.prefetcher.schedule(items, self.label_img.maxHeight())
+        return True
+
+    def updateProposals(self):
+        """
+        Run the detector in background on the current image and
+        the next ones that have no proposals yet
+        """
+        model = self.settings.get('prelabel_model')
+        if not model or self.prelabel_failed or not self.imgList:
+            return False
+        import numpy as np
+        from libs.prelabel import Prelabeler, ProposalStore, proposalPath
+        if self.prelabel_thread is not None:
+            self.prelabel_pending = True
+            return False
+        indexes = [self.image_index]
+        for _ in range(self.settings.get('prelabel_ahead')):
+            indexes.append(self.nextIndex(indexes[-1]))
+        paths = [
+            self.imgList[i] for i in indexes
+            if 0 <= i < self.total_imgs and self.imgList[i] not in
+            self.proposals
+        ]
+        paths = list(dict.fromkeys(paths))
+        if not paths:
+            return False
+        input_size = self.settings.get('prelabel_input_size')
+        score = self.settings.get('prelabel_score')
+        if self.prelabeler is None:
+            self.prelabeler = Prelabeler(
+                model, input_size, score,
+                workers=self.settings.get('prelabel_workers'),
+                threads=self.settings.get('prelabel_threads'),
+                batch_size=self.settings.get('prelabel_batch'),
+                mp_context=spawnContext(),
+                video_index_path=ImageWidget.video_index_path,
+            )
+        prelabeler = self.prelabeler
+        db_path = proposalPath(
+            self.settings.get('cache_dir'), model, input_size, score
+        )
+
+        def run():
+            store = ProposalStore(db_path)
+            try:
+                found, missing = store.get(paths)
+                yield found
+                for results in prelabeler.detect(missing):
+                    store.put(results)
+                    # Images that failed are not tried again
+                    yield {
+                        path: rows if error is None else
+                        np.zeros((0, 6), dtype=np.float64)
+                        for path, _, rows, error in results
+                    }
+            finally:
+                store.close()
+
+        self.prelabel_thread = TaskThread(run, parent=self)
+        self.prelabel_thread.itemReady.connect(self.registerProposals)
+        self.prelabel_thread.taskFailed.connect(self.prelabelFailed)
+        self.prelabel_thread.finished.connect(self.prelabelFinished)
+        self.prelabel_thread.start()
+        return True
+
+    def registerProposals(self, found):
+        self.proposals.update(found)
+        if self.prelabeler is not None and self.prelabeler.images:
+            self.parent.prelabel.setText(
+                'Pre-label %.1f images/s' % self.prelabeler.throughput()
+            )
+        if self.currentImg in found:
+            self.showProposals()
+        return True
+
+    def prelabelFailed(self, error):
+        self.prelabel_failed = True
+        if self.prelabeler is not None:
+            self.prelabeler.shutdown()
+            self.prelabeler = None
+        self.showPopupOk("Error!", "Pre-labeling failed:\n%s" % error)
+        return True
+
+    def prelabelFinished(self):
+        if self.sender() is not self.prelabel_thread:
+            # Stopped (closing): do not start another one
+            return False
+        self.prelabel_thread = None
+        if self.prelabel_pending:
+            self.prelabel_pending = False
+            return self.updateProposals()
+        return True
+
+    def stopPrelabel(self):
+        self.prelabel_pending = False
+        if self.prelabel_thread is not None:
+            self.prelabel_thread.stop()
+            self.prelabel_thread = None
+        if self.prelabeler is not None:
+            self.prelabeler.shutdown()
+            self.prelabeler = None
+        return True
+
+    def addProposals(self, rows):
+        """
+        Add proposed boxes (n, 6) to the current image as samples
+        to accept or reject, except those matching a label or a
+        proposal of their class. Return the number added
+        """
+        import numpy as np
+        from libs.prelabel import newProposals
+        grouper = self.label_img.grouper
+        shown = np.concatenate((
+            grouper.getYoloRows(),
+            grouper.yoloColumns()[grouper.proposalRows()],
+        ))
+        rows = newProposals(rows, shown, self.categories)
+        if not len(rows):
+            return 0
+        grouper.addProposals(rows)
+        self.refreshTreeView()
+        self.label_img.drawSamplesBox()
+        self.label_img.update()
+        self.parent.fileName.setText(
+            "%s proposals: Ctrl+Enter accepts, Ctrl+Backspace rejects"
+            % len(grouper.proposalRows())
+        )
+        return len(rows)
+
+    def showProposals(self):
+        """
+        Add the detector boxes of the current image that do not
+        match a label, once per image load
+        """
+        rows = self.proposals.get(self.currentImg)
+        if rows is None or not self.currentCfg or self.proposals_shown:
+            return False
+        self.proposals_shown = True
+        return self.addProposals(rows) > 0
+
+    def trackAhead(self):
+        """
+        Prepare in background the tracking images of the current
+        image and the next one, so propagating boxes to the next
+        image only tracks them
+        """
+        if not self.navigation_bar.propagateBoxes() or \
+                not 0 <= self.image_index < self.total_imgs:
+            return False
+        if self.propagator is None:
+            from libs.prelabel import readImage
+            from libs.propagation import Propagator
+            video_index_path = ImageWidget.video_index_path
+            self.propagator = Propagator(
+                lambda path: readImage(path, video_index_path),
+                self.settings.get('propagate_size'),
+                self.settings.get('propagate_score'),
+                on_ready=self.trackingReady.emit,
+            )
+        paths = [self.currentImg]
+        index = self.nextIndex(self.image_index)
+        if 0 <= index < self.total_imgs:
+            paths.append(self.imgList[index])
+        self.propagator.prepare(paths)
+        return True
+
+    def propagateFrom(self, source, rows):
+        """
+        Propose on the current image the boxes rows of the image
+        source, tracked in background
+        """
+        if self.propagator is None or source == self.currentImg:
+            return False
+        self.propagation = (source, self.currentImg, rows)
+        return self.showPropagation()
+
+    def showPropagation(self, key=None):
+        """
+        Add the propagated boxes once tracked. key is the
+        propagation done by the worker, None to check the current one
+        """
+        if self.propagation is None:
+            return False
+        if key is not None and \
+                key != self.propagator.key(*self.propagation):
+            return False
+        boxes = self.propagator.boxes(*self.propagation)
+        if boxes is None:
+            # Queued: trackingReady shows it
+            return False
+        self.propagation = None
+        return self.addProposals(boxes) > 0
+
+    def acceptProposals(self):
+        count = self.label_img.grouper.acceptProposals()
+        if not count:
+            return False
+        self.refreshTreeView()
+        self.label_img.drawSamplesBox()
+        self.label_img.update()
+        self.parent.fileName.setText("%s proposals accepted" % count)
+        return True
+
+    def rejectProposals(self):
+        count = self.label_img.grouper.rejectProposals()
+        if not count:
+            return False
+        # Not proposed again in this session
+        import numpy as np
+        self.proposals[self.currentImg] = np.zeros((0, 6), dtype=np.float64)
+        self.refreshTreeView()
+        self.label_img.drawSamplesBox()
+        self.label_img.update()
+        self.parent.fileName.setText("%s proposals rejected" % count)
+        return True
 
     def enableOkButton(self):
         if self.image_directory and self.obj_names_path:
@@ -258,81 +703,747 @@ class MainWidget(QWidget):
             self.okButton.setEnabled(False)
         return True
 
+    def readObjData(self, obj_path):
+        """
+        Parse a label file once its pending write is done
+        """
+        self.writer.wait(obj_path)
+        return ImageWidget.readObjData(obj_path)
+
     def writeSamples(self):
+        """
+        Queue the current label file write if samples changed
+        """
+        for path, error in self.writer.takeErrors():
+            self.showPopupOk(
+                "Error!", "Could not save %s:\n%s" % (path, error)
+            )
         if not self.currentCfg:
             return True
-        groups = self.label_img.grouper.prepareSamplesToSave()
-        with open(self.currentCfg, 'r+', encoding='utf8') as file:
-            file.truncate(0)
-            groups_keys = list(groups.keys())
-            groups_keys.sort()
-            for group_idx in groups_keys:
-                samples = groups[group_idx]
-                for sample in samples:
-                    if sample.isDeleted():
-                        continue
-                    writer = csv.writer(file, delimiter=' ',
-                                        dialect='skip_space')
-                    writer.writerow(sample.getYoloFormat())
-        return True
-
-    def registerImagePath(self, imagePathButton, imagePathLabel):
+        grouper = self.label_img.grouper
+        if not grouper.isDirty():
+            return True
+        # The lines that are not boxes are written back unchanged
+        content = formatLabels(grouper.getYoloRows()).encode('utf8') + \
+            b''.join(line + b'\r\n' for line in self.label_img.unparsed_lines)
+        try:
+            self.writer.submit(self.currentCfg, content)
+        except OSError as e:
+            self.showPopupOk(
+                "Error!", "Could not save %s:\n%s" % (self.currentCfg, e)
+            )
+            return False
+        self.prefetcher.invalidateLabels(self.currentCfg)
+        if self.browser is not None:
+            self.browser.invalidate(self.currentImg)
+        self.updateStats([self.currentCfg])
+        return True
+
+    def registerImagePath(self, imagePathButton):
         imagePathButton.toggle()
         directory = str(
             QFileDialog.getExistingDirectory(self, "Select Input Directory")
         )
-        basename = os.path.basename(directory)
-        if not basename:
-            print("Input Path not selected")
+        if not os.path.basename(directory):
+            self.parent.fileName.setText("Input Path not selected")
             return -1
-        self.image_directory = basename
+        self.openDirectory(directory)
+        self.saveSession()
 
-        types = ('*.jpg', '*.png', '*.jpeg')
-        self._imgList = []
-        for t in types:
-            self._imgList.extend(glob(directory+'/'+t))
-        # Sort img List
-        self._imgList.sort()
+    def openDirectory(self, directory, images=None, image=None,
+                      image_index=0):
+        basename = os.path.basename(directory)
+        self.image_directory = basename
+        self.dataset_root = os.path.abspath(directory)
+        self.imagePathLabel.setText(basename+'/')
+        return self.scanImages(directory, images, image, image_index)
 
-        self.imgListCfg = []
+    def scanImages(self, directory, images=None, image=None, image_index=0):
+        """
+        Fill imgList / imgListCfg in background with the images
+        of directory that have a txt file, the frames of its videos
+        and the labeled images of its shards. A known image list
+        (image path, label path) is shown at once, at image (or
+        image_index), and replaced by the scanned one when done
+        """
+        self.stopScan()
+        restored = bool(images)
+        if restored:
+            self.writeSamples()
+        else:
+            # Back to the start image
+            self.image_index = 0
+            self.setNextImage(go_back=True)
         self.imgList = []
-        for img_path in self._imgList:
-            txt_path = re.sub('.png$', '.txt', img_path)
-            if os.path.exists(txt_path) and txt_path != img_path:
-                self.imgListCfg.append(txt_path)
-                self.imgList.append(img_path)
+        self.imgListCfg = []
+        self.total_imgs = 0
+        self.label_index = None
+        self.stopDuplicates()
+        self.duplicates = None
+        self.navigation_bar.setDuplicates("")
+        self.applyFilter()
+        if self.browser is not None:
+            self.browser.setImages([], [])
+        if self.history is not None:
+            self.history.close()
+        # Its journal is replayed on the first edit or undo
+        self.history = None
+        self.history_root = directory
+        if restored:
+            self.setImages(images)
+            self.showImage(self.imagePosition(image, image_index))
+        recursive = self.settings.get('scan_recursive')
+        db_path = indexPath(
+            self.settings.get('cache_dir'), directory, recursive
+        )
+
+        video_index_path = ImageWidget.video_index_path
+        shard_index_path = self.shard_index_path
+        skipped = []
+
+        def scan():
+            index = DatasetIndex(db_path)
+            try:
+                for entries in index.scan(directory, recursive=recursive):
+                    yield imagePairs(entries, video_index_path,
+                                     shard_index_path, skipped)
+            finally:
+                index.close()
+
+        self.scan_thread = TaskThread(scan, parent=self)
+        thread = self.scan_thread
+        scanned = [] if restored else None
+        if restored:
+            thread.itemReady.connect(scanned.extend)
+        else:
+            thread.itemReady.connect(self.registerScannedImages)
+        thread.taskDone.connect(
+            lambda: self.scanDone(thread, directory, scanned, skipped)
+        )
+        self.scan_thread.taskFailed.connect(
+            lambda e: self.showPopupOk("Error!", "Scan failed:\n%s" % e)
+        )
+        self.scan_thread.start()
+        return True
+
+    def scanDone(self, thread, directory, scanned=None, skipped=()):
+        """
+        Replace the restored image list with the scanned one and
+        refresh what depends on the image list. skipped: the
+        (path, error) of the videos and shards not read
+        """
+        if thread is not self.scan_thread:
+            # Stopped: closing or another directory opened
+            return False
+        if scanned is not None:
+            self.replaceImages(scanned)
+        if skipped:
+            path, error = skipped[0]
+            text = "Could not index %s: %s" % (path, error)
+            if len(skipped) > 1:
+                text += " (and %s more)" % (len(skipped) - 1)
+            self.parent.fileName.setText(text)
+        elif self.image_index < 0:
+            # The progress shows the total once an image is shown
+            self.parent.fileName.setText(
+                "%s images with text found" % self.total_imgs
+            )
+        self.updateStats()
+        return self.updateDuplicates(directory)
+
+    def setImages(self, images):
+        """
+        Replace the image list with images (image path, label path)
+        """
+        self.imgList = [img_path for img_path, _ in images]
+        self.imgListCfg = [txt_path for _, txt_path in images]
         self.total_imgs = len(self.imgList)
-        print("Total images with text found: ", str(self.total_imgs))
-        imagePathLabel.setText(basename+'/')
+        self.navigation_bar.setTotal(self.total_imgs)
+        if self.browser is not None:
+            self.browser.setImages(self.imgList, self.imgListCfg)
         self.enableOkButton()
+        return True
 
-    def registerObjNamesPath(self, objNamesPathButton, objNamesPathLabel):
+    def imagePosition(self, image, image_index):
         """
-        Read object.names and save categories
+        Position of image in the image list, image_index (kept
+        inside the list) if it is not there anymore
+        """
+        try:
+            return self.imgList.index(image)
+        except ValueError:
+            return min(max(image_index, 0), self.total_imgs - 1)
+
+    def replaceImages(self, images):
         """
+        Swap the restored image list for the scanned one, staying
+        on the current image
+        """
+        img_list = [img_path for img_path, _ in images]
+        if img_list == self.imgList:
+            return False
+        index = self.image_index
+        current = self.imgList[index] if 0 <= index < self.total_imgs \
+            else None
+        self.setImages(images)
+        self.applyFilter()
+        if current is not None and current in self.imgList:
+            self.image_index = self.imgList.index(current)
+            if self.browser is not None:
+                self.browser.setCurrentImage(self.image_index)
+            self.showProgress()
+            self.prefetchImages()
+            return True
+        # The image is gone
+        self.showImage(self.imagePosition(current, index))
+        return True
+
+    def registerScannedImages(self, images):
+        at_end = 0 <= self.total_imgs <= self.image_index
+        for img_path, txt_path in images:
+            self.imgList.append(img_path)
+            self.imgListCfg.append(txt_path)
+        self.total_imgs = len(self.imgList)
+        self.navigation_bar.setTotal(self.total_imgs)
+        if self.browser is not None:
+            self.browser.appendImages(images)
+        self.enableOkButton()
+        if at_end and images:
+            # Waiting on the end image: show the first new one
+            self.image_index -= 1
+            self.setNextImage()
+        else:
+            self.showProgress()
+        self.prefetchImages()
+
+    def recordEdit(self, kind, rows, old, new):
+        """
+        Add an edit of the box tree to the undo history
+        """
+        if not self.currentCfg:
+            return False
+        from libs.history import Command, CATEGORY
+        yolo = self.label_img.grouper.yoloColumns()[rows]
+        idx = old if kind == CATEGORY else yolo[:, 0]
+        self.undoHistory().record(
+            Command(self.currentCfg, kind, yolo[:, 1:], idx, old, new)
+        )
+        return True
+
+    def applyEdit(self, command, undo):
+        """
+        Apply a history command, opening its image first
+        """
+        if command.path != self.currentCfg:
+            try:
+                index = self.imgListCfg.index(command.path)
+            except ValueError:
+                self.showPopupOk(
+                    "Error!", "Image of %s not found" % command.path
+                )
+                return False
+            self.showImage(index)
+        from libs.history import applyCommand
+        applyCommand(self.label_img.grouper, command, undo)
+        self.refreshTreeView()
+        self.label_img.drawSamplesBox()
+        self.label_img.update()
+        return True
+
+    def undoHistory(self):
+        """
+        History of the opened dataset, its journal replayed
+        the first time it is used
+        """
+        if self.history is None:
+            from libs.history import History, historyPath
+            path = None
+            if self.history_root is not None:
+                path = historyPath(self.settings.get('cache_dir'),
+                                   self.history_root)
+            self.history = History(
+                path, limit=self.settings.get('undo_limit')
+            )
+        return self.history
+
+    def undoEdit(self):
+        return self.undoHistory().undo(self.applyEdit)
+
+    def redoEdit(self):
+        return self.undoHistory().redo(self.applyEdit)
+
+    def openBrowser(self):
+        """
+        Show the thumbnails grid of the dataset
+        """
+        if self.browser is None:
+            from libs.thumbnails import ThumbnailCache
+            from widgets.thumbnail_browser import ThumbnailBrowser
+            cache = ThumbnailCache(
+                os.path.join(self.settings.get('cache_dir'), 'thumbnails'),
+                self.settings.get('thumbnail_size'),
+            )
+            # Keep the disk cache in its budget
+            threading.Thread(
+                target=cache.prune, daemon=True,
+                args=(self.settings.get('thumbnail_disk_mb') * 1024 * 1024,),
+            ).start()
+            max_bytes = self.settings.get('thumbnail_cache_mb') * 1024 * 1024
+            self.browser = ThumbnailBrowser(
+                cache, max_bytes,
+                workers=self.settings.get('decode_threads'),
+                read_labels=lambda path: self.readObjData(path).rows,
+                parent=self,
+            )
+            self.browser.imageActivated.connect(self.showImage)
+            self.browser.setImages(self.imgList, self.imgListCfg)
+            self.browser.setCurrentImage(self.image_index)
+        self.browser.show()
+        self.browser.raise_()
+        return True
+
+    def showLatency(self):
+        """
+        Rolling latency of the page turns in the status bar,
+        every stage in its tooltip
+        """
+        values = self.profiler.percentiles('navigate')
+        if values is None:
+            return False
+        self.parent.latency.setText(
+            'p50 %.0f / p95 %.0f / p99 %.0f ms' % tuple(values)
+        )
+        self.parent.latency.setToolTip(self.profiler.summary([
+            'navigate', 'write', 'decode', 'labels', 'pixmap', 'parse',
+            'check', 'tree', 'overlay', 'prefetch decode', 'prefetch parse',
+            'first image',
+        ]))
+        return True
+
+    def profilePath(self, kind, extension):
+        name = '%s-%s%s' % (kind, time.strftime('%Y%m%d-%H%M%S'), extension)
+        return os.path.join(
+            os.path.expanduser(self.settings.get('cache_dir')), 'profiles',
+            name,
+        )
+
+    def toggleTrace(self):
+        """
+        Start recording a Chrome trace of the stages, or stop
+        and write it
+        """
+        if not self.profiler.isTracing():
+            self.profiler.startTrace()
+            self.parent.fileName.setText("Tracing...")
+            return True
+        path = self.profilePath('trace', '.json')
+        self.profiler.stopTrace(path)
+        self.parent.fileName.setText("Trace written to %s" % path)
+        return True
+
+    def toggleProfile(self):
+        """
+        Start a cProfile capture, or stop and write it
+        """
+        if not self.profiler.isProfiling():
+            self.profiler.startProfile()
+            self.parent.fileName.setText("Profiling...")
+            return True
+        path = self.profilePath('profile', '.prof')
+        self.profiler.stopProfile(path)
+        self.parent.fileName.setText("Profile written to %s" % path)
+        return True
+
+    def stopProfiling(self):
+        """
+        Write the trace / profile still recording
+        """
+        if self.profiler.isTracing():
+            self.profiler.stopTrace(self.profilePath('trace', '.json'))
+        if self.profiler.isProfiling():
+            self.profiler.stopProfile(self.profilePath('profile', '.prof'))
+        return True
+
+    def showProgress(self):
+        if self.image_index < 0:
+            self.parent.progress.setText("")
+            return True
+        text = str(self.image_index) + '/' + str(self.total_imgs)
+        positions = self.filter_positions
+        if positions is not None:
+            import numpy as np
+            position = np.searchsorted(positions, self.image_index)
+            if position < len(positions) and \
+                    positions[position] == self.image_index:
+                text += ' (%s/%s filtered)' % (position + 1, len(positions))
+            else:
+                text += ' (%s filtered)' % len(positions)
+        self.parent.progress.setText(text)
+        return True
+
+    def applyFilter(self):
+        """
+        Step through the images matching the navigation bar filter
+        """
+        import numpy as np
+        query = self.navigation_bar.query()
+        skip_duplicates = self.navigation_bar.skipDuplicates()
+        positions = None
+        if query is not None:
+            if self.label_index is None:
+                # Applied when the index is ready
+                self.filter_positions = np.zeros(0, dtype=np.int64)
+                self.navigation_bar.setMatches("Indexing labels...")
+                return self.showProgress()
+            positions = self.label_index.select(**query)
+        if skip_duplicates:
+            if self.duplicates is None:
+                # Applied when the images are hashed
+                self.filter_positions = np.zeros(0, dtype=np.int64)
+                self.navigation_bar.setMatches("Hashing images...")
+                return self.showProgress()
+            representatives = self.duplicates.representatives()
+            positions = representatives if positions is None else \
+                np.intersect1d(positions, representatives)
+        self.filter_positions = positions
+        self.navigation_bar.setMatches(
+            "" if positions is None else "%s images" % len(positions)
+        )
+        self.showProgress()
+        self.prefetchImages()
+        return True
+
+    def updateDuplicates(self, directory):
+        """
+        Hash the images of the dataset in background (only new or
+        changed ones) and cluster the near duplicates
+        """
+        from libs.duplicates import Duplicates, HashStore, hashPath
+        self.stopDuplicates()
+        images = list(self.imgList)
+        db_path = hashPath(self.settings.get('cache_dir'), directory)
+        workers = self.settings.get('stats_workers')
+        radius = self.settings.get('duplicate_distance')
+        video_index_path = ImageWidget.video_index_path
+
+        def build():
+            store = HashStore(db_path)
+            try:
+                for done, total in store.update(
+                        images, workers=workers,
+                        mp_context=spawnContext(),
+                        video_index_path=video_index_path):
+                    yield done, total
+                hashes, valid = store.hashes(images)
+            finally:
+                store.close()
+            yield Duplicates(images, hashes, valid, radius)
+
+        self.hash_thread = TaskThread(build, parent=self)
+        self.hash_thread.itemReady.connect(self.registerDuplicates)
+        self.hash_thread.taskFailed.connect(
+            lambda e: self.navigation_bar.setDuplicates(
+                "Hashing failed: %s" % e
+            )
+        )
+        self.hash_thread.start()
+        return True
+
+    def registerDuplicates(self, item):
+        if isinstance(item, tuple):
+            done, total = item
+            if total:
+                self.navigation_bar.setDuplicates(
+                    "Hashing images %s/%s" % (done, total)
+                )
+            return True
+        if item.images != self.imgList:
+            # Built before the image list changed
+            return False
+        self.duplicates = item
+        self.navigation_bar.setDuplicates(
+            "%s duplicates" % item.duplicateCount()
+        )
+        if self.navigation_bar.skipDuplicates():
+            self.applyFilter()
+        return True
+
+    def stopDuplicates(self):
+        if self.hash_thread is not None:
+            self.hash_thread.stop()
+            self.hash_thread = None
+        return True
+
+    def copyTwinLabels(self):
+        """
+        Add to the current image the boxes of its nearest
+        duplicate that has boxes
+        """
+        from libs.validation import drawableRows
+        if self.duplicates is None or \
+                not 0 <= self.image_index < self.total_imgs:
+            return False
+        for position in self.duplicates.twins(self.image_index).tolist():
+            try:
+                rows = self.readObjData(self.imgListCfg[position]).rows
+            except Exception:
+                continue
+            rows = rows[drawableRows(rows)]
+            if len(rows):
+                break
+        else:
+            self.parent.fileName.setText("No labeled duplicate found")
+            return False
+        grouper = self.label_img.grouper
+        for row in rows.tolist():
+            grouper.restoreRow(row)
+        self.refreshTreeView()
+        self.label_img.drawSamplesBox()
+        self.label_img.update()
+        self.parent.fileName.setText("%s boxes copied from %s" % (
+            len(rows), os.path.basename(self.imgList[position])
+        ))
+        return True
+
+    def stopScan(self):
+        if self.scan_thread is not None:
+            self.scan_thread.stop()
+            self.scan_thread = None
+        return True
+
+    def updateStats(self, paths=None):
+        """
+        Refresh the dataset statistics in background. Only the
+        label files changed since the last update are parsed.
+        paths=None refreshes every label file of the dataset
+        """
+        if self.stats_thread is not None:
+            self.stats_pending.append(paths)
+            return False
+        prune = paths is None
+        if prune:
+            paths = list(self.imgListCfg)
+        writer = self.writer
+        if self.stats is None:
+            from libs.stats import DatasetStats
+            self.stats = DatasetStats(self.settings.get('duplicate_iou'))
+        stats = self.stats
+        workers = self.settings.get('stats_workers')
+
+        def update():
+            # Read the files once their pending writes are done
+            if prune:
+                writer.wait()
+            else:
+                for path in paths:
+                    writer.wait(path)
+            yield from stats.update(
+                paths, prune=prune, workers=workers,
+                mp_context=spawnContext(),
+            )
+
+        self.stats_thread = TaskThread(update, parent=self)
+        self.stats_thread.itemReady.connect(self.showStats)
+        self.stats_thread.taskFailed.connect(self.stats_panel.setError)
+        self.stats_thread.finished.connect(self.statsFinished)
+        self.stats_thread.start()
+        return True
+
+    def statsFinished(self):
+        if self.sender() is not self.stats_thread:
+            # Stopped (closing): do not start another one
+            return False
+        self.stats_thread = None
+        if not self.stats_pending:
+            return self.updateLabelIndex()
+        pending = self.stats_pending
+        self.stats_pending = []
+        if None in pending:
+            return self.updateStats()
+        return self.updateStats(
+            sorted({path for paths in pending for path in paths})
+        )
+
+    def showStats(self, summary):
+        self.stats_summary = summary
+        self.stats_panel.setSummary(summary)
+        return True
+
+    def updateLabelIndex(self):
+        """
+        Rebuild the label index used to filter the navigation
+        from the dataset statistics, in background
+        """
+        if self.index_thread is not None:
+            self.index_pending = True
+            return False
+        from libs.label_index import ImageSizes, LabelIndex
+        images = list(self.imgList)
+        labels = list(self.imgListCfg)
+        if self.image_sizes is None:
+            self.image_sizes = ImageSizes(ImageWidget.imageSize)
+        stats = self.stats
+        sizes = self.image_sizes
+
+        def build():
+            yield LabelIndex.build(images, labels, stats, sizes)
+
+        self.index_thread = TaskThread(build, parent=self)
+        self.index_thread.itemReady.connect(self.registerLabelIndex)
+        self.index_thread.taskFailed.connect(
+            lambda e: self.navigation_bar.setMatches(
+                "Label index failed: %s" % e
+            )
+        )
+        self.index_thread.finished.connect(self.labelIndexFinished)
+        self.index_thread.start()
+        return True
+
+    def registerLabelIndex(self, label_index):
+        if label_index.images != self.imgList:
+            # Built before the image list changed
+            return False
+        self.label_index = label_index
+        return self.applyFilter()
+
+    def labelIndexFinished(self):
+        if self.sender() is not self.index_thread:
+            # Stopped (closing): do not start another one
+            return False
+        self.index_thread = None
+        if self.index_pending:
+            self.index_pending = False
+            return self.updateLabelIndex()
+        return True
+
+    def stopLabelIndex(self):
+        self.index_pending = False
+        if self.index_thread is not None:
+            self.index_thread.stop()
+            self.index_thread = None
+        return True
+
+    def stopStats(self):
+        self.stats_pending = []
+        if self.stats_thread is not None:
+            self.stats_thread.stop()
+            self.stats_thread = None
+        return True
+
+    def registerObjNamesPath(self, objNamesPathButton):
         objNamesPathButton.toggle()
         file_path = QFileDialog.getOpenFileName(
             self, "Select Train file", filter="*.names")[0]
-        file_name = os.path.basename(file_path)
-        if not file_name:
-            print("Obj Names file Path not selected")
+        if not os.path.basename(file_path):
+            self.parent.fileName.setText("Obj Names file Path not selected")
             return -1
-        objNamesPathLabel.setText(file_name)
+        self.loadObjNames(file_path)
+        self.saveSession()
+
+    def loadObjNames(self, file_path):
+        """
+        Read object.names and save categories
+        """
+        self.objNamesPathLabel.setText(os.path.basename(file_path))
         self.obj_names_path = file_path
 
         # Read Objects names
-        with open(file_path, 'r') as f:
-            obj_names = f.readlines()
-            self.categories = {
-                i: name.replace('\n', '')
-                for i, name in enumerate(obj_names)
-            }
+        self.categories = readObjNames(file_path)
+        self.stats_panel.setCategories(self.categories)
+        self.navigation_bar.setCategories(self.categories)
+        if self.stats_summary is not None:
+            self.stats_panel.setSummary(self.stats_summary)
         self.enableOkButton()
-        return
+        return True
+
+    def saveSession(self):
+        """
+        Remember the dataset and image opened for the next start
+        """
+        if self.dataset_root is None and self.obj_names_path is None:
+            return False
+        index = self.image_index
+        image = self.imgList[index] if 0 <= index < self.total_imgs \
+            else None
+        try:
+            saveSession(
+                sessionPath(self.settings.get('cache_dir')),
+                self.dataset_root, self.obj_names_path, image, index,
+            )
+        except OSError as e:
+            self.parent.fileName.setText(
+                "Could not save the session: %s" % e
+            )
+            return False
+        return True
+
+    def restoreSession(self):
+        """
+        Open the dataset and image of the last session. The image
+        list of the last scan is read from the dataset index and
+        shown at once, the directory is scanned again in background
+        """
+        state = loadSession(sessionPath(self.settings.get('cache_dir')))
+        if state is None:
+            return False
+        obj_names_path = state['obj_names_path']
+        if obj_names_path and os.path.isfile(obj_names_path):
+            self.loadObjNames(obj_names_path)
+        directory = state['image_directory']
+        if not directory or not os.path.isdir(directory):
+            return False
+        recursive = self.settings.get('scan_recursive')
+        index = DatasetIndex(indexPath(
+            self.settings.get('cache_dir'), directory, recursive
+        ))
+        try:
+            images = imagePairs(index.stored(directory, recursive),
+                                ImageWidget.video_index_path,
+                                self.shard_index_path)
+        finally:
+            index.close()
+        image_index = state['image_index']
+        if not isinstance(image_index, int):
+            image_index = 0
+        self.openDirectory(directory, images, state['image'], image_index)
+        if not 0 <= self.image_index < self.total_imgs:
+            return False
+        # Recorded once the image is painted
+        QTimer.singleShot(0, self.recordFirstImage)
+        return True
+
+    def recordFirstImage(self):
+        end = time.perf_counter_ns()
+        self.profiler.add('first image', STARTED, end)
+        self.showLatency()
+        self.firstImageShown.emit((end - STARTED) / 1e6)
+        return True
+
+
+def parseArgs(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="YOLO labeling tool")
+    parser.add_argument(
+        '--settings', default=SETTINGS_PATH, help="settings file (JSON)")
+    parser.add_argument(
+        '--first-image', action='store_true',
+        help="print the time to the first image of the restored session "
+             "and quit")
+    return parser.parse_known_args(argv)
 
 
 if __name__ == '__main__':
-    csv.register_dialect('skip_space', skipinitialspace=True)
-    app = QApplication(sys.argv)
-    ex = MyApp()
+    args, qt_args = parseArgs(sys.argv[1:])
+    app = QApplication(sys.argv[:1] + qt_args)
+    ex = MyApp(Settings(args.settings))
+    if args.first_image:
+        if not 0 <= ex.mainWidget.image_index < ex.mainWidget.total_imgs:
+            sys.exit("No session to restore")
+
+        def report(ms):
+            # The measurement is the output of --first-image
+            sys.stdout.write("First image: %.1f ms\n" % ms)
+            ex.close()
+
+        ex.mainWidget.firstImageShown.connect(report)
     sys.exit(app.exec_())
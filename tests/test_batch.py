@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from libs.batch import Operation, _editLines, processFile
+
+
+def test_edit_lines_keeps_the_text():
+    data = b'0 0.5 0.5 0.25 0.125\r\n  1\t0.1 0.2 0.3 0.4\r\n2 0.1 0.2 0.3 0.4'
+    new_idx = np.array([0, 11, 2])
+    kept = np.array([True, True, False])
+    assert _editLines(data, new_idx, kept) == \
+        b'0 0.5 0.5 0.25 0.125\r\n  11\t0.1 0.2 0.3 0.4\r\n'
+
+
+def test_edit_lines_last_line_without_newline():
+    data = b'0 0.5 0.5 0.25 0.125\n1 0.1 0.2 0.3 0.4'
+    assert _editLines(data, np.array([3, 4]), np.array([False, True])) == \
+        b'4 0.1 0.2 0.3 0.4'
+
+
+def test_process_file(tmp_path):
+    path = str(tmp_path / 'a.txt')
+    with open(path, 'wb') as f:
+        f.write(b'0 0.5 0.5 0.25 0.125\n1 0.1 0.2 0.3 0.4\n'
+                b'2 0.1 0.2 0.3 0.4\n')
+    result = processFile(path, Operation(remap={1: 5}, drop=[2]))
+    assert result.error is None
+    assert (result.boxes, result.removed, result.remapped) == (3, 1, 1)
+    with open(path, 'rb') as f:
+        assert f.read() == b'0 0.5 0.5 0.25 0.125\n5 0.1 0.2 0.3 0.4\n'
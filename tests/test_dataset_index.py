@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from libs.dataset_index import DatasetIndex
+
+
+def writeFile(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def scan(index, root):
+    return {
+        os.path.relpath(entry.path, root): entry
+        for entries in index.scan(root, recursive=True)
+        for entry in entries
+    }
+
+
+def test_files_edited_in_place(tmp_path):
+    root = str(tmp_path / 'data')
+    image = writeFile(os.path.join(root, 'a.jpg'), b'image')
+    label = writeFile(os.path.join(root, 'a.txt'), b'0 0.5 0.5 0.1 0.1\n')
+    writeFile(os.path.join(root, 'b.jpg'), b'image')
+    index = DatasetIndex(str(tmp_path / 'index.sqlite'))
+    entries = scan(index, root)
+    assert entries['a.jpg'].boxes == 1 and not entries['b.jpg'].has_label
+    directory_mtime = os.stat(root).st_mtime_ns
+    # Rewritten without a rename: the directory mtime is the same
+    with open(label, 'ab') as f:
+        f.write(b'1 0.2 0.2 0.1 0.1\n')
+    with open(image, 'ab') as f:
+        f.write(b'more')
+    assert os.stat(root).st_mtime_ns == directory_mtime
+    entries = scan(index, root)
+    assert entries['a.jpg'].boxes == 2
+    assert entries['a.jpg'].size == os.path.getsize(image)
+    assert entries['a.jpg'].label_size == os.path.getsize(label)
+    stored = {os.path.relpath(entry.path, root): entry
+              for entry in index.stored(root, recursive=True)}
+    assert stored['a.jpg'].boxes == 2
+    index.close()
+
+
+def test_forget_escapes_wildcards(tmp_path):
+    root = str(tmp_path / 'data')
+    # The subdirectories of similar names are matched by a LIKE
+    for name in ('a_b/sub', 'axb/sub', 'c%/sub', 'cd/sub'):
+        writeFile(os.path.join(root, name, 'img.jpg'), b'image')
+        writeFile(os.path.join(root, name, 'img.txt'), b'')
+    index = DatasetIndex(str(tmp_path / 'index.sqlite'))
+    assert len(scan(index, root)) == 4
+    index._forget(os.path.join(root, 'a_b'))
+    index._forget(os.path.join(root, 'c%'))
+    stored = index.stored(root, recursive=True)
+    assert sorted(os.path.relpath(entry.path, root)
+                  for entry in stored) == ['axb/sub/img.jpg', 'cd/sub/img.jpg']
+    index.close()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from libs.duplicates import HASH_BITS, HashIndex, hammingDistances
+
+
+def randomHashes(count, seed=0):
+    rnd = np.random.RandomState(seed)
+    return rnd.randint(0, 1 << 62, size=count, dtype=np.int64).astype(
+        np.uint64
+    ) * np.uint64(3)
+
+
+def flipBits(value, bits):
+    for bit in bits:
+        value ^= np.uint64(1) << np.uint64(bit)
+    return value
+
+
+def test_hamming_distances():
+    hashes = np.array([0, 1, 3, (1 << 64) - 1], dtype=np.uint64)
+    assert hammingDistances(hashes, 0).tolist() == [0, 1, 2, HASH_BITS]
+
+
+def test_query_matches_brute_force():
+    hashes = randomHashes(500)
+    # Near copies of the first hashes
+    hashes[-3] = flipBits(hashes[0], [1, 40])
+    hashes[-2] = flipBits(hashes[0], [5, 20, 63])
+    hashes[-1] = flipBits(hashes[1], [7])
+    index = HashIndex(hashes, 4)
+    for value in hashes[:3].tolist() + hashes[-3:].tolist():
+        positions, distances = index.query(value)
+        all_distances = hammingDistances(hashes, value)
+        expected = np.nonzero(all_distances <= 4)[0]
+        assert sorted(positions.tolist()) == expected.tolist()
+        assert distances.tolist() == sorted(all_distances[expected].tolist())
+    positions, distances = index.query(hashes[0], radius=2)
+    assert sorted(positions.tolist()) == [0, 497]
+
+
+def test_clusters():
+    hashes = randomHashes(100)
+    hashes[10] = flipBits(hashes[3], [2])
+    hashes[50] = flipBits(hashes[3], [9, 33])
+    hashes[60] = flipBits(hashes[7], [0])
+    labels = HashIndex(hashes, 3).clusters()
+    expected = np.arange(100)
+    expected[[10, 50]] = 3
+    expected[60] = 7
+    assert labels.tolist() == expected.tolist()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from PIL import Image
+
+from libs.export import COCO, PACKED, VOC, exportDataset, importLabels
+from libs.export import importedLabelPath, sameRows
+from libs.label_io import formatLabels, readLabels
+
+
+CATEGORIES = {0: 'cat', 1: 'dog'}
+ROWS = [
+    np.array([[0, 0.5, 0.5, 0.25, 0.5], [1, 0.25, 0.75, 0.125, 0.25]]),
+    np.zeros((0, 5)),
+    np.array([[1, 0.123456, 0.654321, 0.1, 0.2]]),
+]
+
+
+def makeDataset(root):
+    images = root / 'images'
+    images.mkdir()
+    pairs = []
+    for i, rows in enumerate(ROWS):
+        image_path = str(images / ('%s.png' % i))
+        Image.new('RGB', (64 + i, 48)).save(image_path)
+        label_path = importedLabelPath(str(root), 'images/%s.png' % i)
+        with open(label_path, 'w') as f:
+            f.write(formatLabels(rows))
+        pairs.append((image_path, label_path))
+    return pairs
+
+
+def exportAndImport(tmp_path, fmt, output):
+    pairs = makeDataset(tmp_path)
+    for items in exportDataset(pairs, fmt, output, str(tmp_path),
+                               CATEGORIES, workers=1):
+        assert all(item.error is None for item in items)
+    imported = {
+        relative: (rows, size)
+        for relative, rows, size in importLabels(fmt, output, CATEGORIES)
+    }
+    assert len(imported) == len(pairs)
+    for _, label_path in pairs:
+        relative = 'images/%s.png' % label_path[-5]
+        rows, size = imported[relative]
+        assert sameRows(readLabels(label_path), rows, size)
+    return imported
+
+
+def test_coco_round_trip(tmp_path):
+    exportAndImport(tmp_path, COCO, str(tmp_path / 'labels.json'))
+
+
+def test_voc_round_trip(tmp_path):
+    exportAndImport(tmp_path, VOC, str(tmp_path / 'voc'))
+
+
+def test_packed_round_trip(tmp_path):
+    imported = exportAndImport(tmp_path, PACKED, str(tmp_path / 'l.packed'))
+    assert all(size is None for _, size in imported.values())
+
+
+def test_same_rows():
+    rows = ROWS[0]
+    assert sameRows(rows, rows[::-1].copy())
+    moved = rows.copy()
+    moved[0, 1] += 0.05
+    assert not sameRows(rows, moved)
+    assert not sameRows(rows, moved, (64, 48))
+    assert sameRows(rows, moved, (64, 48), tolerance=4.0)
+    assert not sameRows(rows, rows[:1])
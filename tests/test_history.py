@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import numpy as np
+
+from libs.history import CATEGORY, DELETE, VISIBILITY, Command, History
+from libs.history import _matchRows, applyCommand
+from libs.label_io import formatLabels, parseLabels
+from libs.samples import SampleGrouper
+
+
+CATEGORIES = {0: 'cat', 1: 'dog', 2: 'bird'}
+RATIO = (640, 480)
+ROWS = np.array([
+    [0, 0.5, 0.5, 0.25, 0.25],
+    [1, 0.25, 0.75, 0.125, 0.25],
+    [0, 0.75, 0.25, 0.125, 0.125],
+])
+
+
+def loadGrouper(rows):
+    grouper = SampleGrouper(CATEGORIES)
+    grouper.addYoloRows(rows, ratio=RATIO)
+    return grouper
+
+
+def save(grouper):
+    """
+    Content of the label file and the grouper read back from it
+    """
+    content = formatLabels(grouper.getYoloRows())
+    return content, loadGrouper(parseLabels(content.encode('utf8')))
+
+
+def command(grouper, kind, rows, old, new):
+    # As main.recordEdit
+    yolo = grouper.yoloColumns()[rows]
+    idx = old if kind == CATEGORY else yolo[:, 0]
+    return Command('a.txt', kind, yolo[:, 1:], idx, old, new)
+
+
+def sortedRows(rows):
+    return rows[np.lexsort(rows.T[::-1])]
+
+
+def test_coalesce_consecutive_category_changes():
+    grouper = loadGrouper(ROWS)
+    first = command(grouper, CATEGORY, [0], [0], [1])
+    assert first.coalesce(command(grouper, CATEGORY, [0], [1], [2]))
+    assert first.old.tolist() == [0] and first.new.tolist() == [2]
+    assert first.coalesce(command(grouper, CATEGORY, [0], [2], [0]))
+    assert first.isNoop()
+
+
+def test_coalesce_needs_the_same_edit_chain():
+    grouper = loadGrouper(ROWS)
+    first = command(grouper, CATEGORY, [0], [0], [1])
+    # Other boxes, kind, file or an edit not following this one
+    assert not first.coalesce(command(grouper, CATEGORY, [2], [1], [2]))
+    assert not first.coalesce(command(grouper, CATEGORY, [0, 2], [1, 1],
+                                      [2, 2]))
+    assert not first.coalesce(command(grouper, DELETE, [0], [1], [0]))
+    assert not first.coalesce(command(grouper, CATEGORY, [0], [2], [0]))
+    other = command(grouper, CATEGORY, [0], [1], [2])
+    other.path = 'b.txt'
+    assert not first.coalesce(other)
+    assert first.new.tolist() == [1]
+
+
+def test_match_rows_of_identical_boxes():
+    grouper = loadGrouper(np.concatenate((ROWS, ROWS[:1], ROWS[:1])))
+    delete = command(grouper, DELETE, [0, 3], [0, 0], [1, 1])
+    assert _matchRows(grouper, delete, delete.old).tolist() == [0, 3]
+    grouper.sample(0).setDeleted()
+    # Deleted boxes only match deleted rows, and the other way
+    assert _matchRows(grouper, delete, [1, 1]).tolist() == [0, -1]
+    assert _matchRows(grouper, delete, [0, 0]).tolist() == [3, 4]
+
+
+def test_category_undo_redo():
+    grouper = loadGrouper(ROWS)
+    edit = command(grouper, CATEGORY, [0, 2], [0, 0], [2, 1])
+    assert applyCommand(grouper, edit) == [0, 2]
+    assert grouper.yoloColumns()[:, 0].tolist() == [2, 1, 1]
+    assert grouper.isDirty()
+    applyCommand(grouper, edit, undo=True)
+    assert grouper.yoloColumns()[:, 0].tolist() == [0, 1, 0]
+    assert not grouper.isDirty()
+    applyCommand(grouper, edit)
+    assert grouper.yoloColumns()[:, 0].tolist() == [2, 1, 1]
+
+
+def test_delete_and_visibility_undo_redo():
+    grouper = loadGrouper(ROWS)
+    delete = command(grouper, DELETE, [1], [0], [1])
+    hide = command(grouper, VISIBILITY, [0], [1], [0])
+    applyCommand(grouper, delete)
+    applyCommand(grouper, hide)
+    assert len(grouper.getYoloRows()) == 2
+    assert not grouper.sample(0).isVisible()
+    applyCommand(grouper, hide, undo=True)
+    applyCommand(grouper, delete, undo=True)
+    assert grouper.sample(0).isVisible()
+    assert not grouper.isDirty()
+    assert len(grouper.getYoloRows()) == 3
+
+
+def test_undo_redo_across_a_save():
+    grouper = loadGrouper(ROWS)
+    original, _ = save(grouper)
+    delete = command(grouper, DELETE, [1], [0], [1])
+    recategorize = command(grouper, CATEGORY, [0], [0], [2])
+    applyCommand(grouper, delete)
+    applyCommand(grouper, recategorize)
+    edited, grouper = save(grouper)
+    assert len(grouper.getYoloRows()) == 2
+    # The deleted box is no longer in the file: it comes back as new
+    applyCommand(grouper, recategorize, undo=True)
+    applyCommand(grouper, delete, undo=True)
+    assert grouper.isDirty()
+    content, grouper = save(grouper)
+    np.testing.assert_array_equal(
+        sortedRows(parseLabels(content.encode('utf8'))),
+        sortedRows(parseLabels(original.encode('utf8'))),
+    )
+    applyCommand(grouper, delete)
+    applyCommand(grouper, recategorize)
+    content, grouper = save(grouper)
+    assert content == edited
+
+
+def test_journal_replay(tmp_path):
+    path = str(tmp_path / 'history' / 'a.journal')
+    grouper = loadGrouper(ROWS)
+    history = History(path)
+    history.record(command(grouper, CATEGORY, [0], [0], [1]))
+    # Merged into the first command
+    history.record(command(grouper, CATEGORY, [0], [1], [2]))
+    history.seal()
+    history.record(command(grouper, DELETE, [1], [0], [1]))
+    history.seal()
+    history.record(command(grouper, VISIBILITY, [2], [1], [0]))
+    assert history.undo(lambda command, undo: True)
+    history.close()
+    replayed = History(path)
+    assert [c.kind for c in replayed.undo_stack] == [CATEGORY, DELETE]
+    assert replayed.undo_stack[0].new.tolist() == [2]
+    assert [c.kind for c in replayed.redo_stack] == [VISIBILITY]
+    assert replayed.redo(lambda command, undo: True)
+    assert not replayed.canRedo()
+    replayed.close()
+    # A torn last line is dropped
+    with open(path, 'a') as f:
+        f.write('["undo"')
+    assert len(History(path).undo_stack) == 3
+
+
+def test_journal_compaction(tmp_path):
+    path = str(tmp_path / 'a.journal')
+    grouper = loadGrouper(ROWS)
+    history = History(path, limit=2)
+    # Rewritten when longer than 4 * limit + 100 lines
+    for i in range(120):
+        history.seal()
+        history.record(command(grouper, CATEGORY, [0], [i % 3],
+                               [(i + 1) % 3]))
+    history.undo(lambda command, undo: True)
+    history.close()
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) < 120
+    replayed = History(path, limit=2)
+    assert [c.new.tolist() for c in replayed.undo_stack] == [[2]]
+    assert [c.new.tolist() for c in replayed.redo_stack] == [[0]]
+    with open(path) as f:
+        assert len(f.readlines()) == 3
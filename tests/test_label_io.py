@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import csv
+
+import numpy as np
+import pytest
+
+from benchmarks.bench_label_io import arrayRead, arrayWrite, csvRead
+from benchmarks.bench_label_io import csvWrite, makeLabelFile
+from libs.label_io import countLines, formatLabels, parseLabels
+from libs.label_io import readLabels, readLabelsMany
+
+
+ROWS = np.array([
+    [0, 0.5, 0.5, 0.25, 0.125],
+    [3, 0.123456, 0.654321, 0.1, 0.2],
+    [12, 0.999999, 0.0001, 0.000125, 0.999999],
+])
+
+
+def writeFile(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+def test_format_parse_round_trip():
+    data = formatLabels(ROWS).encode('utf8')
+    rows = parseLabels(data)
+    np.testing.assert_array_equal(rows, ROWS)
+    assert formatLabels(rows).encode('utf8') == data
+
+
+def test_format_matches_sample_object(tmp_path):
+    # The boxes of a file saved by the grouper (formatLabels) and
+    # as SampleObject.getYoloFormat rows with the csv writer
+    csv.register_dialect('skip_space', skipinitialspace=True)
+    path = str(tmp_path / 'labels.txt')
+    makeLabelFile(path, 500)
+    expected = csvWrite(csvRead(path))
+    assert arrayWrite(arrayRead(path)) == expected
+    with open(path, 'w') as f:
+        f.write(expected)
+    assert arrayWrite(arrayRead(path)) == csvWrite(csvRead(path))
+
+
+def test_crlf_and_lf_lines():
+    lf = b'0 0.5 0.5 0.25 0.125\n1 0.1 0.2 0.3 0.4\n'
+    crlf = lf.replace(b'\n', b'\r\n')
+    np.testing.assert_array_equal(parseLabels(lf), parseLabels(crlf))
+    assert countLines(lf) == countLines(crlf) == 2
+
+
+def test_last_line_without_newline():
+    assert len(parseLabels(b'0 0.5 0.5 0.25 0.125')) == 1
+
+
+def test_empty_file():
+    rows = parseLabels(b'')
+    assert rows.shape == (0, 5)
+    assert formatLabels(rows) == ''
+
+
+@pytest.mark.parametrize('data', [
+    b'0 0.5 0.5 0.25\n',
+    b'0 0.5 0.5 0.25 0.125 1\n',
+    b'0 0.5 0.5 0.25 0.125\n1 0.5 x 0.25 0.125\n',
+])
+def test_malformed_lines_raise(data):
+    with pytest.raises(Exception):
+        parseLabels(data, 'labels.txt')
+
+
+def test_read_many_round_trip(tmp_path):
+    first = writeFile(tmp_path / 'a.txt', formatLabels(ROWS).encode('utf8'))
+    empty = writeFile(tmp_path / 'b.txt', b'')
+    # No newline at the end: the next file must not be merged into it
+    last = writeFile(tmp_path / 'c.txt', b'1 0.1 0.2 0.3 0.4')
+    rows, offsets = readLabelsMany([first, empty, last, first])
+    assert offsets.tolist() == [0, 3, 3, 4, 7]
+    for i, path in enumerate([first, empty, last, first]):
+        part = rows[offsets[i]:offsets[i + 1]]
+        np.testing.assert_array_equal(part, readLabels(path))
+    with open(first, 'rb') as f:
+        assert formatLabels(rows[:3]).encode('utf8') == f.read()
+
+
+def test_read_many_malformed_file(tmp_path):
+    good = writeFile(tmp_path / 'a.txt', b'0 0.5 0.5 0.25 0.125\n')
+    bad = writeFile(tmp_path / 'b.txt', b'0 0.5 0.5\n')
+    with pytest.raises(Exception) as error:
+        readLabelsMany([good, bad])
+    assert bad in str(error.value)
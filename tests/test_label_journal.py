@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+
+from libs.label_journal import LabelJournal, readJournal, recoverJournals
+from libs.label_writer import LabelWriter
+
+
+def readFile(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def writeFile(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def test_recover_unapplied_writes(tmp_path):
+    journals = str(tmp_path / 'journals')
+    first = writeFile(str(tmp_path / 'a.txt'), b'old\n')
+    second = str(tmp_path / 'b.txt')
+    journal = LabelJournal.create(journals)
+    journal.write(first, b'0 0.1 0.1 0.1 0.1\n')
+    applied = journal.write(second, b'applied\n')
+    journal.write(first, b'0 0.2 0.2 0.2 0.2\n')
+    journal.applied([applied])
+    # The session ends without writing the label files
+    journal.close(remove=False)
+    recovered, errors = recoverJournals(journals)
+    assert (recovered, errors) == ([os.path.abspath(first)], [])
+    assert readFile(first) == b'0 0.2 0.2 0.2 0.2\n'
+    assert not os.path.exists(second)
+    assert os.listdir(journals) == []
+
+
+def test_recover_keeps_newer_label_files(tmp_path):
+    journals = str(tmp_path / 'journals')
+    path = str(tmp_path / 'a.txt')
+    journal = LabelJournal.create(journals)
+    journal.write(path, b'logged\n')
+    journal.close(remove=False)
+    writeFile(path, b'newer\n')
+    stamp = os.stat(path).st_mtime + 10
+    os.utime(path, (stamp, stamp))
+    assert recoverJournals(journals) == ([], [])
+    assert readFile(path) == b'newer\n'
+
+
+def test_recover_skips_running_sessions(tmp_path):
+    journals = str(tmp_path / 'journals')
+    path = str(tmp_path / 'a.txt')
+    journal = LabelJournal.create(journals)
+    journal.write(path, b'logged\n')
+    try:
+        assert recoverJournals(journals) == ([], [])
+        assert not os.path.exists(path)
+    finally:
+        journal.close()
+
+
+def test_torn_entry_ends_the_journal(tmp_path):
+    journal = LabelJournal(str(tmp_path / 'session.wal'))
+    journal.write('a.txt', b'first\n')
+    journal.close(remove=False)
+    with open(journal.path, 'a') as f:
+        f.write('["write", 2, "b.txt", "sec')
+    entries = readJournal(journal.path)
+    assert list(entries) == [os.path.abspath('a.txt')]
+    assert entries[os.path.abspath('a.txt')][0] == b'first\n'
+
+
+def test_compact_when_everything_is_applied(tmp_path):
+    journal = LabelJournal(str(tmp_path / 'session.wal'), compact_bytes=10)
+    first = journal.write('a.txt', b'a' * 100)
+    second = journal.write('b.txt', b'b' * 100)
+    journal.applied([first])
+    # An entry is pending: nothing is dropped
+    assert os.path.getsize(journal.path) > 200
+    assert not journal.compact()
+    journal.applied([second])
+    assert os.path.getsize(journal.path) == 0
+    third = journal.write('c.txt', b'c\n')
+    assert list(readJournal(journal.path).values())[0][0] == b'c\n'
+    journal.applied([third])
+    journal.close()
+    assert not os.path.exists(journal.path)
+
+
+def test_writes_during_compaction_are_kept(tmp_path, monkeypatch):
+    journal = LabelJournal(str(tmp_path / 'session.wal'), compact_bytes=0)
+    first = journal.write('a.txt', b'a\n')
+    fsync = os.fsync
+    writes = []
+
+    def slowFsync(fd):
+        # A write submitted between the check and the truncation
+        if threading.current_thread().name == 'applier' and not writes:
+            thread = threading.Thread(
+                target=lambda: writes.append(journal.write('b.txt', b'b\n'))
+            )
+            writes.append(thread)
+            thread.start()
+            thread.join(0.2)
+        return fsync(fd)
+
+    monkeypatch.setattr(os, 'fsync', slowFsync)
+    applier = threading.Thread(target=journal.applied, args=([first],),
+                               name='applier')
+    applier.start()
+    applier.join()
+    writes[0].join()
+    monkeypatch.setattr(os, 'fsync', fsync)
+    assert journal.pending() == 1
+    assert list(readJournal(journal.path)) == [os.path.abspath('b.txt')]
+    journal.close()
+
+
+def test_writer_applies_the_journal(tmp_path):
+    journal = LabelJournal(str(tmp_path / 'session.wal'), compact_bytes=0)
+    writer = LabelWriter(journal)
+    paths = [str(tmp_path / ('%s.txt' % i)) for i in range(20)]
+
+    def submit(path):
+        for i in range(50):
+            writer.submit(path, b'%d\n' % i)
+
+    threads = [threading.Thread(target=submit, args=(path,))
+               for path in paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+    for path in paths:
+        assert readFile(path) == b'49\n'
+    assert not os.path.exists(journal.path)
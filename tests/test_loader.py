@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+from libs.loader import BackgroundLoader
+
+
+def failingLoader(calls, failed):
+    def load(key):
+        calls.append(key)
+        raise IOError("Can not read %s" % key)
+
+    return BackgroundLoader(load, 1 << 20, lambda value: 1, workers=1,
+                            failed=failed)
+
+
+def loaded(loader, key, *args):
+    """
+    Value of key once its queued load is done
+    """
+    value = loader.get(key, *args)
+    if value is not None:
+        return value
+    future = loader._pending.get(key)
+    if future is not None:
+        future.result()
+    return loader.get(key, *args)
+
+
+def test_failure_is_cached():
+    calls = []
+    loader = failingLoader(calls, 'failed')
+    try:
+        assert loaded(loader, 'a', 'a') == 'failed'
+        assert loader.get('a', 'a') == 'failed'
+        assert calls == ['a']
+    finally:
+        loader.shutdown()
+
+
+def test_invalidate_loads_a_failure_again():
+    calls = []
+    loader = failingLoader(calls, 'failed')
+    try:
+        assert loaded(loader, 'a', 'a') == 'failed'
+        loader.invalidate('a')
+        assert loaded(loader, 'a', 'a') == 'failed'
+        assert calls == ['a', 'a']
+    finally:
+        loader.shutdown()
+
+
+def test_failure_without_value_is_loaded_again():
+    calls = []
+    loader = failingLoader(calls, None)
+    try:
+        assert loaded(loader, 'a', 'a') is None
+        assert loaded(loader, 'a', 'a') is None
+        assert calls == ['a', 'a']
+    finally:
+        loader.shutdown()
+
+
+def test_failure_is_ready():
+    ready = []
+    loader = BackgroundLoader(lambda: 1 / 0, 1 << 20, lambda value: 1,
+                              workers=1, on_ready=ready.append, failed=0.0)
+    try:
+        assert loaded(loader, 'a') == 0.0
+        assert ready == ['a']
+    finally:
+        loader.shutdown()
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from libs.prefetch import Prefetcher
+
+
+def test_invalidated_parse_is_dropped():
+    contents = {'a.txt': 'old'}
+    started = threading.Event()
+    release = threading.Event()
+
+    def parse(path):
+        value = contents[path]
+        started.set()
+        release.wait(5)
+        return value
+
+    prefetcher = Prefetcher(lambda path, height: path, parse, 1 << 20,
+                            lambda value: 1)
+    try:
+        prefetcher.schedule([('a.jpg', 'a.txt')], 100)
+        assert started.wait(5)
+        # The file is rewritten while the old content is parsed
+        contents['a.txt'] = 'new'
+        prefetcher.invalidateLabels('a.txt')
+        release.set()
+        assert prefetcher.labels('a.txt') == 'new'
+        prefetcher._executor.shutdown(wait=True)
+        assert prefetcher.labels('a.txt') == 'new'
+    finally:
+        release.set()
+        prefetcher.shutdown()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import cv2
+import numpy as np
+
+from libs.propagation import gridPoints, propagateBoxes, trackingImage
+
+
+def texture(width=320, height=240, seed=0):
+    rnd = np.random.RandomState(seed)
+    noise = rnd.randint(0, 256, (height // 8, width // 8)).astype(np.uint8)
+    image = cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+    return cv2.GaussianBlur(image, (5, 5), 0)
+
+
+def shifted(image, dx, dy):
+    matrix = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(image, matrix, image.shape[::-1],
+                          borderMode=cv2.BORDER_REFLECT)
+
+
+def test_tracking_image_fits_the_size():
+    image = np.zeros((1000, 2000, 3), dtype=np.uint8)
+    assert trackingImage(image, 640).shape == (320, 640)
+    assert trackingImage(image[:100, :200], 640).shape == (100, 200)
+
+
+def test_grid_points_inside_the_box():
+    points = gridPoints(np.array([[0, 0.5, 0.5, 0.5, 0.5]]), 100, 100)
+    assert points.shape == (1, 16, 2)
+    assert points.min() > 25 and points.max() < 75
+
+
+def test_boxes_follow_the_motion():
+    previous = texture()
+    current = shifted(previous, 6, -4)
+    rows = np.array([
+        [0, 0.5, 0.5, 0.25, 0.25],
+        [3, 0.3, 0.6, 0.2, 0.3],
+    ])
+    result = propagateBoxes(rows, previous, current)
+    assert result.shape == (2, 6)
+    assert result[:, 0].tolist() == [0, 3]
+    np.testing.assert_allclose(result[:, 1], rows[:, 1] + 6 / 320.0,
+                               atol=0.005)
+    np.testing.assert_allclose(result[:, 2], rows[:, 2] - 4 / 240.0,
+                               atol=0.005)
+    np.testing.assert_allclose(result[:, 3:5], rows[:, 3:5], atol=0.01)
+    assert (result[:, 5] >= 0.5).all()
+
+
+def test_no_boxes_without_texture():
+    flat = np.full((240, 320), 128, dtype=np.uint8)
+    rows = np.array([[0, 0.5, 0.5, 0.25, 0.25]])
+    assert propagateBoxes(rows, flat, flat).shape == (0, 6)
+    assert propagateBoxes(rows[:0], flat, flat).shape == (0, 6)
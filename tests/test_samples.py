@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+
+import numpy as np
+
+from benchmarks.bench_label_io import makeLabelFile
+from libs.label_io import formatLabels, readLabels
+from libs.samples import BoxStore, DELETED, SampleGrouper, SampleObject
+from libs.samples import VISIBLE
+
+
+CATEGORIES = {i: 'class_%s' % i for i in range(80)}
+RATIO = (1920, 1080)
+
+
+def objectSamples(path):
+    """
+    One SampleObject per line, as the label files were read
+    before the BoxStore
+    """
+    samples = []
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f):
+            sample = SampleObject(ratio=RATIO)
+            sample.addYoloCfg(line_number, line.split(),
+                              categories=CATEGORIES)
+            samples.append(sample)
+    return samples
+
+
+def objectWrite(samples):
+    """
+    The not deleted samples by final category with the csv writer
+    """
+    file = io.StringIO()
+    writer = csv.writer(file, delimiter=' ')
+    for sample in sorted(samples, key=lambda s: s.getFinalIdx()):
+        if not sample.isDeleted():
+            writer.writerow(sample.getYoloFormat())
+    return file.getvalue()
+
+
+def load(tmp_path, lines=300):
+    path = str(tmp_path / 'labels.txt')
+    makeLabelFile(path, lines)
+    grouper = SampleGrouper(CATEGORIES)
+    grouper.addYoloRows(readLabels(path), ratio=RATIO)
+    return grouper, objectSamples(path)
+
+
+def test_add_rows_like_samples(tmp_path):
+    grouper, samples = load(tmp_path)
+    assert len(grouper.store) == len(samples)
+    for row, sample in enumerate(samples):
+        view = grouper.sample(row)
+        assert view.getBoxFormat() == sample.getBoxFormat()
+        assert view.getYoloFormat() == sample.getYoloFormat()
+        assert view.line_number == sample.line_number
+        assert view.category_name == sample.category_name
+        assert view.isVisible() and not view.isDeleted()
+    assert formatLabels(grouper.getYoloRows()) == objectWrite(samples)
+
+
+def test_add_sample_copies_the_object(tmp_path):
+    grouper, samples = load(tmp_path, 5)
+    sample = SampleObject(ratio=RATIO)
+    sample.addBox(100.0, 200.0, 300.0, 250.0, 7, 'class_7')
+    grouper.addSample(sample)
+    samples.append(sample)
+    # The object is now a view of the grouper row
+    assert grouper.sample(5) is sample
+    sample.setCategory(3)
+    assert grouper.store.finalIdx()[5] == 3
+    assert formatLabels(grouper.getYoloRows()) == objectWrite(samples)
+
+
+def test_edits_like_samples(tmp_path):
+    grouper, samples = load(tmp_path)
+    rnd = np.random.RandomState(0)
+    for row in rnd.choice(len(samples), 60, replace=False).tolist():
+        action = row % 3
+        for sample in (grouper.sample(row), samples[row]):
+            if action == 0:
+                sample.setDeleted()
+            elif action == 1:
+                sample.setCategory((sample.idx + 1) % 80)
+            else:
+                sample.setInvisible()
+    assert formatLabels(grouper.getYoloRows()) == objectWrite(samples)
+    for row, sample in enumerate(samples):
+        view = grouper.sample(row)
+        assert view.isDeleted() == sample.isDeleted()
+        assert view.isVisible() == sample.isVisible()
+        assert view.getFinalIdx() == sample.getFinalIdx()
+        assert view.needToSave() == sample.needToSave()
+
+
+def test_flags():
+    store = BoxStore(capacity=2)
+    rows = store.appendRows(5)
+    assert len(store) == 5 and store.capacity == 8
+    assert store.hasFlag(VISIBLE).all()
+    store.setFlag([1, 3], DELETED)
+    store.setFlag([3], VISIBLE, False)
+    assert store.hasFlag(DELETED).tolist() == [0, 1, 0, 1, 0]
+    assert store.hasFlag(VISIBLE).tolist() == [1, 1, 1, 0, 1]
+    assert store.column('idx')[rows].tolist() == [-1] * 5
+
+
+def test_group_visibility(tmp_path):
+    grouper, _ = load(tmp_path, 50)
+    idx = grouper.store.column('idx')
+    grouper.setGroupVisibility(int(idx[0]), False)
+    visible = grouper.store.hasFlag(VISIBLE)
+    assert visible.tolist() == (idx != idx[0]).tolist()
+    shown = grouper.getRowsGrouped(only_visible=True)
+    assert int(idx[0]) not in shown
+    assert sum(len(rows) for rows in shown.values()) == visible.sum()
+
+
+def newSample(idx=1):
+    sample = SampleObject(ratio=RATIO)
+    sample.addBox(10.0, 20.0, 110.0, 220.0, idx, CATEGORIES[idx])
+    return sample
+
+
+def test_dirty_category_changes(tmp_path):
+    grouper, _ = load(tmp_path, 5)
+    assert not grouper.isDirty()
+    sample = grouper.sample(2)
+    sample.setCategory((sample.idx + 1) % 80)
+    assert sample.withChanges() and grouper.isDirty()
+    sample.resetCategory()
+    assert not sample.withChanges() and not grouper.isDirty()
+    # Changed back to the saved category: nothing to write
+    sample.setCategory(sample.idx)
+    assert not grouper.isDirty()
+
+
+def test_dirty_deletes(tmp_path):
+    grouper, _ = load(tmp_path, 5)
+    grouper.sample(0).setDeleted()
+    assert grouper.isDirty()
+    grouper.sample(0).setDeleted(False)
+    assert not grouper.isDirty()
+    # Visibility is not saved
+    grouper.sample(1).setInvisible()
+    assert not grouper.isDirty()
+
+
+def test_dirty_new_samples(tmp_path):
+    grouper, _ = load(tmp_path, 5)
+    sample = newSample()
+    grouper.addSample(sample)
+    assert sample.isNew() and grouper.isDirty()
+    sample.setCategory(2)
+    assert grouper.isDirty()
+    # A new sample deleted again is never written
+    sample.setDeleted()
+    assert not grouper.isDirty()
+    grouper.restoreRow([3, 0.5, 0.5, 0.1, 0.1])
+    assert grouper.isDirty()
+
+
+def test_dirty_proposals(tmp_path):
+    grouper, _ = load(tmp_path, 5)
+    rows = grouper.addProposals(np.array([[1, 0.5, 0.5, 0.1, 0.1, 0.9]]))
+    assert not grouper.isDirty()
+    grouper.acceptProposals()
+    assert grouper.isDirty()
+    grouper.store.setFlag(rows, DELETED)
+    assert not grouper.isDirty()
+    grouper.addProposals(np.array([[2, 0.2, 0.2, 0.1, 0.1, 0.9]]))
+    grouper.rejectProposals()
+    assert not grouper.isDirty()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from libs.samples import SampleGrouper
+from libs.spatial_index import GridIndex
+
+
+CATEGORIES = {0: 'cat', 1: 'dog'}
+RATIO = (1000, 800)
+
+
+def randomBoxes(count, seed=0):
+    rnd = np.random.RandomState(seed)
+    lx = rnd.uniform(0, 1000, count)
+    ly = rnd.uniform(0, 800, count)
+    rx = lx + rnd.uniform(1, 200, count) * rnd.choice([-1, 1], count)
+    ry = ly + rnd.uniform(1, 200, count) * rnd.choice([-1, 1], count)
+    return {i: box for i, box in enumerate(zip(lx, ly, rx, ry))}
+
+
+def bruteAt(boxes, x, y):
+    return sorted(
+        i for i, (lx, ly, rx, ry) in boxes.items()
+        if min(lx, rx) <= x <= max(lx, rx) and min(ly, ry) <= y <= max(ly, ry)
+    )
+
+
+def bruteIn(boxes, lx, ly, rx, ry):
+    return sorted(
+        i for i, (blx, bly, brx, bry) in boxes.items()
+        if min(blx, brx) <= rx and max(blx, brx) >= lx and
+        min(bly, bry) <= ry and max(bly, bry) >= ly
+    )
+
+
+def checkIndex(index, boxes, seed=1):
+    """
+    Candidates of random queries, filtered exactly, are the
+    boxes found by brute force
+    """
+    rnd = np.random.RandomState(seed)
+    assert len(index) == len(boxes)
+    for x, y in rnd.uniform(-50, 1050, (200, 2)).tolist():
+        found = [
+            i for i in index.candidatesAt(x, y).tolist()
+            if i in bruteAt({i: boxes[i]}, x, y)
+        ]
+        assert sorted(found) == bruteAt(boxes, x, y)
+    for lx, ly, w, h in rnd.uniform(0, 600, (100, 4)).tolist():
+        found = [
+            i for i in index.candidatesIn(lx, ly, lx + w, ly + h).tolist()
+            if i in bruteIn({i: boxes[i]}, lx, ly, lx + w, ly + h)
+        ]
+        assert sorted(found) == bruteIn(boxes, lx, ly, lx + w, ly + h)
+    # A query covering everything
+    assert index.candidatesIn(-1e4, -1e4, 1e4, 1e4).tolist() == \
+        sorted(boxes)
+
+
+def buildIndex(boxes, cell_size=None):
+    index = GridIndex()
+    ids = np.array(sorted(boxes))
+    columns = np.array([boxes[i] for i in ids.tolist()]).reshape(-1, 4)
+    index.build(ids, *columns.T, cell_size=cell_size)
+    return index
+
+
+def test_build():
+    boxes = randomBoxes(300)
+    checkIndex(buildIndex(boxes), boxes)
+    checkIndex(buildIndex(boxes, cell_size=16), boxes)
+
+
+def test_move_resize_and_remove():
+    boxes = randomBoxes(300)
+    index = buildIndex(boxes)
+    moved = randomBoxes(300, seed=2)
+    for i in range(0, 300, 3):
+        # Moved
+        lx, ly, rx, ry = moved[i]
+        boxes[i] = (lx, ly, lx + (boxes[i][2] - boxes[i][0]),
+                    ly + (boxes[i][3] - boxes[i][1]))
+        index.insert(i, *boxes[i])
+    for i in range(1, 300, 3):
+        # Resized, some to span many cells
+        lx, ly, rx, ry = boxes[i]
+        boxes[i] = (lx, ly, rx + 300 * (i % 2), ry - 5)
+        index.insert(i, *boxes[i])
+    for i in range(2, 300, 6):
+        del boxes[i]
+        assert index.remove(i)
+    assert not index.remove(2)
+    checkIndex(index, boxes)
+    for i in list(boxes):
+        index.remove(i)
+    assert len(index) == 0 and not index._cells
+
+
+def test_grouper_queries_after_changes():
+    grouper = SampleGrouper(CATEGORIES)
+    rnd = np.random.RandomState(3)
+    rows = np.column_stack((
+        rnd.randint(0, 2, 100), rnd.uniform(0.1, 0.9, (100, 2)),
+        rnd.uniform(0.01, 0.2, (100, 2)),
+    ))
+    grouper.addYoloRows(rows, ratio=RATIO)
+    grouper.rowsAt(0, 0)
+    # Resize and move some boxes of the indexed grouper
+    for row in range(0, 100, 7):
+        sample = grouper.sample(row)
+        sample.addBox(sample.lx + 40, sample.ly - 30, sample.rx + 90,
+                      sample.ry + 10, sample.idx, sample.category_name)
+        grouper.updateSample(sample)
+    grouper.sample(5).setDeleted()
+    columns = grouper.store.columns
+    boxes = {
+        row: (columns['lx'][row], columns['ly'][row],
+              columns['rx'][row], columns['ry'][row])
+        for row in range(100)
+    }
+    for x, y in rnd.uniform(0, 1000, (200, 2)).tolist():
+        expected = [row for row in bruteAt(boxes, x, y) if row != 5]
+        assert sorted(grouper.rowsAt(x, y).tolist()) == expected
+        assert sorted(grouper.rowsAt(x, y, include_deleted=True)
+                      .tolist()) == bruteAt(boxes, x, y)
+    expected = [row for row in bruteIn(boxes, 100, 100, 400, 300)
+                if row != 5]
+    assert sorted(grouper.rowsIn(100, 100, 400, 300).tolist()) == expected
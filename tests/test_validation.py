@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from libs.validation import DUPLICATE, INVALID_CLASS, MALFORMED, NO_SIZE
+from libs.validation import OUTSIDE, checkLabels, checkRows, countIssues
+from libs.validation import drawableRows, parseLabelsChecked, unparsedLines
+
+
+def kinds(issues):
+    return [(issue.line, issue.kind) for issue in issues]
+
+
+def test_valid_rows():
+    rows = [[0, 0.5, 0.5, 0.2, 0.2], [1, 0.5, 0.5, 0.2, 0.2]]
+    assert checkRows(rows, {0: 'a', 1: 'b'}) == []
+
+
+def test_row_issues():
+    rows = [
+        [0, 0.5, 0.5, 0.2, 0.2],
+        [-1, 0.5, 0.5, 0.2, 0.2],
+        [2.5, 0.5, 0.5, 0.2, 0.2],
+        [7, 0.5, 0.5, 0.2, 0.2],
+        [0, 0.5, 0.5, 0.0, 0.2],
+        [0, 0.95, 0.5, 0.2, 0.2],
+        [0, np.nan, 0.5, 0.2, 0.2],
+        [0, 0.5, 0.5, 0.2, 0.2],
+    ]
+    assert kinds(checkRows(rows, {0: 'a', 1: 'b'})) == [
+        (1, INVALID_CLASS), (2, INVALID_CLASS), (3, INVALID_CLASS),
+        (4, NO_SIZE), (5, OUTSIDE), (6, MALFORMED), (7, DUPLICATE),
+    ]
+
+
+def test_duplicates_need_the_same_class():
+    rows = [[0, 0.5, 0.5, 0.2, 0.2], [1, 0.5, 0.5, 0.2, 0.2]]
+    assert checkRows(rows) == []
+    assert kinds(checkRows(rows[:1] * 2, iou_threshold=0.5)) == [
+        (1, DUPLICATE)
+    ]
+
+
+def test_malformed_lines_keep_their_line_numbers():
+    data = b'0 0.5 0.5 0.2 0.2\n0 0.5\n\n1 x 0.5 0.2 0.2\n0 0.5 0.5 0.2 0.2\n'
+    labels = parseLabelsChecked(data)
+    assert labels.line_numbers.tolist() == [0, 4]
+    assert kinds(checkLabels(labels)) == [
+        (1, MALFORMED), (3, MALFORMED), (4, DUPLICATE)
+    ]
+
+
+def test_count_issues_per_file():
+    rows = np.array([
+        [0, 0.5, 0.5, 0.2, 0.2],
+        [0, 0.5, 0.5, 0.2, 0.2],
+        [0, 0.5, 0.5, 0.2, 0.2],
+        [-1, 0.5, 0.5, 0.2, 0.2],
+    ])
+    # Boxes of different files are never duplicates
+    offsets = np.array([0, 1, 2, 4, 4])
+    assert countIssues(rows, offsets).tolist() == [0, 0, 1, 0]
+
+
+def test_unparsed_lines():
+    data = (b'0 0.5 0.5 0.2 0.2\r\n0 0.5\r\n1 nan 0.5 0.2 0.2\r\n'
+            b'1 x 0.5 0.2 0.2')
+    labels = parseLabelsChecked(data)
+    assert unparsedLines(data, labels) == [
+        b'0 0.5', b'1 nan 0.5 0.2 0.2', b'1 x 0.5 0.2 0.2'
+    ]
+    valid = b'0 0.5 0.5 0.2 0.2\n'
+    assert unparsedLines(valid, parseLabelsChecked(valid)) == []
+
+
+def test_invalid_class_indexes_are_not_drawn():
+    data = (b'0 0.5 0.5 0.2 0.2\n-1 0.5 0.5 0.2 0.2\n'
+            b'2.5 0.5 0.5 0.2 0.2\n4294967296 0.5 0.5 0.2 0.2\n'
+            b'3 0.5 0.5 0.2 0.2\n')
+    labels = parseLabelsChecked(data)
+    assert drawableRows(labels.rows).tolist() == [
+        True, False, False, False, True
+    ]
+    assert unparsedLines(data, labels) == [
+        b'-1 0.5 0.5 0.2 0.2', b'2.5 0.5 0.5 0.2 0.2',
+        b'4294967296 0.5 0.5 0.2 0.2',
+    ]
@@ -2,6 +2,9 @@
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 
+from libs.history import CATEGORY, DELETE, VISIBILITY
+from libs.samples import VISIBLE
+
 
 class GroupDelegate(QtWidgets.QStyledItemDelegate):
 
@@ -39,57 +42,224 @@ class GroupView(QtWidgets.QTreeView):
             self.setExpanded(index, not self.isExpanded(index))
 
 
-class GroupModel(QtGui.QStandardItemModel):
+class _Group(object):
+
+    """Category row of GroupModel"""
+
+    __slots__ = ('position', 'idx', 'name', 'rows')
+
+    def __init__(self, position, idx, name, rows):
+        self.position = position
+        self.idx = idx
+        self.name = name
+        self.rows = rows
+
+
+class GroupModel(QtCore.QAbstractItemModel):
+
+    """
+    Samples of a SampleGrouper grouped by category.
+    Reads the grouper store directly: no item per sample.
+    Columns: icon, name (visible), new category, delete
+    """
+
+    COLUMNS = ["", "Name", "New Category", "Delete"]
+
+    groupVisibilityChanged = QtCore.pyqtSignal(int)
+    samplesVisibilityChanged = QtCore.pyqtSignal(list)
+    categoryError = QtCore.pyqtSignal(str)
+    # kind, rows, old values, new values (libs.history.Command)
+    samplesEdited = QtCore.pyqtSignal(str, list, list, list)
 
     def __init__(self, parent=None):
         super(GroupModel, self).__init__(parent)
-        self.setColumnCount(3)
-        self.setHorizontalHeaderLabels(["", "Name", "New Category", "Delete"])
-        for i in range(self.columnCount()):
-            self.horizontalHeaderItem(i)
         self.category_icon = QtGui.QIcon("./resources/icons/category2.png")
+        self.grouper = None
+        self._groups = []
+
+    def setGrouper(self, grouper):
+        self.beginResetModel()
+        self.grouper = grouper
+        self._groups = []
+        if grouper is not None:
+            groups = grouper.getRowsGrouped()
+            for position, (idx, rows) in enumerate(groups.items()):
+                name = grouper.categories.get(idx, str(idx))
+                self._groups.append(_Group(position, idx, name, rows))
+        self.endResetModel()
+        return True
+
+    def _sample(self, index):
+        group = index.internalPointer()
+        return self.grouper.sample(group.rows[index.row()])
+
+    # Structure
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QtCore.QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column)
+        return self.createIndex(row, column, self._groups[parent.row()])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        group = index.internalPointer()
+        if group is None:
+            return QtCore.QModelIndex()
+        return self.createIndex(group.position, 0)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if not parent.isValid():
+            return len(self._groups)
+        if parent.internalPointer() is None and parent.column() == 0:
+            return len(self._groups[parent.row()].rows)
+        return 0
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if (orientation == QtCore.Qt.Horizontal and
+                role == QtCore.Qt.DisplayRole):
+            return self.COLUMNS[section]
+        return None
+
+    # Content
+    def _groupCheckState(self, group):
+        visible = self.grouper.store.hasFlag(VISIBLE)[group.rows]
+        if visible.all():
+            return QtCore.Qt.Checked
+        if not visible.any():
+            return QtCore.Qt.Unchecked
+        return QtCore.Qt.PartiallyChecked
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        column = index.column()
+        if index.internalPointer() is None:
+            group = self._groups[index.row()]
+            if column != 1:
+                return None
+            if role == QtCore.Qt.DisplayRole:
+                return group.name + " [%s]" % str(group.idx)
+            if role == QtCore.Qt.CheckStateRole:
+                return self._groupCheckState(group)
+            return None
+        sample = self._sample(index)
+        if column == 1:
+            if role == QtCore.Qt.DisplayRole:
+                return sample.category_name + "_" + str(sample.line_number)
+            if role == QtCore.Qt.CheckStateRole:
+                return (QtCore.Qt.Checked if sample.isVisible()
+                        else QtCore.Qt.Unchecked)
+        elif column == 2:
+            if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+                new_idx = sample._new_idx
+                return "" if new_idx is None else str(new_idx)
+            if role == QtCore.Qt.DecorationRole:
+                return self.category_icon
+            if role == QtCore.Qt.ForegroundRole:
+                color = "#FF0000" if sample.withChanges() else "#000000"
+                return QtGui.QColor(color)
+        elif column == 3:
+            if role == QtCore.Qt.CheckStateRole:
+                return (QtCore.Qt.Checked if sample.isDeleted()
+                        else QtCore.Qt.Unchecked)
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        column = index.column()
+        if index.internalPointer() is None:
+            if column == 1:
+                flags |= QtCore.Qt.ItemIsUserCheckable
+            return flags
+        if column in (1, 3):
+            flags |= QtCore.Qt.ItemIsUserCheckable
+        elif column == 2:
+            flags |= QtCore.Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid():
+            return False
+        column = index.column()
+        if index.internalPointer() is None:
+            if column != 1 or role != QtCore.Qt.CheckStateRole:
+                return False
+            group = self._groups[index.row()]
+            visible = int(value) == QtCore.Qt.Checked
+            rows = [int(row) for row in group.rows]
+            old = self.grouper.store.hasFlag(VISIBLE)[rows].tolist()
+            self.grouper.setGroupVisibility(group.idx, visible)
+            self.dataChanged.emit(index, index, [role])
+            if len(group.rows):
+                self.dataChanged.emit(
+                    self.index(0, 1, index),
+                    self.index(len(group.rows) - 1, 1, index), [role]
+                )
+            self.groupVisibilityChanged.emit(group.idx)
+            self.samplesEdited.emit(
+                VISIBILITY, rows, old, [visible] * len(rows)
+            )
+            return True
+        sample = self._sample(index)
+        row = [int(index.internalPointer().rows[index.row()])]
+        if column == 1 and role == QtCore.Qt.CheckStateRole:
+            old = [sample.isVisible()]
+            if int(value) == QtCore.Qt.Checked:
+                sample.setVisible()
+            else:
+                sample.setInvisible()
+            self.dataChanged.emit(index, index, [role])
+            group = index.internalPointer()
+            group_index = self.createIndex(group.position, 1)
+            self.dataChanged.emit(group_index, group_index, [role])
+            self.samplesVisibilityChanged.emit([sample])
+            self.samplesEdited.emit(
+                VISIBILITY, row, old, [sample.isVisible()]
+            )
+            return True
+        if column == 2 and role == QtCore.Qt.EditRole:
+            old = [sample.getFinalIdx()]
+            if not self.setSampleCategory(sample, value):
+                return False
+            self.dataChanged.emit(index, index)
+            self.samplesEdited.emit(
+                CATEGORY, row, old, [sample.getFinalIdx()]
+            )
+            return True
+        if column == 3 and role == QtCore.Qt.CheckStateRole:
+            old = [sample.isDeleted()]
+            sample.setDeleted(deleted=int(value) == QtCore.Qt.Checked)
+            self.dataChanged.emit(index, index, [role])
+            self.samplesEdited.emit(DELETE, row, old, [sample.isDeleted()])
+            return True
+        return False
 
-    def add_group(self, idx, group_name):
-        item_root = QtGui.QStandardItem()
-        item_root.setEditable(False)
-        item = QtGui.QStandardItem(group_name + " [%s]" % str(idx))
-        item.setEditable(False)
-        item.setCheckable(True)
-        item.setCheckState(QtCore.Qt.CheckState(2))
-        item.setData(idx)
-        item.setData(item_root, 3)
-        ii = self.invisibleRootItem()
-        i = ii.rowCount()
-        for j, it in enumerate((item_root, item)):
-            ii.setChild(i, j, it)
-            ii.setEditable(False)
-        for j in range(self.columnCount()):
-            it = ii.child(i, j)
-            if it is None:
-                it = QtGui.QStandardItem()
-                ii.setChild(i, j, it)
-        return item_root
-
-    def append_element_to_group(self, group_item, sample):
-        j = group_item.rowCount()
-        item = QtGui.QStandardItem()
-        item.setEditable(False)
-        group_item.setChild(j, 0, item)
-        item_label = sample.category_name + "_" + str(sample.line_number)
-        item = QtGui.QStandardItem(item_label)
-        group_item.setChild(j, 1, item)
-        item.setEditable(True)
-        item.setCheckable(True)
-        item.setData(sample)
-        checked_state = 2 if sample.isVisible() else 0
-        item.setCheckState(QtCore.Qt.CheckState(checked_state))
-        item_icon = QtGui.QStandardItem()
-        item_icon.setEditable(True)
-        item_icon.setIcon(self.category_icon)
-        item_icon.setData(sample)
-        group_item.setChild(j, 2, item_icon)
-        item_rm = QtGui.QStandardItem()
-        item_rm.setEditable(True)
-        item_rm.setData(sample)
-        item_rm.setCheckable(True)
-        group_item.setChild(j, 3, item_rm)
+    def setSampleCategory(self, sample, value):
+        """
+        Validate the new category typed by the user
+        """
+        value = str(value or "").strip()
+        if not value:
+            sample.resetCategory()
+            return True
+        categories = self.grouper.categories
+        try:
+            category_index = int(value)
+        except Exception:
+            self.categoryError.emit("Category must be integer")
+            return False
+        if category_index not in categories:
+            self.categoryError.emit(
+                "Category index must be in %s. \n Categories: %s"
+                % (str(list(categories.keys())), str(categories))
+            )
+            return False
+        sample.setCategory(category_index)
+        return True
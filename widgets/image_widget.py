@@ -1,33 +1,73 @@
 # -*- coding: utf-8 -*-
 
-import csv
+import threading
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QBuffer, QIODevice, QRect, QSize, QSizeF
+from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtWidgets import QWidget
 from PyQt5.QtWidgets import QDesktopWidget, QMessageBox
 from PyQt5.QtWidgets import QHBoxLayout, QLabel
-from PyQt5.QtGui import QPixmap, QPainter, QPen, QFont, QColor
-from PyQt5.QtCore import QPoint
+from PyQt5.QtGui import QImage, QPixmap, QPainter, QPen, QFont, QColor
+from PyQt5.QtGui import QFontMetricsF, QImageIOHandler, QImageReader
+from PyQt5.QtCore import QPoint, QPointF, QRectF
+import numpy as np
 
-from libs.samples import SampleGrouper, SampleObject
+from libs.cache import LRUCache
+from libs.dataset_index import splitFramePath, splitMemberPath
+from libs.label_io import readLabelData
+from libs.profiler import Profiler
+from libs.samples import PROPOSED, SampleGrouper, VISIBLE
+from libs.tiles import pyramidLevel, visibleTiles
+from libs.validation import ParsedLabels, checkLabels, readLabelsChecked
+from libs.validation import drawableRows, unparsedLines
+
+# Pen width of the boxes
+BOX_PEN = 2
+# Label text baseline offset from the box top
+TEXT_OFFSET = 15
+# Zoom change per mouse wheel step
+ZOOM_STEP = 1.25
+# Max zoom, in screen pixels per full resolution pixel
+MAX_PIXEL_ZOOM = 4
+
+# Whole pyramid levels of the formats without region reads
+_level_images = LRUCache(2)
+_level_lock = threading.Lock()
 
 
 class ImageWidget(QWidget):
+
+    # Emitted from the tile workers
+    tileReady = pyqtSignal(object)
+    # Video index file (libs.video) of the frames, set by the app
+    video_index_path = None
+
     def __init__(self, parent):
         super(ImageWidget, self).__init__(parent)
         self.parent = parent
         self.results = []
+        # Lines of the label file that are not boxes, saved back as
+        # they are
+        self.unparsed_lines = []
         self.setMouseTracking(True)
         self.screen_height = QDesktopWidget().screenGeometry().height()
         self.last_idx = 0
+        self.image_fn = None
+        self.tiles = None
+        self.profiler = Profiler()
+        self.tileReady.connect(lambda key: self.update())
 
         self.initUI()
 
     def initUI(self):
-        self.pixmap = QPixmap('./resources/background/start.png')
+        self.pixmapOriginal = QPixmap('./resources/background/start.png')
+        self.overlay = self.newOverlay()
         self.label_img = QLabel()
         self.label_img.setObjectName("image")
-        self.pixmapOriginal = QPixmap.copy(self.pixmap)
+        self.font = QFont('mono', 10, 1)
+        self.resetZoom()
+        self.full_size = (self.pixmapOriginal.width(),
+                          self.pixmapOriginal.height())
 
         self.drawing = False
         self.lastPoint = QPoint()
@@ -35,9 +75,72 @@ class ImageWidget(QWidget):
         self.setLayout(hbox)
         # self.setFixedSize(1200,800)
 
+    def setProfiler(self, profiler):
+        """
+        Profiler timing the stages of showing an image
+        """
+        self.profiler = profiler
+        return True
+
+    def setTileLoader(self, tiles):
+        """
+        TileLoader used to show full resolution tiles when zooming
+        """
+        self.tiles = tiles
+        return True
+
     def paintEvent(self, event):
         painter = QPainter(self)
-        painter.drawPixmap(self.rect(), self.pixmap)
+        if self.zoom != 1:
+            self._paintZoomed(painter)
+            return
+        # Base image and boxes overlay, only in the damaged area
+        rect = event.rect()
+        painter.drawPixmap(rect, self.pixmapOriginal, rect)
+        painter.drawPixmap(rect, self.overlay, rect)
+
+    def _viewRect(self):
+        """
+        Visible area in display (fit to screen) coordinates
+        """
+        return QRectF(self.pan, QSizeF(self.W, self.H) / self.zoom)
+
+    def _paintZoomed(self, painter):
+        """
+        Scaled display image, full resolution tiles of the visible
+        area when available, and the visible boxes on top
+        """
+        view = self._viewRect()
+        painter.fillRect(self.rect(), Qt.black)
+        painter.drawPixmap(QRectF(self.rect()), self.pixmapOriginal, view)
+        full_scale = self.full_size[0] / self.W
+        level = pyramidLevel(self.zoom / full_scale)
+        if self.tiles is not None and 2 ** level < full_scale:
+            full_rect = (view.x() * full_scale, view.y() * full_scale,
+                         view.width() * full_scale,
+                         view.height() * full_scale)
+            keys = []
+            for tx, ty, region in visibleTiles(level, full_rect,
+                                               self.full_size):
+                keys.append((self.image_fn, level, tx, ty))
+                tile = self.tiles.tile(self.image_fn, level, tx, ty, region)
+                if tile is None or tile.isNull():
+                    # Queued, or the scaled image stays (not decoded)
+                    continue
+                x, y, w, h = [value / full_scale for value in region]
+                painter.drawImage(QRectF(
+                    (x - view.x()) * self.zoom, (y - view.y()) * self.zoom,
+                    w * self.zoom, h * self.zoom
+                ), tile)
+            self.tiles.cancelExcept(keys)
+        if getattr(self, 'grouper', None) is None:
+            return
+        rows = self.grouper.rowsIn(
+            view.left(), view.top(), view.right(), view.bottom(),
+            only_visible=True, include_deleted=True,
+        )
+        painter.setFont(self.font)
+        self._drawRows(painter, rows, view.topLeft(), self.zoom)
 
     def showPopupOk(self, title: str, content: str):
         msg = QMessageBox()
@@ -48,73 +151,379 @@ class ImageWidget(QWidget):
         if result == QMessageBox.Ok:
             msg.close()
 
-    def drawSamplesBox(self):
-        res = QPixmap.copy(self.pixmapOriginal)
-        painter = QPainter(res)
-        font = QFont('mono', 10, 1)
-        painter.setFont(font)
+    def newOverlay(self):
+        overlay = QPixmap(self.pixmapOriginal.size())
+        overlay.fill(Qt.transparent)
+        return overlay
+
+    def _boxExtents(self, rows):
+        """
+        (left, top, right, bottom) arrays of the area painted
+        by each row: box, pen and line number text
+        """
+        store = self.grouper.store
+        metrics = QFontMetricsF(self.font)
+        text_width = metrics.width(str(max(len(store) - 1, 0)))
+        margin = BOX_PEN
+        lx, ly = store.column('lx')[rows], store.column('ly')[rows]
+        rx, ry = store.column('rx')[rows], store.column('ry')[rows]
+        return (
+            np.minimum(lx, rx) - margin,
+            np.minimum(ly, ry) - margin,
+            np.maximum(np.maximum(lx, rx), lx + text_width) + margin,
+            np.maximum(np.maximum(ly, ry),
+                       ly + TEXT_OFFSET + metrics.descent()) + margin,
+        )
+
+    def _rowsRect(self, rows):
+        """
+        Overlay area painted by rows
+        """
+        if not len(rows):
+            return QRectF()
+        left, top, right, bottom = self._boxExtents(rows)
+        return QRectF(
+            QPointF(left.min(), top.min()), QPointF(right.max(), bottom.max())
+        )
+
+    def _drawRows(self, painter, rows, origin=QPointF(0, 0), zoom=1):
+        """
+        Draw rows mapping display coordinates with (p - origin) * zoom.
+        Proposals of the detector are dashed
+        """
+        store = self.grouper.store
+        idx = store.column('idx')
+        ox, oy = origin.x(), origin.y()
         # Dibujamos por grupos
-        groups = self.grouper.getSamplesGrouped(only_visible=True)
-        for gindex, samples in groups.items():
-            gcolor = self.grouper.categories_color[gindex]
-            qcolor = QColor(*gcolor)
-            for sample in samples:
-                painter.setPen(QPen(qcolor, 2, Qt.SolidLine))
-                painter.drawRect(sample.lx, sample.ly,
-                                 sample.rx - sample.lx,
-                                 sample.ry - sample.ly)
+        for gindex in np.unique(idx[rows]):
+            gcolor = self.grouper.categories_color[int(gindex)]
+            box_pen = QPen(QColor(*gcolor), BOX_PEN, Qt.SolidLine)
+            proposal_pen = QPen(QColor(*gcolor), BOX_PEN, Qt.DashLine)
+            text_pen = QPen(Qt.blue, BOX_PEN, Qt.SolidLine)
+            group_rows = rows[idx[rows] == gindex]
+            lx = ((store.column('lx')[group_rows] - ox) * zoom).tolist()
+            ly = ((store.column('ly')[group_rows] - oy) * zoom).tolist()
+            rx = ((store.column('rx')[group_rows] - ox) * zoom).tolist()
+            ry = ((store.column('ry')[group_rows] - oy) * zoom).tolist()
+            line_number = store.column('line_number')[group_rows].tolist()
+            proposed = (store.flags[group_rows] & PROPOSED).tolist()
+            for i in range(len(group_rows)):
+                painter.setPen(proposal_pen if proposed[i] else box_pen)
+                painter.drawRect(QRectF(lx[i], ly[i],
+                                        rx[i] - lx[i], ry[i] - ly[i]))
                 # Draw text
-                painter.setPen(QPen(Qt.blue, 2, Qt.SolidLine))
-                painter.drawText(sample.lx, sample.ly+15,
-                                 str(sample.line_number))
-        return res
-
-    def setPixmap(self, image_fn):
-        self.pixmap = QPixmap(image_fn)
-        self.W, self.H = self.pixmap.width(), self.pixmap.height()
-
-        if self.H > self.screen_height * 0.8:
-            resize_ratio = (self.screen_height * 0.8) / self.H
-            self.W = round(self.W * resize_ratio)
-            self.H = round(self.H * resize_ratio)
-            self.pixmap = QPixmap.scaled(self.pixmap, self.W, self.H,
-                                         transformMode=Qt.SmoothTransformation)
+                painter.setPen(text_pen)
+                painter.drawText(QPointF(lx[i], ly[i] + TEXT_OFFSET),
+                                 str(line_number[i]))
+
+    def drawSamplesBox(self):
+        """
+        Draw all the visible samples in a new overlay
+        """
+        self.overlay = self.newOverlay()
+        rows = np.nonzero(self.grouper.store.hasFlag(VISIBLE))[0]
+        painter = QPainter(self.overlay)
+        painter.setFont(self.font)
+        self._drawRows(painter, rows)
+        painter.end()
+        return self.overlay
+
+    def redrawRegion(self, rect):
+        """
+        Clear rect of the overlay and draw again the visible
+        samples that paint inside it
+        """
+        rect = rect.toAlignedRect().intersected(self.overlay.rect())
+        if rect.isEmpty():
+            return False
+        # Labels paint up to text width / offset out of their box
+        metrics = QFontMetricsF(self.font)
+        margin = metrics.width(str(len(self.grouper.store))) + TEXT_OFFSET
+        rows = self.grouper.rowsIn(
+            rect.left() - margin, rect.top() - margin,
+            rect.right() + 1 + margin, rect.bottom() + 1 + margin,
+            only_visible=True, include_deleted=True,
+        )
+        left, top, right, bottom = self._boxExtents(rows)
+        rows = rows[
+            (left <= rect.right() + 1) & (right >= rect.left()) &
+            (top <= rect.bottom() + 1) & (bottom >= rect.top())
+        ]
+        painter = QPainter(self.overlay)
+        painter.setCompositionMode(QPainter.CompositionMode_Clear)
+        painter.fillRect(rect, Qt.transparent)
+        painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+        painter.setClipRect(rect)
+        painter.setFont(self.font)
+        self._drawRows(painter, rows)
+        painter.end()
+        if self.zoom != 1:
+            self.update()
+        else:
+            self.update(rect)
+        return True
+
+    def refreshSamples(self, samples):
+        """
+        Repaint the area of samples after a visibility change
+        """
+        rows = np.array([sample._row for sample in samples], dtype=int)
+        return self.redrawRegion(self._rowsRect(rows))
+
+    def refreshGroup(self, idx):
+        """
+        Repaint the area of a category after a visibility change
+        """
+        rows = np.nonzero(self.grouper.store.column('idx') == idx)[0]
+        return self.redrawRegion(self._rowsRect(rows))
+
+    def mapToImage(self, pos):
+        """
+        Display (fit to screen) coordinates of a widget position
+        """
+        return self.pan + QPointF(pos) / self.zoom
+
+    def resetZoom(self):
+        self.zoom = 1.0
+        self.pan = QPointF(0, 0)
+        self.panning_from = None
+
+    def maxZoom(self):
+        return max(self.full_size[0] / self.W, 1) * MAX_PIXEL_ZOOM
+
+    def _clampPan(self, pan):
+        return QPointF(
+            min(max(pan.x(), 0), self.W - self.W / self.zoom),
+            min(max(pan.y(), 0), self.H - self.H / self.zoom),
+        )
+
+    def wheelEvent(self, event):
+        """
+        Zoom around the cursor
+        """
+        steps = event.angleDelta().y() / 120
+        zoom = min(max(self.zoom * ZOOM_STEP ** steps, 1), self.maxZoom())
+        anchor = self.mapToImage(event.pos())
+        self.zoom = zoom
+        self.pan = self._clampPan(anchor - QPointF(event.pos()) / zoom)
+        self.update()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MiddleButton:
+            self.panning_from = event.pos()
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.MiddleButton:
+            self.panning_from = None
+
+    def mouseMoveEvent(self, event):
+        """
+        Pan with the middle button. Show the cursor position
+        and the boxes under it
+        """
+        if self.panning_from is not None:
+            delta = QPointF(event.pos() - self.panning_from) / self.zoom
+            self.panning_from = event.pos()
+            self.pan = self._clampPan(self.pan - delta)
+            self.update()
+        point = self.mapToImage(event.pos())
+        x, y = point.x(), point.y()
+        text = '({}, {})'.format(int(x), int(y))
+        if getattr(self, 'grouper', None) is not None:
+            samples = self.grouper.samplesAt(x, y, only_visible=True)
+            names = [
+                sample.category_name + "_" + str(sample.line_number)
+                for sample in samples
+            ]
+            if names:
+                text += ' ' + ', '.join(names)
+        self.parent.cursorPos.setText(text)
+
+    def maxHeight(self):
+        return self.screen_height * 0.8
+
+    @staticmethod
+    def decodeImage(image_fn, max_height):
+        """
+        Load an image scaled to fit max_height.
+        Safe to call from worker threads (QImage, not QPixmap)
+        """
+        if splitFramePath(image_fn) is not None:
+            image = ImageWidget.decodeFrame(image_fn)
+        elif splitMemberPath(image_fn) is not None:
+            image = ImageWidget.imageReader(image_fn).read()
+        else:
+            image = QImage(image_fn)
+        W, H = image.width(), image.height()
+        if H > max_height:
+            resize_ratio = max_height / H
+            W = round(W * resize_ratio)
+            H = round(H * resize_ratio)
+            image = image.scaled(W, H, Qt.IgnoreAspectRatio,
+                                 Qt.SmoothTransformation)
+        return image
+
+    @staticmethod
+    def imageReader(image_fn):
+        """
+        QImageReader of an image file, or of the bytes of an image
+        of a shard (read in memory, nothing is extracted)
+        """
+        if splitMemberPath(image_fn) is None:
+            return QImageReader(image_fn)
+        from libs.shards import shardSource
+        buffer = QBuffer()
+        buffer.setData(shardSource().data(image_fn))
+        buffer.open(QIODevice.ReadOnly)
+        reader = QImageReader(buffer)
+        # The reader does not keep its device alive
+        reader.buffer = buffer
+        return reader
+
+    @staticmethod
+    def decodeFrame(image_fn):
+        """
+        Full size image of a video frame path.
+        Safe to call from worker threads
+        """
+        from libs.video import frameSource
+        frame = frameSource(ImageWidget.video_index_path).frame(image_fn)
+        height, width = frame.shape[:2]
+        return QImage(frame.data, width, height, frame.strides[0],
+                      QImage.Format_BGR888).copy()
+
+    @staticmethod
+    def imageSize(image_fn):
+        """
+        Image (width, height) read from the file header, None if
+        it can not be read. Safe to call from worker threads
+        """
+        if splitFramePath(image_fn) is not None:
+            from libs.video import frameSource
+            try:
+                return frameSource(ImageWidget.video_index_path) \
+                    .frameSize(image_fn)
+            except Exception:
+                return None
+        try:
+            size = ImageWidget.imageReader(image_fn).size()
+        except Exception:
+            return None
+        if not size.isValid():
+            return None
+        return (size.width(), size.height())
+
+    @staticmethod
+    def decodeTile(image_fn, level, region):
+        """
+        Decode the region (x, y, w, h) of an image at a pyramid level.
+        Formats that can (JPEG) only decode the region; the others
+        decode the whole image once per level. Safe in worker threads
+        """
+        x, y, w, h = region
+        scale = 2 ** level
+        size = QSize(max(round(w / scale), 1), max(round(h / scale), 1))
+        reader = ImageWidget.imageReader(image_fn)
+        if reader.supportsOption(QImageIOHandler.ClipRect):
+            reader.setClipRect(QRect(x, y, w, h))
+            reader.setScaledSize(size)
+            return reader.read()
+        with _level_lock:
+            image = _level_images.get((image_fn, level))
+            if image is None:
+                if splitFramePath(image_fn) is not None:
+                    image = ImageWidget.decodeFrame(image_fn)
+                else:
+                    image = reader.read()
+                if scale > 1:
+                    image = image.scaled(
+                        max(round(image.width() / scale), 1),
+                        max(round(image.height() / scale), 1),
+                        Qt.IgnoreAspectRatio, Qt.SmoothTransformation
+                    )
+                _level_images.put((image_fn, level), image)
+        return image.copy(QRect(round(x / scale), round(y / scale),
+                                size.width(), size.height()))
+
+    @staticmethod
+    def readObjData(obj_path):
+        """
+        Parse image txt into ParsedLabels, the invalid lines are
+        skipped. A missing file (frame not labeled yet) has no boxes.
+        Safe to call from worker threads
+        """
+        try:
+            return readLabelsChecked(obj_path)
+        except FileNotFoundError:
+            return ParsedLabels(np.zeros((0, 5), dtype=np.float64),
+                                np.zeros(0, dtype=np.int64))
+
+    def setPixmap(self, image_fn, image=None):
+        if image is None:
+            with self.profiler.stage('decode'):
+                image = self.decodeImage(image_fn, self.maxHeight())
+        with self.profiler.stage('pixmap'):
+            self.pixmapOriginal = QPixmap.fromImage(image)
+        self.W = self.pixmapOriginal.width()
+        self.H = self.pixmapOriginal.height()
+        self.overlay = self.newOverlay()
+        self.image_fn = image_fn
+        self.full_size = self.imageSize(image_fn) or (self.W, self.H)
+        self.resetZoom()
 
         self.parent.imageSize.setText('{}x{}'.format(self.W, self.H))
         self.setFixedSize(self.W, self.H)
-        self.pixmapOriginal = QPixmap.copy(self.pixmap)
 
-    def setObjData(self, obj_path):
+    def setObjData(self, obj_path, obj_datas=None):
         """
-        Read image txt and draw created boxes
+        Read image txt and draw created boxes.
+        obj_datas are the already parsed labels of obj_path, if any.
+        Problems of the file are reported to the main widget; boxes
+        of unknown classes are loaded with their index as name.
+        Lines that can not be drawn are kept in unparsed_lines
         """
         # Create new grouper
         main_widget = self.parent.mainWidget
         categories = main_widget.categories
         self.grouper = SampleGrouper(categories)
+        self.unparsed_lines = []
         self.resetResult()
-        main_widget.group_model.removeRows(
-            0, main_widget.group_model.rowCount()
-        )
         if not obj_path:
+            with self.profiler.stage('tree'):
+                main_widget.refreshTreeView()
+            main_widget.showIssues([])
             return False
-        with open(obj_path, 'r') as f:
-            obj_datas = csv.reader(f, delimiter=' ', dialect='skip_space')
-            for line_number, obj_data in enumerate(obj_datas):
-                if len(obj_data) != 5:
-                    raise Exception(
-                        "Invalid config file: %s \n. Line %s.\n"
-                        "Expected 5 elements: %s"
-                        % (main_widget.currentCfg, line_number, str(obj_data))
-                    )
-                sample = SampleObject(ratio=self.getRatio())
-                sample.addYoloCfg(line_number, obj_data,
-                                  categories=categories)
-                self.grouper.addSample(sample)
-                box = sample.getBoxFormat()
-                self.results.append(box)
-        main_widget.refreshTreeView()
-        self.pixmap = self.drawSamplesBox()
+        with self.profiler.stage('parse'):
+            if obj_datas is None:
+                obj_datas = self.readObjData(obj_path)
+            # Values that are not numbers and invalid class indexes
+            # can not be drawn
+            drawable = drawableRows(obj_datas.rows)
+            rows = obj_datas.rows[drawable]
+            if obj_datas.issues or not drawable.all():
+                self.unparsed_lines = unparsedLines(
+                    readLabelData(obj_path), obj_datas
+                )
+            unknown = {
+                int(idx): str(int(idx)) for idx in np.unique(rows[:, 0])
+                if not categories.get(int(idx), False)
+            }
+            self.grouper.addYoloRows(
+                rows, ratio=self.getRatio(),
+                categories={**categories, **unknown} if unknown else None,
+                line_numbers=obj_datas.line_numbers[drawable],
+            )
+            self.results = self.grouper.getBoxes()
+        with self.profiler.stage('check'):
+            issues = checkLabels(
+                obj_datas, categories,
+                main_widget.settings.get('duplicate_iou'),
+            )
+        with self.profiler.stage('tree'):
+            main_widget.refreshTreeView()
+        with self.profiler.stage('overlay'):
+            self.drawSamplesBox()
+        main_widget.showIssues(issues)
         self.update()
 
     def getRatio(self):
@@ -135,5 +544,5 @@ class ImageWidget(QWidget):
                 self.results[-1][-1] = idx
             else:
                 raise ValueError('invalid results')
-            self.pixmap = self.drawSamplesBox()
+            self.drawSamplesBox()
             self.update()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtWidgets import QWidget, QLabel, QComboBox, QSpinBox, QPushButton
+from PyQt5.QtWidgets import QCheckBox
+from PyQt5.QtWidgets import QHBoxLayout
+
+
+class NavigationBar(QWidget):
+
+    """
+    Filter of the images stepped through with Back / Next
+    and jump to an image index
+    """
+
+    filterChanged = pyqtSignal()
+    jumpRequested = pyqtSignal(int)
+    copyTwinRequested = pyqtSignal()
+    propagateChanged = pyqtSignal(bool)
+
+    def __init__(self, parent=None):
+        super(NavigationBar, self).__init__(parent)
+        self.categories = None
+        self.category = QComboBox(self)
+        self.category.addItem("All classes", None)
+        self.smaller_than = QSpinBox(self)
+        self.smaller_than.setRange(0, 100000)
+        self.smaller_than.setSpecialValueText("Any size")
+        self.smaller_than.setSuffix(" px")
+        self.smaller_than.setToolTip(
+            "Only images with a box narrower or lower than this"
+        )
+        self.with_issues = QCheckBox("With issues", self)
+        self.with_issues.setToolTip(
+            "Only images with invalid lines, boxes without area or "
+            "outside the image, duplicate boxes or unknown classes"
+        )
+        self.skip_duplicates = QCheckBox("Skip duplicates", self)
+        self.skip_duplicates.setToolTip(
+            "Only the first image of each group of near identical images"
+        )
+        self.duplicates = QLabel("", self)
+        copy_twin_button = QPushButton("Copy twin labels", self)
+        copy_twin_button.setToolTip(
+            "Add the boxes of the nearest labeled duplicate of this image"
+        )
+        self.propagate = QCheckBox("Propagate boxes", self)
+        self.propagate.setToolTip(
+            "Track the boxes of this image into the next one (Next) "
+            "and propose them there"
+        )
+        self.matches = QLabel("", self)
+        self.jump_index = QSpinBox(self)
+        self.jump_index.setRange(0, 0)
+        jump_button = QPushButton("Go to", self)
+
+        self.category.currentIndexChanged.connect(
+            lambda: self.filterChanged.emit()
+        )
+        self.smaller_than.valueChanged.connect(
+            lambda: self.filterChanged.emit()
+        )
+        self.with_issues.toggled.connect(
+            lambda: self.filterChanged.emit()
+        )
+        self.skip_duplicates.toggled.connect(
+            lambda: self.filterChanged.emit()
+        )
+        copy_twin_button.clicked.connect(
+            lambda: self.copyTwinRequested.emit()
+        )
+        self.propagate.toggled.connect(
+            lambda checked: self.propagateChanged.emit(checked)
+        )
+        jump_button.clicked.connect(
+            lambda: self.jumpRequested.emit(self.jump_index.value())
+        )
+
+        hbox = QHBoxLayout()
+        hbox.setContentsMargins(0, 0, 0, 0)
+        hbox.addWidget(QLabel("Filter:", self))
+        hbox.addWidget(self.category)
+        hbox.addWidget(QLabel("Boxes smaller than", self))
+        hbox.addWidget(self.smaller_than)
+        hbox.addWidget(self.with_issues)
+        hbox.addWidget(self.skip_duplicates)
+        hbox.addWidget(self.matches)
+        hbox.addStretch(1)
+        hbox.addWidget(self.duplicates)
+        hbox.addWidget(copy_twin_button)
+        hbox.addWidget(self.propagate)
+        hbox.addStretch(1)
+        hbox.addWidget(self.jump_index)
+        hbox.addWidget(jump_button)
+        self.setLayout(hbox)
+
+    def setCategories(self, categories):
+        self.categories = categories
+        current = self.category.currentData()
+        self.category.blockSignals(True)
+        self.category.clear()
+        self.category.addItem("All classes", None)
+        for idx in sorted(categories):
+            self.category.addItem("%s: %s" % (idx, categories[idx]), idx)
+        position = self.category.findData(current)
+        self.category.setCurrentIndex(max(position, 0))
+        self.category.blockSignals(False)
+        return True
+
+    def setTotal(self, total):
+        self.jump_index.setMaximum(max(total - 1, 0))
+        return True
+
+    def setMatches(self, text):
+        self.matches.setText(text)
+        return True
+
+    def setDuplicates(self, text):
+        self.duplicates.setText(text)
+        return True
+
+    def skipDuplicates(self):
+        return self.skip_duplicates.isChecked()
+
+    def propagateBoxes(self):
+        return self.propagate.isChecked()
+
+    def query(self):
+        """
+        LabelIndex.select arguments of the filter, None if
+        every image is shown
+        """
+        query = {}
+        idx = self.category.currentData()
+        if idx is not None:
+            query['classes'] = [idx]
+        if self.smaller_than.value():
+            query['smaller_than'] = self.smaller_than.value()
+        if self.with_issues.isChecked():
+            query['issues'] = True
+            if self.categories is not None:
+                query['known_classes'] = [
+                    i for i, name in self.categories.items() if name
+                ]
+        return query or None
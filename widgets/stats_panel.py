@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import Qt, QRectF
+from PyQt5.QtGui import QColor, QPainter
+from PyQt5.QtWidgets import QWidget, QLabel, QTableWidget, QTableWidgetItem
+from PyQt5.QtWidgets import QVBoxLayout, QHeaderView, QAbstractItemView
+
+
+class HistogramWidget(QWidget):
+
+    """
+    Bar chart of a histogram with its title
+    """
+
+    def __init__(self, title, parent=None):
+        super(HistogramWidget, self).__init__(parent)
+        self.title = title
+        self.values = []
+        self.setMinimumHeight(70)
+
+    def setValues(self, values):
+        self.values = list(values)
+        self.setToolTip(
+            "%s\n%s" % (self.title, ' '.join(str(v) for v in self.values))
+        )
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        metrics = painter.fontMetrics()
+        painter.drawText(0, metrics.ascent(), self.title)
+        top = metrics.height() + 2
+        height = self.height() - top
+        if not self.values or height <= 0:
+            return
+        peak = max(max(self.values), 1)
+        width = self.width() / len(self.values)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(70, 130, 180))
+        for i, value in enumerate(self.values):
+            bar = height * value / peak
+            painter.drawRect(QRectF(
+                i * width, top + height - bar, max(width - 1, 1), bar
+            ))
+
+
+class StatsPanel(QWidget):
+
+    """
+    Dataset statistics: totals, boxes per class and
+    box size / boxes per image distributions
+    """
+
+    COLUMNS = ["Class", "Name", "Boxes", "Images"]
+
+    def __init__(self, parent=None):
+        super(StatsPanel, self).__init__(parent)
+        self.categories = {}
+        self.totals = QLabel("No dataset", self)
+        self.totals.setWordWrap(True)
+        self.classes = QTableWidget(0, len(self.COLUMNS), self)
+        self.classes.setHorizontalHeaderLabels(self.COLUMNS)
+        self.classes.verticalHeader().setVisible(False)
+        self.classes.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.classes.horizontalHeader().setSectionResizeMode(
+            1, QHeaderView.Stretch
+        )
+        self.width_hist = HistogramWidget(
+            "Box width (0 - 1 of image width)", self)
+        self.height_hist = HistogramWidget(
+            "Box height (0 - 1 of image height)", self)
+        self.per_image = HistogramWidget("Boxes per image", self)
+
+        vbox = QVBoxLayout()
+        vbox.setContentsMargins(0, 0, 0, 0)
+        vbox.addWidget(self.totals)
+        vbox.addWidget(self.classes, 1)
+        vbox.addWidget(self.width_hist)
+        vbox.addWidget(self.height_hist)
+        vbox.addWidget(self.per_image)
+        self.setLayout(vbox)
+
+    def setCategories(self, categories):
+        self.categories = categories
+        return True
+
+    def setSummary(self, summary):
+        text = "%s images, %s boxes, %s empty" % (
+            summary.files, summary.boxes, summary.empty
+        )
+        if summary.issues:
+            text += ", %s issues in %s files" % (
+                summary.issues, summary.issue_files
+            )
+        if summary.errors:
+            text += ", %s invalid" % len(summary.errors)
+            self.totals.setToolTip('\n'.join(sorted(summary.errors)))
+        else:
+            self.totals.setToolTip("")
+        self.totals.setText(text)
+
+        idxs = sorted(
+            set(self.categories) |
+            {i for i, count in enumerate(summary.class_counts) if count}
+        )
+        self.classes.setRowCount(len(idxs))
+        for row, idx in enumerate(idxs):
+            boxes = images = 0
+            if idx < len(summary.class_counts):
+                boxes = int(summary.class_counts[idx])
+                images = int(summary.class_images[idx])
+            values = (idx, self.categories.get(idx, "?"), boxes, images)
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(str(value))
+                if column != 1:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.classes.setItem(row, column, item)
+
+        self.width_hist.setValues(summary.width_hist)
+        self.height_hist.setValues(summary.height_hist)
+        self.per_image.setValues(summary.boxes_per_image)
+        return True
+
+    def setError(self, error):
+        """
+        Show that the statistics could not be computed
+        """
+        self.totals.setText("Statistics failed")
+        self.totals.setToolTip(str(error))
+        return True
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QRectF, QSize
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtGui import QColor, QImage, QPainter, QPen
+from PyQt5.QtWidgets import QWidget, QListView, QVBoxLayout
+
+from libs.dataset_index import splitFramePath
+from libs.label_io import readLabels
+from libs.loader import BackgroundLoader
+from widgets.image_widget import ImageWidget
+
+
+def categoryColor(idx):
+    return QColor.fromHsv((idx * 47) % 360, 220, 255)
+
+
+class ThumbnailModel(QAbstractListModel):
+
+    """
+    Images of the dataset with their thumbnail as decoration.
+    Thumbnails are only requested for the items the view
+    paints, and are loaded in background
+    """
+
+    # Emitted from the loader workers
+    thumbnailReady = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super(ThumbnailModel, self).__init__(parent)
+        self.images = []
+        self.labels = []
+        self.rows = {}
+        self.loader = None
+        # Same size for every item, loaded or not
+        self.item_size = QSize()
+        self.thumbnailReady.connect(self.refreshThumbnail)
+
+    def setLoader(self, loader):
+        """
+        BackgroundLoader of the thumbnails, keyed by image path.
+        Its on_ready must be thumbnailReady.emit
+        """
+        self.loader = loader
+        return True
+
+    def setImages(self, images, labels):
+        self.beginResetModel()
+        self.images = list(images)
+        self.labels = list(labels)
+        self.rows = {path: row for row, path in enumerate(self.images)}
+        self.endResetModel()
+        return True
+
+    def appendImages(self, images):
+        if not images:
+            return True
+        first = len(self.images)
+        self.beginInsertRows(QModelIndex(), first, first + len(images) - 1)
+        for image_fn, label_fn in images:
+            self.rows[image_fn] = len(self.images)
+            self.images.append(image_fn)
+            self.labels.append(label_fn)
+        self.endInsertRows()
+        return True
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.images)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        image_fn = self.images[row]
+        if role == Qt.DisplayRole:
+            return "%s %s" % (row, os.path.basename(image_fn))
+        if role == Qt.ToolTipRole:
+            return image_fn
+        if role == Qt.SizeHintRole:
+            return self.item_size
+        if role == Qt.DecorationRole:
+            image = self.loader.get(image_fn, image_fn, self.labels[row])
+            if image is None or image.isNull():
+                return None
+            return image
+        return None
+
+    def refreshThumbnail(self, image_fn):
+        row = self.rows.get(image_fn)
+        if row is None:
+            return False
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+        return True
+
+    def invalidate(self, image_fn):
+        """
+        Draw the boxes of image_fn again (labels changed)
+        """
+        self.loader.invalidate(image_fn)
+        return self.refreshThumbnail(image_fn)
+
+
+class ThumbnailBrowser(QWidget):
+
+    """
+    Grid of the dataset thumbnails. Clicking a thumbnail
+    emits imageActivated with its image index.
+    read_labels(label_fn) -> yolo rows, called from worker threads
+    """
+
+    imageActivated = pyqtSignal(int)
+
+    def __init__(self, cache, max_bytes, workers=2, read_labels=readLabels,
+                 parent=None):
+        super(ThumbnailBrowser, self).__init__(parent, Qt.Window)
+        self.setWindowTitle('Images')
+        self.cache = cache
+        size = cache.size
+        self.model = ThumbnailModel(self)
+        self.model.setLoader(BackgroundLoader(
+            lambda image_fn, label_fn: self.decodeThumbnail(
+                image_fn, label_fn, cache, read_labels
+            ),
+            max_bytes, lambda image: image.sizeInBytes(), workers=workers,
+            on_ready=self.model.thumbnailReady.emit, name='thumbnails',
+            failed=QImage(),
+        ))
+        self.view = QListView(self)
+        self.view.setViewMode(QListView.IconMode)
+        self.view.setMovement(QListView.Static)
+        self.view.setResizeMode(QListView.Adjust)
+        self.view.setUniformItemSizes(True)
+        self.view.setIconSize(QSize(size, size))
+        self.view.setGridSize(QSize(size + 16, size + 32))
+        self.model.item_size = QSize(size + 8, size + 28)
+        self.view.setTextElideMode(Qt.ElideMiddle)
+        self.view.setModel(self.model)
+        self.view.clicked.connect(
+            lambda index: self.imageActivated.emit(index.row())
+        )
+        self.view.verticalScrollBar().valueChanged.connect(
+            lambda value: self.cancelHidden()
+        )
+
+        vbox = QVBoxLayout()
+        vbox.setContentsMargins(0, 0, 0, 0)
+        vbox.addWidget(self.view)
+        self.setLayout(vbox)
+        self.resize(4 * (size + 16) + 40, 3 * (size + 32) + 20)
+
+    @staticmethod
+    def decodeThumbnail(image_fn, label_fn, cache, read_labels=readLabels):
+        """
+        Thumbnail of image_fn with its boxes drawn. The image part
+        is read from the disk cache, or decoded at reduced size and
+        stored. Safe to call from worker threads
+        """
+        size = cache.size
+        cache_path = cache.path(image_fn)
+        image = QImage()
+        if cache_path is not None and os.path.exists(cache_path):
+            image.load(cache_path)
+        if image.isNull():
+            if splitFramePath(image_fn) is not None:
+                image = ImageWidget.decodeFrame(image_fn).scaled(
+                    size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation
+                )
+            else:
+                reader = ImageWidget.imageReader(image_fn)
+                source_size = reader.size()
+                if source_size.isValid():
+                    reader.setScaledSize(
+                        source_size.scaled(size, size, Qt.KeepAspectRatio)
+                    )
+                image = reader.read()
+            if image.isNull():
+                return image
+            if cache_path is not None:
+                cache.store(
+                    cache_path, lambda path: image.save(path, 'JPG', 85)
+                )
+        image = image.convertToFormat(QImage.Format_RGB32)
+        try:
+            rows = read_labels(label_fn) if label_fn else ()
+        except Exception:
+            rows = ()
+        W, H = image.width(), image.height()
+        painter = QPainter(image)
+        for idx, center_x, center_y, width, height in rows:
+            painter.setPen(QPen(categoryColor(int(idx)), 1))
+            painter.drawRect(QRectF(
+                (center_x - width / 2) * W, (center_y - height / 2) * H,
+                width * W, height * H,
+            ))
+        painter.end()
+        return image
+
+    def setImages(self, images, labels):
+        return self.model.setImages(images, labels)
+
+    def appendImages(self, images):
+        return self.model.appendImages(images)
+
+    def invalidate(self, image_fn):
+        return self.model.invalidate(image_fn)
+
+    def setCurrentImage(self, index):
+        if 0 <= index < self.model.rowCount():
+            model_index = self.model.index(index)
+            self.view.setCurrentIndex(model_index)
+            self.view.scrollTo(model_index)
+        return True
+
+    def cancelHidden(self):
+        """
+        Drop the queued thumbnails scrolled out of view
+        """
+        viewport = self.view.viewport().rect()
+        first = self.view.indexAt(viewport.topLeft())
+        if not first.isValid():
+            return False
+        grid = self.view.gridSize()
+        columns = max(viewport.width() // grid.width(), 1)
+        rows = viewport.height() // grid.height() + 2
+        images = self.model.images[first.row():first.row() + columns * rows]
+        self.model.loader.cancelExcept(images)
+        return True
+
+    def shutdown(self):
+        self.model.loader.shutdown()
+        return True
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+
+class TaskThread(QThread):
+
+    """
+    Run a generator function in a thread. Every yielded
+    item is delivered to the GUI thread with itemReady
+    """
+
+    itemReady = pyqtSignal(object)
+    taskDone = pyqtSignal()
+    taskFailed = pyqtSignal(object)
+
+    def __init__(self, fn, *args, parent=None, **kwargs):
+        super(TaskThread, self).__init__(parent)
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        items = self.fn(*self.args, **self.kwargs)
+        try:
+            for item in items:
+                if self.isInterruptionRequested():
+                    return
+                self.itemReady.emit(item)
+        except Exception as e:
+            self.taskFailed.emit(e)
+            return
+        finally:
+            # Run the generator cleanup in this thread when stopped
+            items.close()
+        self.taskDone.emit()
+
+    def stop(self):
+        self.requestInterruption()
+        self.wait()
+        return True